@@ -12,8 +12,20 @@ FILE_ENCODING = 'utf-8'
 
 PYASM_SUFFIX = '.pyasm'
 PYC_SUFFIX = '.pyc'
+# zipimport bundles, wheels and eggs
+ARCHIVE_SUFFIXES = ('.zip', '.whl', '.egg')
 
 PY38_VER = (3, 8, 0)
 PY39_VER = (3, 9, 0)
 
 MIN_PYC_SIZE = 50
+
+# the magic number is followed by this
+PYC_MAGIC_MARKER = b'\r\n'
+# from 3.9a0 to the final release
+PY39_MAGIC_NUMBERS = range(3420, 3426)
+# the magic numbers of PyPy are the ones below this
+PYPY_MAGIC_LIMIT = 1000
+
+# the name of stdin and stdout in the arguments
+STDIO_PATH = '-'
@@ -2,78 +2,547 @@
 CLI for pyc39to38
 """
 
-from argparse import ArgumentParser
+from argparse import (
+    ArgumentParser,
+    ArgumentTypeError,
+    Namespace
+)
+from json import dump
 from os.path import (
     isfile,
-    exists
+    isdir,
+    exists,
+    relpath
 )
-from os import (
-    stat,
-    unlink
+from os import stat
+from sys import (
+    argv,
+    stdin,
+    stdout
 )
+from contextlib import ExitStack
 from logging import (
     basicConfig,
     getLogger,
     INFO
 )
-from typing import NoReturn
+from typing import (
+    Optional,
+    NoReturn,
+    List,
+    Tuple
+)
 
 from . import (
     CLI_PROG_NAME,
     LOG_CFG,
     __version__,
     PYC_SUFFIX,
-    MIN_PYC_SIZE
+    ARCHIVE_SUFFIXES,
+    MIN_PYC_SIZE,
+    PYC_MAGIC_MARKER,
+    PY39_MAGIC_NUMBERS,
+    PYPY_MAGIC_LIMIT,
+    STDIO_PATH,
+    FILE_ENCODING
 )
-from .asm import reasm_file
-from .rules import do_39_to_38
 from .cfg import Config
 
+# the rest is imported where it's needed, importing xdis and xasm takes longer than converting a small file
+
 
-basicConfig(level=INFO, format=LOG_CFG)
 logger = getLogger(CLI_PROG_NAME)
 
 
+def setup_logging():
+    """
+    configure the logging once the arguments are parsed, --help and --version don't need it
+    """
+    basicConfig(level=INFO, format=LOG_CFG)
+
+
 def die(msg: str) -> NoReturn:
     logger.fatal(msg)
     exit(1)
 
 
-if __name__ == '__main__':
+def shard_arg(value: str) -> Tuple[int, int]:
+    """
+    parse K/N of --shard
+    """
+    try:
+        index, count = map(int, value.split('/'))
+    except ValueError:
+        raise ArgumentTypeError(f'invalid shard {value!r}, expected K/N')
+    if not 0 <= index < count:
+        raise ArgumentTypeError(f'invalid shard {value!r}, K must be from 0 to N - 1')
+    return index, count
+
+
+def check_pyc_header(path: str) -> Optional[str]:
+    """
+    check the magic number of a bytecode file, so that the wrong ones are rejected without loading xdis
+
+    PyPy has its own magic numbers, they are left to xdis
+
+    :param path: path of the bytecode file
+    :return: what's wrong with it, None if it may be 3.9 bytecode
+    """
+    try:
+        with open(path, 'rb') as fp:
+            magic = fp.read(len(PYC_MAGIC_MARKER) + 2)
+    except OSError as e:
+        return f'cannot be read ({e.strerror})'
+    if magic[2:] != PYC_MAGIC_MARKER:
+        return 'is not a bytecode file'
+    if (number := int.from_bytes(magic[:2], 'little')) >= PYPY_MAGIC_LIMIT and number not in PY39_MAGIC_NUMBERS:
+        return f'is not Python 3.9 bytecode (magic number {number})'
+    return None
+
+
+def convert_dir(args: Namespace, cfg: Config):
+    """
+    convert all bytecode files under a directory into another one
+    """
+    input_dir, output_dir = args.input_pyc, args.output_pyc
+
+    if output_dir is None:
+        die('output directory is required')
+    if exists(output_dir) and not isdir(output_dir):
+        die('output path %r is not a directory' % output_dir)
+    if args.async_io and (args.timeout is not None or args.max_rss is not None or args.chunk_size is not None):
+        die('--async-io cannot be used with --timeout, --max-rss or --chunk-size')
+    if (args.prefetch is not None and args.prefetch < 1) or (args.max_in_flight is not None and args.max_in_flight < 1):
+        die('--prefetch and --max-in-flight must be positive')
+
+    from .tree import convert_tree
+    from .rules import do_39_to_38
+
+    max_rss = args.max_rss * 1024 * 1024 if args.max_rss is not None else None
+    chunk_size = args.chunk_size * 1024 if args.chunk_size is not None else None
+    max_in_flight = args.max_in_flight * 1024 * 1024 if args.max_in_flight is not None else None
+    if convert_tree(input_dir, output_dir, cfg, do_39_to_38, args.jobs, args.force, args.incremental, args.resume,
+                    args.timeout, max_rss, chunk_size, args.dedup, args.shard, args.report,
+                    args.async_io, args.prefetch, max_in_flight):
+        logger.info('done')
+    else:
+        logger.error('conversion failed')
+
+
+def store_dir(args: Namespace, cfg: Config):
+    """
+    convert all bytecode files under a directory into a store
+    """
+    input_dir, store_path = args.input_pyc, args.store
+
+    if not isdir(input_dir):
+        die('input path %r is not a directory' % input_dir)
+    if args.output_pyc is not None:
+        die('no output path is needed with --store')
+    if isdir(store_path):
+        die('store path %r is a directory' % store_path)
+    if args.incremental or args.resume or args.dedup or args.async_io:
+        die('--store cannot be used with --incremental, --resume, --dedup or --async-io')
+
+    from .tree import convert_tree_to_store
+    from .rules import do_39_to_38
+
+    max_rss = args.max_rss * 1024 * 1024 if args.max_rss is not None else None
+    chunk_size = args.chunk_size * 1024 if args.chunk_size is not None else None
+    if convert_tree_to_store(input_dir, store_path, cfg, do_39_to_38, args.jobs, args.timeout, max_rss, chunk_size,
+                             args.shard, args.report):
+        logger.info('done')
+    else:
+        logger.error('conversion failed')
+
+
+def convert(args: Namespace, cfg: Config):
+    """
+    convert a single bytecode file, or the bytecode in a zip archive or a PyInstaller executable
+    """
+    input_pyc, output_pyc, force = args.input_pyc, args.output_pyc, args.force
+
+    if output_pyc is None:
+        die('output file is required')
+    is_archive = input_pyc.endswith(ARCHIVE_SUFFIXES)
+    if args.pyinstaller:
+        # executables can be named anything
+        pass
+    elif is_archive:
+        if not output_pyc.endswith(ARCHIVE_SUFFIXES):
+            die('output file %r does not have a zip archive extension' % output_pyc)
+    else:
+        if not input_pyc.endswith(PYC_SUFFIX):
+            die('input file %r does not have a .pyc extension' % input_pyc)
+        if not output_pyc.endswith(PYC_SUFFIX):
+            die('output file %r does not have a .pyc extension' % output_pyc)
+
+    if not isfile(input_pyc):
+        die('input path %r is not a valid file' % input_pyc)
+    if exists(output_pyc) and not force:
+        # it's replaced only once the new one is completely written
+        die('output file %r already exists' % output_pyc)
+
+    if not args.pyinstaller and not is_archive:
+        if stat(input_pyc).st_size < MIN_PYC_SIZE:
+            die('input file %r is too small to be a valid bytecode file' % input_pyc)
+        if (error := check_pyc_header(input_pyc)) is not None:
+            die('input file %r %s' % (input_pyc, error))
+
+    from .rules import do_39_to_38
+    if args.pyinstaller:
+        from .carchive import convert_carchive
+        success = convert_carchive(input_pyc, output_pyc, cfg, do_39_to_38, args.jobs)
+    elif is_archive:
+        from .archive import convert_archive
+        success = convert_archive(input_pyc, output_pyc, cfg, do_39_to_38, args.jobs)
+    else:
+        from .asm import reasm_file
+        success = reasm_file(input_pyc, output_pyc, cfg, do_39_to_38)
+
+    if success:
+        logger.info('done')
+    else:
+        logger.error('conversion failed')
+
+
+def watch_dir(args: Namespace, cfg: Config):
+    """
+    convert the bytecode files landing in a spool directory until interrupted
+    """
+    spool_dir, output_dir = args.input_pyc, args.output_pyc
+
+    if not isdir(spool_dir):
+        die('spool path %r is not a directory' % spool_dir)
+    if output_dir is None:
+        die('output directory is required')
+    if exists(output_dir) and not isdir(output_dir):
+        die('output path %r is not a directory' % output_dir)
+
+    from .watch import watch_tree
+    from .rules import do_39_to_38
+
+    logger.info(f'watching {spool_dir}, press Ctrl-C to stop')
+    stats = watch_tree(spool_dir, output_dir, cfg, do_39_to_38, args.jobs, args.report)
+    if stats.failed:
+        logger.error(f'{stats.failed} files failed to convert')
+    else:
+        logger.info('done')
+
+
+def convert_pipe(args: Namespace, cfg: Config):
+    """
+    convert a single bytecode file or a framed stream of them, - is stdin or stdout
+    """
+    input_path, output_path = args.input_pyc, args.output_pyc
+
+    if output_path is None:
+        if not args.stream:
+            die('output file is required')
+        output_path = STDIO_PATH
+    if args.pyinstaller or input_path.endswith(ARCHIVE_SUFFIXES) or output_path.endswith(ARCHIVE_SUFFIXES):
+        die('archives and executables cannot be read from stdin or written to stdout')
+    if input_path != STDIO_PATH and not isfile(input_path):
+        die('input path %r is not a valid file' % input_path)
+    if output_path != STDIO_PATH and exists(output_path) and not args.force:
+        die('output file %r already exists' % output_path)
+
+    from .archive import convert_member
+    from .stream import convert_stream
+    from .rules import do_39_to_38
+    from .utils import atomic_open
+
+    with ExitStack() as stack:
+        input_fp = stdin.buffer if input_path == STDIO_PATH else stack.enter_context(open(input_path, 'rb'))
+        if args.stream:
+            output_fp = stdout.buffer if output_path == STDIO_PATH else stack.enter_context(atomic_open(output_path))
+            success = convert_stream(input_fp, output_fp, cfg, do_39_to_38, args.jobs)
+        elif (new_data := convert_member(('<stdin>' if input_path == STDIO_PATH else input_path, input_fp.read()),
+                                         cfg, do_39_to_38)) is None:
+            success = False
+        else:
+            output_fp = stdout.buffer if output_path == STDIO_PATH else stack.enter_context(atomic_open(output_path))
+            output_fp.write(new_data)
+            output_fp.flush()
+            success = True
+
+    if success:
+        logger.info('done')
+    else:
+        logger.error('conversion failed')
+
+
+def decompile(args: Namespace, cfg: Config):
+    """
+    convert a bytecode file or a directory tree of them and decompile them in the same process
+    """
+    input_path, output_path = args.input_pyc, args.output_pyc
+
+    if output_path is None:
+        die('output file or directory is required')
+    if not exists(input_path):
+        die('input path %r does not exist' % input_path)
+
+    from .decompile import (
+        load_decompiler,
+        decompile_files,
+        decompile_tree,
+        log_timings,
+        DECOMPILERS
+    )
+    from .analyze import to_json_line
+    from .rules import do_39_to_38
+
+    if load_decompiler(args.decompiler) is None:
+        die('%s is not installed' % (args.decompiler or ' or '.join(DECOMPILERS)))
+    if isdir(input_path):
+        if exists(output_path) and not isdir(output_path):
+            die('output path %r is not a directory' % output_path)
+        items = decompile_tree(input_path, output_path)
+    else:
+        if exists(output_path) and not args.force:
+            die('output file %r already exists' % output_path)
+        items = [(input_path, output_path)]
+
+    reports = []
+    report_fp = open(args.report, 'w', encoding=FILE_ENCODING) if args.report else None
+    try:
+        for report in decompile_files(items, cfg, do_39_to_38, args.decompiler, args.jobs):
+            reports.append(report)
+            if not report['ok']:
+                logger.error(f'failed to decompile {report["path"]}: {report["error"]}')
+            if report_fp is not None:
+                report_fp.write(to_json_line(report))
+    finally:
+        if report_fp is not None:
+            report_fp.close()
+
+    log_timings(reports)
+    if all(report['ok'] for report in reports):
+        logger.info('done')
+    else:
+        logger.error(f'{sum(1 for report in reports if not report["ok"])} files failed')
+
+
+def analyze(args: Namespace, cfg: Config):
+    """
+    analyze a bytecode file or a directory tree of them without writing any bytecode
+    """
+    if args.output_pyc is not None:
+        die('no output file is written in analysis mode')
+    if not exists(args.input_pyc):
+        die('input path %r does not exist' % args.input_pyc)
+
+    from .batch import (
+        find_pycs,
+        in_shard
+    )
+    from .analyze import (
+        analyze_files,
+        summarize,
+        log_summary,
+        to_json_line
+    )
+    from .rules import do_39_to_38
+
+    paths = find_pycs(args.input_pyc)
+    if args.shard is not None:
+        paths = [path for path in paths if in_shard(relpath(path, args.input_pyc), args.shard)]
+    reports = []
+    report_fp = open(args.report, 'w', encoding=FILE_ENCODING) if args.report else None
+    try:
+        for report in analyze_files(paths, cfg, do_39_to_38, args.jobs):
+            if args.shard is not None:
+                report['shard'] = f'{args.shard[0]}/{args.shard[1]}'
+            reports.append(report)
+            if report_fp is not None:
+                report_fp.write(to_json_line(report))
+    finally:
+        if report_fp is not None:
+            report_fp.close()
+
+    summary = summarize(reports, args.top)
+    log_summary(summary)
+    if args.summary:
+        with open(args.summary, 'w', encoding=FILE_ENCODING) as fp:
+            dump(summary, fp, indent=2)
+
+
+def merge_reports_main(merge_argv: List[str]):
+    """
+    combine the reports of sharded runs into one summary
+    """
+    parser = ArgumentParser(prog=f'{CLI_PROG_NAME} merge-reports',
+                            description='Merge the reports of sharded runs into one summary')
+    parser.add_argument('reports', type=str, nargs='+', help='JSONL reports written with --report')
+    parser.add_argument('--summary', type=str, help='write the summary to this JSON file')
+    parser.add_argument('--top', type=int, default=10, help='how many of the slowest files to list (default: 10)')
+    merge_args = parser.parse_args(merge_argv)
+    setup_logging()
+
+    from .report import (
+        load_reports,
+        merge_reports,
+        log_merged
+    )
+
+    for path in merge_args.reports:
+        if not isfile(path):
+            die('report %r is not a valid file' % path)
+    summary = merge_reports(load_reports(merge_args.reports), merge_args.top)
+    log_merged(summary)
+    if merge_args.summary:
+        with open(merge_args.summary, 'w', encoding=FILE_ENCODING) as fp:
+            dump(summary, fp, indent=2)
+
+
+def export_main(export_argv: List[str]):
+    """
+    write the files of a store back to a directory tree
+    """
+    parser = ArgumentParser(prog=f'{CLI_PROG_NAME} export',
+                            description='Write the converted files in a store back to a directory tree')
+    parser.add_argument('store', type=str, help='store written with --store')
+    parser.add_argument('output_dir', type=str, help='output directory')
+    parser.add_argument('--select', type=str, action='append', default=None, metavar='PATTERN',
+                        help='only export the files whose relative path matches this glob pattern, can be repeated')
+    parser.add_argument('-f', '--force', action='store_true', help='overwrite the existing output files')
+    export_args = parser.parse_args(export_argv)
+    setup_logging()
+
+    if not isfile(export_args.store):
+        die('store %r is not a valid file' % export_args.store)
+    if exists(export_args.output_dir) and not isdir(export_args.output_dir):
+        die('output path %r is not a directory' % export_args.output_dir)
+
+    from .store import export_store
+
+    exported, failed = export_store(export_args.store, export_args.output_dir, export_args.select, export_args.force)
+    logger.info(f'{exported} files exported, {failed} failed')
+    if failed:
+        die(f'{failed} files failed to export')
+
+
+if __name__ == '__main__' and argv[1:2] == ['merge-reports']:
+    merge_reports_main(argv[2:])
+elif __name__ == '__main__' and argv[1:2] == ['export']:
+    export_main(argv[2:])
+elif __name__ == '__main__':
     parser = ArgumentParser(prog=CLI_PROG_NAME,
                             description='Convert Python 3.9 bytecode file to 3.8')
-    parser.add_argument('input_pyc', type=str, help='input bytecode file')
-    parser.add_argument('output_pyc', type=str, help='output bytecode file')
+    parser.add_argument('input_pyc', type=str, help='input bytecode file, zip archive or directory, - for stdin')
+    parser.add_argument('output_pyc', type=str, nargs='?',
+                        help='output bytecode file, zip archive or directory, - for stdout')
     parser.add_argument('-f', '--force', action='store_true', help='overwrite the existing output file')
     parser.add_argument('-V', '--version', action='version', version=__version__)
+    parser.add_argument('--incremental', action='store_true',
+                        help='for directories, keep a manifest in the output directory and only convert '
+                             'the files changed since the last run')
+    parser.add_argument('--resume', action='store_true',
+                        help='for directories, skip the files finished by the last (killed) run')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='for directories, kill the worker converting a file for longer than this many seconds')
+    parser.add_argument('--max-rss', type=int, default=None,
+                        help='for directories, kill the worker converting a file using more memory than this many MiB')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='for directories, send the files smaller than this many KiB to the workers '
+                             'in chunks of about this size')
+    parser.add_argument('--async-io', action='store_true',
+                        help='for directories, read and write the files with an asyncio front end, '
+                             'overlapping with the conversion in the workers (for slow filesystems)')
+    parser.add_argument('--prefetch', type=int, default=None,
+                        help='with --async-io, how many files can be read, converted or written at the same time '
+                             '(default: 4 per worker)')
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help='with --async-io, how many MiB of input files can be held in memory at the same time '
+                             '(default: 256)')
+    parser.add_argument('--dedup', action='store_true',
+                        help='for directories, convert the files with the same content only once '
+                             'and hardlink the output to the others')
+    parser.add_argument('--store', type=str, default=None, metavar='DB',
+                        help='for directories, write the converted files with their stats into this SQLite '
+                             'database instead of an output directory, see the export subcommand')
+    parser.add_argument('--shard', type=shard_arg, default=None, metavar='K/N',
+                        help='for directories, only process the K-th (from 0) of N parts of the tree, '
+                             'split by a hash of the paths')
+    parser.add_argument('--report', type=str,
+                        help='for directories, the watch mode, the decompile mode and the analysis mode, '
+                             'write the report of each file to this JSONL file')
+    parser.add_argument('--watch', action='store_true',
+                        help='the input is a spool directory, convert the bytecode files landing in it '
+                             'once they are fully written, until interrupted')
+    parser.add_argument('--decompile', action='store_true',
+                        help='decompile the converted code objects in the same process and write .py files, '
+                             'no 3.8 bytecode is written')
+    parser.add_argument('--decompiler', type=str, choices=('decompyle3', 'uncompyle6'), default=None,
+                        help='the decompiler for --decompile (default: the first one installed of them)')
+    parser.add_argument('--stream', action='store_true',
+                        help='the input is a stream of length-prefixed (name, bytecode) frames, '
+                             'write the converted ones to the output (default: stdout) in the same order')
+    parser.add_argument('--pyinstaller', action='store_true',
+                        help='the input is a PyInstaller executable, convert the bytecode in it')
     parser.add_argument('--preserve-lineno-after-extarg', action='store_true',
                         help='preserve the state that the lineno is sometimes after EXTENDED_ARG')
     parser.add_argument('--no-begin-finally', action='store_true',
                         help='do not replace <finally block 1> and JUMP_FORWARD with BEGIN_FINALLY')
+    parser.add_argument('--degrade', action='store_true',
+                        help='retry a code object failing to convert with fewer rules instead of failing the file, '
+                             'the degraded ones are logged and listed in the report')
+    parser.add_argument('--only', type=str, action='append', default=None, metavar='QUALNAME_GLOB',
+                        help='only convert the code objects whose qualified names match this glob (can be repeated), '
+                             'with the ones defined in them and the ones they are defined in, '
+                             'the rest do nothing but return None')
+    parser.add_argument('--optimize', action='store_true',
+                        help='thread the jump chains and drop the jumps to the next instruction after the rules, '
+                             'the bytes saved are reported for each file')
+    parser.add_argument('--low-memory', action='store_true',
+                        help='convert the code objects in place and release them once done, for huge files')
+    parser.add_argument('--verify', action='store_true',
+                        help='check the stack depth and jumps of the converted code before writing it')
+    parser.add_argument('--peak-memory', action='store_true',
+                        help='report the peak memory usage of the main process and of the largest worker when done')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes for directories, archives and executables '
+                             '(default: number of CPUs)')
+    analysis = parser.add_argument_group('analysis mode')
+    analysis.add_argument('--analyze', action='store_true',
+                          help='only run the rules and report how they apply, no bytecode is written')
+    analysis.add_argument('--summary', type=str, help='write the summary to this JSON file')
+    analysis.add_argument('--top', type=int, default=10,
+                          help='how many of the slowest files and the largest code objects to list (default: 10)')
     args = parser.parse_args()
-    input_pyc, output_pyc, force = args.input_pyc, args.output_pyc, args.force
-
-    if not input_pyc.endswith(PYC_SUFFIX):
-        die('input file %r does not have a .pyc extension' % input_pyc)
-    if not output_pyc.endswith(PYC_SUFFIX):
-        die('output file %r does not have a .pyc extension' % output_pyc)
-
-    if not isfile(input_pyc):
-        die('input path %r is not a valid file' % input_pyc)
-    if exists(output_pyc):
-        if force:
-            unlink(output_pyc)
-        else:
-            die('output file %r already exists' % output_pyc)
-
-    if stat(input_pyc).st_size < MIN_PYC_SIZE:
-        die('input file %r is too small to be a valid bytecode file' % input_pyc)
+    setup_logging()
 
     cfg = Config()
     cfg.preserve_lineno_after_extarg = args.preserve_lineno_after_extarg
     cfg.no_begin_finally = args.no_begin_finally
+    cfg.degrade = args.degrade
+    cfg.only = args.only
+    cfg.low_memory = args.low_memory
+    cfg.verify = args.verify
+    cfg.optimize = args.optimize
 
-    if reasm_file(input_pyc, output_pyc, cfg, do_39_to_38):
-        logger.info('done')
+    if args.analyze:
+        analyze(args, cfg)
+    elif args.decompile:
+        decompile(args, cfg)
+    elif args.watch:
+        watch_dir(args, cfg)
+    elif args.stream or STDIO_PATH in (args.input_pyc, args.output_pyc):
+        convert_pipe(args, cfg)
+    elif args.store is not None:
+        store_dir(args, cfg)
+    elif isdir(args.input_pyc):
+        convert_dir(args, cfg)
     else:
-        logger.error('conversion failed')
+        convert(args, cfg)
+
+    if args.peak_memory:
+        from .utils import get_peak_memory
+        if (peak_memory := get_peak_memory()) is None:
+            logger.warning('peak memory usage is not available on this platform')
+        else:
+            logger.info('peak memory usage: %.1f MiB in the main process' % (peak_memory / 1024 / 1024))
+            # the workers of the batch modes
+            if peak_worker_memory := get_peak_memory(True):
+                logger.info('peak memory usage: %.1f MiB in the largest worker' % (peak_worker_memory / 1024 / 1024))
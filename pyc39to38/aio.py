@@ -0,0 +1,224 @@
+"""
+batch processing with the reading and the writing done by an asyncio front end,
+so that they overlap with the conversion in the worker processes (for slow, e.g. network, filesystems)
+"""
+
+from asyncio import (
+    AbstractEventLoop,
+    Condition,
+    Semaphore,
+    Queue,
+    Task,
+    CancelledError,
+    new_event_loop,
+    gather
+)
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor
+)
+from time import monotonic
+from typing import (
+    Optional,
+    Callable,
+    Iterable,
+    Iterator,
+    Tuple,
+    TypeVar
+)
+
+from .batch import (
+    lpt_order,
+    PoolStats
+)
+
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+# files being read, converted or written at the same time, for each worker
+DEFAULT_PREFETCH_PER_JOB = 4
+# bytes of the input files being read, converted or written at the same time
+DEFAULT_MAX_IN_FLIGHT = 256 * 1024 * 1024
+# threads reading and writing at the same time at most
+MAX_IO_THREADS = 32
+
+
+def timed_call(func: Callable[..., R], *args) -> Tuple[R, float]:
+    """
+    call a function in a worker process, timing it there so that the time waiting for a worker isn't counted
+
+    :return: the result and the seconds taken
+    """
+    start = monotonic()
+    result = func(*args)
+    return result, monotonic() - start
+
+
+class ByteBudget:
+    """
+    limits the bytes held in flight, one item is always let through even if it's larger than the budget
+
+    create it in the running loop, like the other synchronization primitives
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.cond = Condition()
+
+    async def acquire(self, size: int):
+        async with self.cond:
+            while self.used and self.used + size > self.limit:
+                await self.cond.wait()
+            self.used += size
+
+    async def release(self, size: int):
+        async with self.cond:
+            self.used -= size
+            self.cond.notify_all()
+
+
+class AsyncPipeline:
+    """
+    read, convert and write the items with bounded concurrency, the results go to a queue as they are done
+
+    the synchronization primitives are created by start(), on 3.8 and 3.9 they're bound to the loop they're created in
+    """
+
+    def __init__(self, loop: AbstractEventLoop, cpu_pool: ProcessPoolExecutor, io_pool: ThreadPoolExecutor,
+                 read: Callable[[T], Tuple[R, Optional[bytes]]],
+                 convert: Callable[[R, bytes], Tuple[R, Optional[bytes]]],
+                 write: Callable[[T, R, bytes], R], failed: Callable[[T, str], R],
+                 prefetch: int, max_in_flight: int, stats: Optional[PoolStats]):
+        self.loop = loop
+        self.cpu_pool = cpu_pool
+        self.io_pool = io_pool
+        self.read = read
+        self.convert = convert
+        self.write = write
+        self.failed = failed
+        self.prefetch = prefetch
+        self.max_in_flight = max_in_flight
+        self.stats = stats
+        self.slots: Optional[Semaphore] = None
+        self.budget: Optional[ByteBudget] = None
+        # the results, None when all are done
+        self.done: Optional[Queue] = None
+
+    async def start(self, items: Iterable[Tuple[T, int]]) -> Task:
+        """
+        create the synchronization primitives in the running loop, and start running the items
+
+        :param items: the items with their sizes
+        :return: the task running them
+        """
+        self.slots = Semaphore(self.prefetch)
+        self.budget = ByteBudget(self.max_in_flight)
+        # an item keeps its slot until its result is taken, so at most prefetch of them wait here
+        self.done = Queue(maxsize=self.prefetch)
+        return self.loop.create_task(self.run(items))
+
+    async def run(self, items: Iterable[Tuple[T, int]]):
+        """
+        :param items: the items with their sizes
+        """
+        tasks = []
+        try:
+            for item, size in items:
+                await self.slots.acquire()
+                await self.budget.acquire(size)
+                tasks.append(self.loop.create_task(self.process(item, size)))
+            await gather(*tasks)
+        except CancelledError:
+            # the caller stopped early, no one is waiting for the results
+            await self.cancel_all(tasks)
+            raise
+        except BaseException:
+            await self.cancel_all(tasks)
+            # so that the caller doesn't wait forever
+            await self.done.put(None)
+            raise
+        await self.done.put(None)
+
+    @staticmethod
+    async def cancel_all(tasks: Iterable[Task]):
+        for task in tasks:
+            task.cancel()
+        await gather(*tasks, return_exceptions=True)
+
+    async def process(self, item: T, size: int):
+        try:
+            result, data = await self.loop.run_in_executor(self.io_pool, self.read, item)
+            if data is not None:
+                (result, data), seconds = await self.loop.run_in_executor(self.cpu_pool, timed_call,
+                                                                          self.convert, result, data)
+                if self.stats is not None:
+                    self.stats.busy += seconds
+                if data is not None:
+                    result = await self.loop.run_in_executor(self.io_pool, self.write, item, result, data)
+        except Exception as e:
+            # the pool is broken, e.g. a worker was killed
+            result = self.failed(item, f'worker failed: {e!r}')
+        finally:
+            await self.budget.release(size)
+        try:
+            await self.done.put(result)
+        finally:
+            self.slots.release()
+
+
+def run_async_io(items: Iterable[T], size: Callable[[T], int],
+                 read: Callable[[T], Tuple[R, Optional[bytes]]],
+                 convert: Callable[[R, bytes], Tuple[R, Optional[bytes]]],
+                 write: Callable[[T, R, bytes], R], failed: Callable[[T, str], R],
+                 jobs: int, prefetch: Optional[int] = None, max_in_flight: Optional[int] = None,
+                 stats: Optional[PoolStats] = None) -> Iterator[R]:
+    """
+    run the conversion of the items in worker processes, largest first, while the next ones are read and
+    the finished ones are written by threads driven by an event loop
+
+    the event loop runs while the caller waits for the next result, the threads and the workers go on in between
+
+    :param items: the items
+    :param size: size of the input of an item, counted against max_in_flight
+    :param read: read an item, returns the result so far and the content, None as the content if failed
+    :param convert: convert the content in a worker process, returns the result so far and the new content,
+                    None as the new content if failed, must be picklable
+    :param write: write the new content of an item, returns the result
+    :param failed: make the result of an item whose worker failed, with the error
+    :param jobs: number of worker processes
+    :param prefetch: how many items can be read, converted or written at the same time (default: 4 per worker)
+    :param max_in_flight: how many bytes of input can be read, converted or written at the same time
+                          (default: 256 MiB)
+    :param stats: where to record how busy the workers are kept
+    :return: iterator of the results, in the order they are done
+    """
+    if prefetch is None:
+        prefetch = DEFAULT_PREFETCH_PER_JOB * jobs
+    if max_in_flight is None:
+        max_in_flight = DEFAULT_MAX_IN_FLIGHT
+    sizes = [(item, size(item)) for item in items]
+    sizes = lpt_order(sizes, lambda sized: sized[1])
+
+    start = monotonic()
+    loop = new_event_loop()
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as cpu_pool, \
+                ThreadPoolExecutor(max_workers=min(prefetch, MAX_IO_THREADS)) as io_pool:
+            pipeline = AsyncPipeline(loop, cpu_pool, io_pool, read, convert, write, failed,
+                                     prefetch, max_in_flight, stats)
+            runner = loop.run_until_complete(pipeline.start(sizes))
+            try:
+                while (result := loop.run_until_complete(pipeline.done.get())) is not None:
+                    if stats is not None:
+                        stats.wall = monotonic() - start
+                    yield result
+                loop.run_until_complete(runner)
+            finally:
+                if not runner.done():
+                    # the caller stopped early, the files being converted are still waited for
+                    runner.cancel()
+                    loop.run_until_complete(gather(runner, return_exceptions=True))
+    finally:
+        loop.close()
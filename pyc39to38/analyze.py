@@ -0,0 +1,201 @@
+"""
+corpus analysis, runs the rules without writing anything
+"""
+
+from functools import partial
+from heapq import nlargest
+from json import dumps
+from os.path import getsize
+from time import perf_counter
+from typing import (
+    Optional,
+    Iterable,
+    Iterator,
+    List,
+    Dict,
+    Any
+)
+from logging import getLogger
+
+from xdis.disasm import get_opcode
+
+from .load import load_pyc
+from .walk import prepare_patcher
+from .emit import resolve_arg
+from .rules import (
+    RULE_APPLIER,
+    RULES
+)
+from .batch import run_pool
+from .cfg import Config
+from . import (
+    PY38_VER,
+    PY39_VER
+)
+
+
+logger = getLogger('analyze')
+
+# how many of the largest code objects to keep for each file
+TOP_CODES_PER_FILE = 10
+
+# pseudo rule, the instructions needing an EXTENDED_ARG after conversion
+EXTENDED_ARG_NEEDS = 'extended_arg'
+
+REPORT = Dict[str, Any]
+
+
+def inst_count_bucket(count: int) -> int:
+    """
+    get the histogram bucket of an instruction count
+
+    :param count: instruction count
+    :return: the upper bound of the bucket, a power of 2
+    """
+    return 1 << max(count - 1, 0).bit_length()
+
+
+def analyze_file(path: str, cfg: Config, rule_applier: RULE_APPLIER) -> REPORT:
+    """
+    run the rules over a bytecode file in memory and gather statistics
+
+    :param path: path of the bytecode file
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :return: report of the file
+    """
+    report: REPORT = {
+        'path': path,
+        'ok': False,
+        'error': None,
+        'size': None,
+        'seconds': 0.0,
+        'codes': 0,
+        'insts': 0,
+        'rules': dict.fromkeys(RULES + (EXTENDED_ARG_NEEDS,), 0),
+        'failed_codes': [],
+        'largest': [],
+        'hist': {}
+    }
+    start = perf_counter()
+    try:
+        report['size'] = getsize(path)
+        pyc = load_pyc(path, PY39_VER, lazy=True)
+    except Exception as e:
+        # a corrupted file can fail in many ways inside xdis
+        report['error'] = f'{e.__class__.__name__}: {e}'
+        report['seconds'] = perf_counter() - start
+        return report
+    if pyc is None:
+        report['error'] = 'not a 3.9 bytecode file'
+        report['seconds'] = perf_counter() - start
+        return report
+
+    opc38 = get_opcode(PY38_VER, pyc.is_pypy)
+    sizes = []
+    hist: Dict[int, int] = {}
+    for code_idx, (code, label, backpatch_inst) in enumerate(pyc.iter_codes(True)):
+        qualname = pyc.qualnames[code_idx]
+        count = len(code.instructions)
+        report['codes'] += 1
+        report['insts'] += count
+        sizes.append((count, qualname))
+        bucket = inst_count_bucket(count)
+        hist[bucket] = hist.get(bucket, 0) + 1
+
+        patcher, _ = prepare_patcher(pyc.opc, code, label, backpatch_inst, cfg, True)
+        try:
+            rule_applier(patcher, pyc.is_pypy, cfg)
+            for inst in patcher.code.instructions:
+                if resolve_arg(opc38, inst, patcher.label, patcher.backpatch_inst) > 255:
+                    report['rules'][EXTENDED_ARG_NEEDS] += 1
+        except (ValueError, TypeError) as e:
+            report['failed_codes'].append({'qualname': qualname, 'error': f'{e.__class__.__name__}: {e}'})
+        for rule, hits in patcher.stats.items():
+            report['rules'][rule] += hits
+
+    report['largest'] = [
+        {'qualname': qualname, 'insts': count}
+        for count, qualname in nlargest(TOP_CODES_PER_FILE, sizes)
+    ]
+    report['hist'] = {str(bucket): hist[bucket] for bucket in sorted(hist)}
+    report['ok'] = not report['failed_codes']
+    report['seconds'] = perf_counter() - start
+    return report
+
+
+def analyze_files(paths: Iterable[str], cfg: Config, rule_applier: RULE_APPLIER,
+                  jobs: Optional[int] = None) -> Iterator[REPORT]:
+    """
+    analyze bytecode files in worker processes
+
+    :param paths: paths of the bytecode files
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param jobs: number of worker processes (default: number of CPUs)
+    :return: iterator of the reports of each file, in the order they are done
+    """
+    return run_pool(partial(analyze_file, cfg=cfg, rule_applier=rule_applier), paths, jobs)
+
+
+def summarize(reports: List[REPORT], top: int) -> REPORT:
+    """
+    aggregate the reports of each file
+
+    :param reports: reports of each file
+    :param top: how many of the slowest files and the largest code objects to list
+    :return: the summary
+    """
+    rules: Dict[str, Dict[str, int]] = {}
+    hist: Dict[int, int] = {}
+    for report in reports:
+        for rule, hits in report['rules'].items():
+            rule_summary = rules.setdefault(rule, {'hits': 0, 'files': 0})
+            rule_summary['hits'] += hits
+            rule_summary['files'] += 1 if hits else 0
+        for bucket, count in report['hist'].items():
+            hist[int(bucket)] = hist.get(int(bucket), 0) + count
+
+    largest = nlargest(top, (
+        (code['insts'], report['path'], code['qualname'])
+        for report in reports for code in report['largest']
+    ))
+    slowest = nlargest(top, reports, key=lambda r: r['seconds'])
+
+    return {
+        'files': len(reports),
+        'ok': sum(1 for report in reports if report['ok']),
+        'unreadable': sum(1 for report in reports if report['error'] is not None),
+        'failed_codes': sum(len(report['failed_codes']) for report in reports),
+        'seconds': sum(report['seconds'] for report in reports),
+        'codes': sum(report['codes'] for report in reports),
+        'insts': sum(report['insts'] for report in reports),
+        'rules': rules,
+        'slowest': [{'path': report['path'], 'seconds': report['seconds']} for report in slowest],
+        'largest': [{'path': path, 'qualname': qualname, 'insts': count} for count, path, qualname in largest],
+        'hist': {str(bucket): hist[bucket] for bucket in sorted(hist)}
+    }
+
+
+def log_summary(summary: REPORT):
+    """
+    log the summary in a human-readable way
+    """
+    logger.info(f'{summary["files"]} files, {summary["ok"]} ok, {summary["unreadable"]} unreadable, '
+                f'{summary["failed_codes"]} code objects failed, {summary["seconds"]:.2f}s in total')
+    logger.info(f'{summary["codes"]} code objects, {summary["insts"]} instructions')
+    for rule, rule_summary in summary['rules'].items():
+        logger.info(f'rule {rule}: {rule_summary["hits"]} hits in {rule_summary["files"]} files')
+    for report in summary['slowest']:
+        logger.info(f'slow: {report["path"]} ({report["seconds"]:.3f}s)')
+    for code in summary['largest']:
+        logger.info(f'large: {code["path"]}: {code["qualname"]} ({code["insts"]} instructions)')
+    for bucket, count in summary['hist'].items():
+        logger.info(f'code objects with <= {bucket} instructions: {count}')
+
+
+def to_json_line(report: REPORT) -> str:
+    """
+    :return: the report as one line of JSON
+    """
+    return dumps(report, separators=(',', ':')) + '\n'
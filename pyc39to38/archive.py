@@ -0,0 +1,198 @@
+"""
+conversion of the bytecode files inside zip archives, without extracting them
+"""
+
+from base64 import urlsafe_b64encode
+from copy import copy
+from csv import (
+    reader,
+    writer
+)
+from functools import partial
+from hashlib import sha256
+from io import StringIO
+from logging import getLogger
+from struct import unpack
+from traceback import print_exc
+from typing import (
+    Optional,
+    Iterator,
+    Dict,
+    Tuple
+)
+from zipfile import (
+    ZipFile,
+    ZipInfo,
+    BadZipFile,
+    sizeFileHeader
+)
+
+from .asm import reasm_bytes
+from .batch import run_pool_ordered
+from .utils import (
+    copy_range,
+    atomic_open
+)
+from .rules import RULE_APPLIER
+from .cfg import Config
+from . import (
+    PYC_SUFFIX,
+    FILE_ENCODING
+)
+
+
+logger = getLogger('archive')
+
+# PEP 3147 names in __pycache__
+PY39_CACHE_TAG = '.cpython-39'
+PY38_CACHE_TAG = '.cpython-38'
+
+# the file hashes of a wheel
+RECORD_SUFFIX = '.dist-info/RECORD'
+RECORD_HASH = 'sha256'
+
+# bit 3 of the general purpose flag, the sizes and the crc come after the data
+DATA_DESCRIPTOR_FLAG = 0x08
+# the name and extra field lengths in the local file header
+NAME_LENGTHS_OFF = 26
+NAME_LENGTHS_FMT = '<2H'
+
+
+def rename_member(name: str) -> str:
+    """
+    get the new name of a converted bytecode file, so that 3.8 still finds it in __pycache__
+    """
+    if name.endswith(PY39_CACHE_TAG + PYC_SUFFIX):
+        return name[:-len(PY39_CACHE_TAG + PYC_SUFFIX)] + PY38_CACHE_TAG + PYC_SUFFIX
+    return name
+
+
+def copy_raw(zin: ZipFile, zout: ZipFile, info: ZipInfo):
+    """
+    copy a member to another archive as it is, without decompressing and compressing it again
+
+    :param zin: the input archive
+    :param zout: the output archive
+    :param info: the member to copy
+    """
+    zin.fp.seek(info.header_offset)
+    header = zin.fp.read(sizeFileHeader)
+    name_len, extra_len = unpack(NAME_LENGTHS_FMT, header[NAME_LENGTHS_OFF:sizeFileHeader])
+    zin.fp.seek(info.header_offset + sizeFileHeader + name_len + extra_len)
+
+    new_info = copy(info)
+    # the sizes and the crc are known now, they go in the header instead
+    new_info.flag_bits &= ~DATA_DESCRIPTOR_FLAG
+    new_info.header_offset = zout.fp.tell()
+    zout.fp.write(new_info.FileHeader())
+    try:
+        copy_range(zin.fp, zout.fp, info.compress_size)
+    except EOFError:
+        raise BadZipFile(f'member {info.filename!r} is truncated')
+    zout.filelist.append(new_info)
+    zout.NameToInfo[new_info.filename] = new_info
+    zout.start_dir = zout.fp.tell()
+
+
+def record_hash(data: bytes) -> str:
+    """
+    :return: the hash of a file in the format of a wheel RECORD
+    """
+    digest = urlsafe_b64encode(sha256(data).digest()).rstrip(b'=').decode('ascii')
+    return f'{RECORD_HASH}={digest}'
+
+
+def rewrite_record(data: bytes, converted: Dict[str, Tuple[str, str, int]]) -> bytes:
+    """
+    update the hashes and the sizes of the converted bytecode files in a wheel RECORD
+
+    :param data: content of the RECORD
+    :param converted: old name to new name, hash and size of the converted files
+    :return: the new RECORD
+    """
+    out = StringIO(newline='')
+    record_writer = writer(out, lineterminator='\n')
+    for row in reader(StringIO(data.decode(FILE_ENCODING), newline='')):
+        if row and row[0] in converted:
+            name, file_hash, size = converted[row[0]]
+            row = [name, file_hash, str(size)]
+        record_writer.writerow(row)
+    return out.getvalue().encode(FILE_ENCODING)
+
+
+def convert_member(item: Tuple[str, bytes], cfg: Config, rule_applier: RULE_APPLIER) -> Optional[bytes]:
+    """
+    convert a bytecode file in an archive, run in the worker processes
+
+    :param item: name and content of the member
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :return: the converted content, None if failed
+    """
+    name, data = item
+    try:
+        return reasm_bytes(data, name, cfg, rule_applier)
+    except Exception:
+        # don't let a single member take down the whole archive
+        print_exc()
+        return None
+
+
+def iter_members(zin: ZipFile) -> Iterator[Tuple[ZipInfo, Optional[Tuple[str, bytes]]]]:
+    """
+    iterate the members of an archive, reading the bytecode files only when they are taken
+
+    :param zin: the archive
+    :return: iterator of the members, with the name and content if it's a bytecode file to convert
+    """
+    for info in zin.infolist():
+        if info.filename.endswith(RECORD_SUFFIX):
+            # written last, once all the hashes are known
+            continue
+        if info.is_dir() or not info.filename.endswith(PYC_SUFFIX):
+            yield info, None
+        else:
+            yield info, (info.filename, zin.read(info))
+
+
+def convert_archive(input_path: str, output_path: str, cfg: Config, rule_applier: RULE_APPLIER,
+                    jobs: Optional[int] = None) -> bool:
+    """
+    convert the bytecode files in a zip archive (a zipimport bundle, a wheel or an egg) into a new archive
+
+    the other members are copied as they are, so is a bytecode file failed to convert
+
+    :param input_path: input archive path
+    :param output_path: output archive path
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param jobs: number of worker processes (default: number of CPUs)
+    :return: True if all the bytecode files are converted, False if not
+    """
+    # old name to new name, hash and size, for the wheel RECORD
+    converted: Dict[str, Tuple[str, str, int]] = {}
+    failed = 0
+    try:
+        with ZipFile(input_path) as zin, atomic_open(output_path) as fp, ZipFile(fp, 'w') as zout:
+            func = partial(convert_member, cfg=cfg, rule_applier=rule_applier)
+            for info, data in run_pool_ordered(func, iter_members(zin), jobs):
+                if data is None:
+                    if info.filename.endswith(PYC_SUFFIX) and not info.is_dir():
+                        logger.error(f'failed to convert {info.filename}, copied as it is')
+                        failed += 1
+                    copy_raw(zin, zout, info)
+                    continue
+                new_info = copy(info)
+                new_info.filename = rename_member(info.filename)
+                zout.writestr(new_info, data)
+                converted[info.filename] = (new_info.filename, record_hash(data), len(data))
+
+            for info in zin.infolist():
+                if info.filename.endswith(RECORD_SUFFIX):
+                    zout.writestr(copy(info), rewrite_record(zin.read(info), converted))
+    except (OSError, IOError, BadZipFile):
+        print_exc()
+        return False
+
+    logger.info(f'{len(converted)} bytecode files converted, {failed} failed')
+    return not failed
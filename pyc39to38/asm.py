@@ -2,33 +2,46 @@
 assembly related operations
 """
 
-from tempfile import NamedTemporaryFile
 from traceback import print_exc
-from os import unlink
 from logging import getLogger
-from struct import pack
+from mmap import (
+    mmap,
+    ACCESS_READ
+)
+from struct import (
+    pack,
+    error as StructError
+)
+from io import BytesIO
+from time import time
 from typing import (
     Optional,
-    Tuple
+    Counter,
+    BinaryIO,
+    List
 )
 
-from xdis.disasm import (
-    disassemble_file,
-    get_opcode
-)
-from xasm.assemble import (
-    asm_file,
-    Assembler
-)
-from xasm.write_pyc import write_pycfile
+from xdis.disasm import get_opcode
+from xdis.magics import magics
+from xdis.marsh import dumps
+from xdis.version_info import version_tuple_to_str
+from xasm.assemble import Assembler
 
-from .utils import rm_suffix
+from .load import (
+    LoadedPyc,
+    load_pyc
+)
 from .walk import walk_codes
+from .verify import verify_codes
+from .optimize import (
+    OPT_THREADED,
+    OPT_DROPPED,
+    OPT_SAVED_BYTES
+)
 from .rules import RULE_APPLIER
 from .cfg import Config
+from .utils import atomic_open
 from . import (
-    FILE_ENCODING,
-    PYASM_SUFFIX,
     PY38_VER,
     PY39_VER
 )
@@ -36,8 +49,86 @@ from . import (
 
 logger = getLogger('asm')
 
-SOURCE_SIZE_OFF = 12
-SOURCE_SIZE_FMT = '<I'
+# magic, flags (0 for the timestamp based ones), timestamp and source size
+PYC_HEADER_FMT = '<4sIII'
+
+# how xdis fails on a malformed input file: ImportError for a body it can't unmarshal,
+# the unmarshal errors themselves, and struct.error for a truncated header
+LOAD_ERRORS = (ImportError, EOFError, TypeError, StructError)
+
+
+def convert_pyc(pyc: LoadedPyc, cfg: Config, rule_applier: RULE_APPLIER,
+                stats: Optional[Counter[str]] = None, degraded: Optional[List[str]] = None) -> Optional[Assembler]:
+    """
+    convert the code objects of a loaded bytecode file
+
+    :param pyc: the loaded bytecode file
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param stats: where to count how many times each rule applies
+    :param degraded: where to list the code objects converted with some rules disabled
+    :return: assembler with the converted code objects, None if failed
+
+    if cfg.optimize is set and stats is not given, how much the optimization saves is logged
+    """
+    log_optimized = cfg.optimize and stats is None
+    if log_optimized:
+        stats = Counter()
+    opc = get_opcode(pyc.version, pyc.is_pypy)
+    if (new_asm := walk_codes(opc, pyc, pyc.is_pypy, cfg, rule_applier, stats, degraded)) is None:
+        logger.error('failed to walk through the codes, aborting')
+        return None
+    if log_optimized:
+        logger.info(f'{stats[OPT_THREADED]} jumps threaded, {stats[OPT_DROPPED]} jumps dropped, '
+                    f'about {stats[OPT_SAVED_BYTES]} bytes saved')
+
+    if cfg.verify:
+        # the first one is the module itself
+        if broken := verify_codes(new_asm.opc, new_asm.code_list[0]):
+            for name, problems in broken:
+                for problem in problems:
+                    logger.error(f'code {name!r} is broken: {problem}')
+            logger.error('verification failed, aborting')
+            return None
+    return new_asm
+
+
+def build_pyc(new_asm: Assembler, timestamp: Optional[int]) -> Optional[bytes]:
+    """
+    build the content of a 3.8 bytecode file from the converted code objects
+
+    unlike xasm's write_pycfile, the real source size goes into the header,
+    and the whole file is joined into one buffer of the final size, so that it's written at once
+
+    :param new_asm: assembler with the converted code objects
+    :param timestamp: timestamp of the original file, None for now
+    :return: content of the file, None if the code objects can't be marshalled
+    """
+    if timestamp is None:
+        timestamp = int(time())
+    header = pack(PYC_HEADER_FMT, magics[version_tuple_to_str(PY38_VER, end=2)], 0, timestamp, new_asm.size)
+    try:
+        codes = [dumps(co, python_version=PY38_VER) for co in new_asm.code_list]
+    except (ValueError, TypeError, KeyError):
+        # xdis can't marshal everything, e.g. a string beyond Latin-1
+        print_exc()
+        return None
+    return b''.join([header] + codes)
+
+
+def write_pyc(fp: BinaryIO, new_asm: Assembler, timestamp: Optional[int]) -> bool:
+    """
+    write the converted code objects as a 3.8 bytecode file, with a single write
+
+    :param fp: file object to write to
+    :param new_asm: assembler with the converted code objects
+    :param timestamp: timestamp of the original file, None for now
+    :return: True if success, False if the code objects can't be marshalled (nothing is written)
+    """
+    if (data := build_pyc(new_asm, timestamp)) is None:
+        return False
+    fp.write(data)
+    return True
 
 
 def reasm_file(input_path: str, output_path: str, cfg: Config, rule_applier: RULE_APPLIER) -> bool:
@@ -50,48 +141,66 @@ def reasm_file(input_path: str, output_path: str, cfg: Config, rule_applier: RUL
     :param rule_applier: rule applier
     :return: True if success, False if failed
     """
-    version: Tuple[int, ...]
-    timestamp: int
-    asm: Assembler
-    tmp_asm: Optional[NamedTemporaryFile] = None
-
     try:
-        with NamedTemporaryFile(
-            'w', suffix=PYASM_SUFFIX,
-            prefix=rm_suffix(input_path),
-            delete=False,
-            encoding=FILE_ENCODING
-        ) as tmp_asm:
-            (
-                _, _, version, timestamp, _, is_pypy, _, _
-            ) = disassemble_file(input_path, tmp_asm, 'xasm')
-
-        if version != PY39_VER:
-            logger.error('input bytecode version is not 3.9, aborting')
-            return False
-
-        asm = asm_file(tmp_asm.name)
-    except (OSError, IOError):
+        with open(input_path, 'rb') as fp:
+            # mapped instead of read, xdis only copies the parts it unmarshals,
+            # the code objects not selected are never decoded if loaded lazily
+            pyc = load_pyc(input_path, PY39_VER, cfg.low_memory or cfg.only is not None,
+                           mmap(fp.fileno(), 0, access=ACCESS_READ))
+    except LOAD_ERRORS as e:
+        logger.error(f'failed to load the input bytecode: {e.__class__.__name__}: {e}, aborting')
+        return False
+    except (OSError, IOError, ValueError):
+        # an empty file can't be mapped
         print_exc()
         return False
-    finally:
-        # TODO: do we still need tmp_asm for trans_asm and write_pycfile?
-        if tmp_asm is not None:
-            unlink(tmp_asm.name)  # anyway, we are removing it here, seems OK
+    if pyc is None:
+        logger.error('failed to load the input bytecode, aborting')
+        return False
 
-    opc = get_opcode(version, is_pypy)
-    if (new_asm := walk_codes(opc, asm, is_pypy, cfg, rule_applier)) is None:
-        logger.error('failed to walk through the codes, aborting')
+    if (new_asm := convert_pyc(pyc, cfg, rule_applier)) is None:
+        return False
+    # built before opening the output, so that nothing is left if it fails
+    if (data := build_pyc(new_asm, pyc.timestamp)) is None:
+        logger.error(f'failed to marshal the converted code objects of {input_path}, aborting')
         return False
 
     try:
-        with open(output_path, 'wb') as fp:
-            write_pycfile(fp, new_asm.code_list, timestamp, PY38_VER)
-            # write_pycfile writes a zero, in our case it's better to write the real size
-            fp.seek(SOURCE_SIZE_OFF)
-            fp.write(pack(SOURCE_SIZE_FMT, new_asm.size))
+        with atomic_open(output_path) as fp:
+            fp.write(data)
     except (OSError, IOError):
         print_exc()
         return False
     else:
         return True
+
+
+def reasm_bytes(data: bytes, name: str, cfg: Config, rule_applier: RULE_APPLIER,
+                stats: Optional[Counter[str]] = None, degraded: Optional[List[str]] = None) -> Optional[bytes]:
+    """
+    reassemble a Python bytecode file in memory
+
+    :param data: content of the input file
+    :param name: name of the input file, only for the messages
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param stats: where to count how many times each rule applies
+    :param degraded: where to list the code objects converted with some rules disabled
+    :return: content of the output file, None if failed
+    """
+    try:
+        pyc = load_pyc(name, PY39_VER, cfg.low_memory or cfg.only is not None, BytesIO(data))
+    except ImportError:
+        # xdis reports a malformed file this way
+        print_exc()
+        return None
+    if pyc is None:
+        logger.error(f'failed to load the bytecode of {name}')
+        return None
+
+    if (new_asm := convert_pyc(pyc, cfg, rule_applier, stats, degraded)) is None:
+        return None
+
+    if (new_data := build_pyc(new_asm, pyc.timestamp)) is None:
+        logger.error(f'failed to marshal the converted code objects of {name}')
+    return new_data
@@ -0,0 +1,406 @@
+"""
+batch processing
+"""
+
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    FIRST_COMPLETED,
+    wait as wait_futures
+)
+from collections import deque
+from multiprocessing import (
+    Process,
+    Pipe
+)
+from multiprocessing.connection import (
+    Connection,
+    wait
+)
+from functools import partial
+from hashlib import sha1
+from time import (
+    monotonic,
+    perf_counter
+)
+from traceback import format_exc
+from os import (
+    walk,
+    cpu_count
+)
+from os.path import (
+    isfile,
+    join,
+    sep
+)
+from typing import (
+    Optional,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Tuple,
+    TypeVar
+)
+
+from .utils import get_rss
+from . import PYC_SUFFIX
+
+
+T = TypeVar('T')
+R = TypeVar('R')
+K = TypeVar('K')
+
+# how many items can be in the workers at the same time for each worker, in run_pool and run_pool_ordered
+IN_FLIGHT_PER_JOB = 2
+
+# how often to check the time and the memory usage of the isolated workers, in seconds
+WATCH_INTERVAL = 0.1
+
+
+def find_pycs(root: str) -> List[str]:
+    """
+    find all bytecode files under a directory
+
+    :param root: the directory, or a single file
+    :return: sorted paths of the bytecode files
+    """
+    if isfile(root):
+        return [root]
+    paths = []
+    for dir_path, dir_names, file_names in walk(root):
+        # make the order stable
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if file_name.endswith(PYC_SUFFIX):
+                paths.append(join(dir_path, file_name))
+    return paths
+
+
+def in_shard(rel_path: str, shard: Tuple[int, int]) -> bool:
+    """
+    check whether a file belongs to a shard, by a hash of its path so that every node gets the same answer
+
+    :param rel_path: path of the file relative to the root of the tree
+    :param shard: index (from 0) and count of the shards
+    :return: True if the file belongs to the shard
+    """
+    index, count = shard
+    digest = sha1(rel_path.replace(sep, '/').encode('utf-8', 'surrogateescape')).digest()
+    return int.from_bytes(digest[:8], 'big') % count == index
+
+
+def default_jobs() -> int:
+    """
+    :return: default number of worker processes
+    """
+    return cpu_count() or 1
+
+
+def run_pool(func: Callable[[T], R], items: Iterable[T], jobs: Optional[int] = None,
+             max_in_flight: Optional[int] = None) -> Iterator[R]:
+    """
+    run a function over the items in worker processes
+
+    the function and the items have to be picklable,
+    the items are taken only when there's room for them, and a result is dropped once it's yielded
+
+    :param func: the function to run
+    :param items: the items to run it with
+    :param jobs: number of worker processes, run in this process if it's 1 (default: number of CPUs)
+    :param max_in_flight: how many items can be in the workers at the same time (default: twice the jobs)
+    :return: iterator of the results, in the order they are done
+    """
+    if jobs is None:
+        jobs = default_jobs()
+    if jobs <= 1:
+        for item in items:
+            yield func(item)
+        return
+    if max_in_flight is None:
+        max_in_flight = jobs * IN_FLIGHT_PER_JOB
+
+    items = iter(items)
+    pending = set()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            for item in items:
+                pending.add(executor.submit(func, item))
+                if len(pending) >= max_in_flight:
+                    break
+            if not pending:
+                return
+            done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+class PoolStats:
+    """
+    how busy the workers are kept during a run
+    """
+
+    def __init__(self, jobs: int):
+        self.jobs = jobs
+        # seconds spent in the function, summed over the workers
+        self.busy = 0.0
+        # seconds from the start to the last result
+        self.wall = 0.0
+
+    @property
+    def utilization(self) -> float:
+        """
+        :return: the part of the worker time spent in the function, 1.0 means no worker is ever idle
+        """
+        return self.busy / (self.jobs * self.wall) if self.wall else 0.0
+
+
+def lpt_order(items: Iterable[T], cost: Callable[[T], float]) -> List[T]:
+    """
+    order the items by their estimated cost, largest first (longest processing time first scheduling),
+    so that a big item doesn't start last and keep a single worker busy after all the others are done
+
+    :param items: the items
+    :param cost: estimated cost of an item
+    :return: the ordered items, the ones with the same cost stay in their order
+    """
+    return sorted(items, key=cost, reverse=True)
+
+
+def make_chunks(items: List[T], cost: Callable[[T], float], chunk_cost: float) -> List[List[T]]:
+    """
+    group the small items into chunks, so that each of them doesn't cost a round trip to a worker
+
+    :param items: the items, largest first
+    :param cost: estimated cost of an item
+    :param chunk_cost: estimated cost of a chunk, the items costing at least this much are on their own
+    :return: the chunks, in the order of the items
+    """
+    chunks = []
+    chunk = []
+    current_cost = 0.0
+    for item in items:
+        item_cost = cost(item)
+        if item_cost >= chunk_cost:
+            chunks.append([item])
+            continue
+        if chunk and current_cost + item_cost > chunk_cost:
+            chunks.append(chunk)
+            chunk = []
+            current_cost = 0.0
+        chunk.append(item)
+        current_cost += item_cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def run_chunk(chunk: List[T], func: Callable[[T], R]) -> Tuple[List[R], float]:
+    """
+    run a function over a chunk of items in a worker
+
+    :return: the results, and the seconds it took
+    """
+    start = perf_counter()
+    results = [func(item) for item in chunk]
+    return results, perf_counter() - start
+
+
+def run_scheduled(func: Callable[[T], R], items: Iterable[T], cost: Callable[[T], float],
+                  jobs: Optional[int] = None, chunk_cost: Optional[float] = None,
+                  stats: Optional[PoolStats] = None) -> Iterator[R]:
+    """
+    run a function over the items in worker processes, largest first
+
+    :param func: the function to run
+    :param items: the items to run it with
+    :param cost: estimated cost of an item, e.g. the file size
+    :param jobs: number of worker processes, run in this process if it's 1 (default: number of CPUs)
+    :param chunk_cost: group the items smaller than this into chunks of about this cost, no chunks if None
+    :param stats: where to record how busy the workers are kept
+    :return: iterator of the results, in the order they are done
+    """
+    if jobs is None:
+        jobs = default_jobs()
+    items = lpt_order(items, cost)
+    chunks = make_chunks(items, cost, chunk_cost) if chunk_cost else [[item] for item in items]
+    start = perf_counter()
+    for results, seconds in run_pool(partial(run_chunk, func=func), chunks, jobs):
+        if stats is not None:
+            stats.busy += seconds
+            stats.wall = perf_counter() - start
+        yield from results
+
+
+def run_pool_ordered(func: Callable[[T], R], items: Iterable[Tuple[K, Optional[T]]], jobs: Optional[int] = None,
+                     max_in_flight: Optional[int] = None) -> Iterator[Tuple[K, Optional[R]]]:
+    """
+    run a function over the items in worker processes, keeping their order
+
+    the items are taken only when there's room for them, so that only max_in_flight of them are in memory
+
+    :param func: the function to run
+    :param items: iterable of key and item, the item is passed through as None if it's None
+    :param jobs: number of worker processes, run in this process if it's 1 (default: number of CPUs)
+    :param max_in_flight: how many items can be in the workers at the same time (default: twice the jobs)
+    :return: iterator of key and result, in the order of the items
+    """
+    if jobs is None:
+        jobs = default_jobs()
+    if jobs <= 1:
+        for key, item in items:
+            yield key, None if item is None else func(item)
+        return
+    if max_in_flight is None:
+        max_in_flight = jobs * IN_FLIGHT_PER_JOB
+
+    # the items not yielded yet, with their futures
+    pending = deque()
+    in_flight = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for key, item in items:
+            if item is None:
+                pending.append((key, None))
+            else:
+                pending.append((key, executor.submit(func, item)))
+                in_flight += 1
+            # wait for the oldest ones to make room, and don't hold back the ones already done
+            while pending and (in_flight >= max_in_flight or pending[0][1] is None or pending[0][1].done()):
+                key, future = pending.popleft()
+                if future is None:
+                    yield key, None
+                else:
+                    in_flight -= 1
+                    yield key, future.result()
+        while pending:
+            key, future = pending.popleft()
+            yield key, None if future is None else future.result()
+
+
+def isolated_worker_main(func: Callable[[T], R], conn: Connection):
+    """
+    the main loop of an isolated worker process, runs the function over the items sent until None is sent
+
+    :param func: the function to run
+    :param conn: the connection to the parent process
+    """
+    while True:
+        try:
+            item = conn.recv()
+        except EOFError:
+            return
+        if item is None:
+            return
+        try:
+            conn.send((True, func(item)))
+        except Exception:
+            conn.send((False, format_exc()))
+
+
+class IsolatedWorker:
+    """
+    a worker process running one item at a time, so that it can be killed for that item alone
+    """
+
+    def __init__(self, func: Callable[[T], R]):
+        self.conn, child_conn = Pipe()
+        self.process = Process(target=isolated_worker_main, args=(func, child_conn), daemon=True)
+        self.process.start()
+        child_conn.close()
+        # the item being run, and when it started
+        self.item: Optional[T] = None
+        self.started = 0.0
+
+    def submit(self, item: T):
+        self.conn.send(item)
+        self.item = item
+        self.started = monotonic()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(WATCH_INTERVAL)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+def run_isolated(func: Callable[[T], R], items: Iterable[T], jobs: Optional[int] = None,
+                 timeout: Optional[float] = None, max_rss: Optional[int] = None,
+                 stats: Optional[PoolStats] = None) -> Iterator[Tuple[T, Optional[R], Optional[str]]]:
+    """
+    run a function over the items in worker processes, one item at a time in each,
+    and kill the worker of an item taking too long or too much memory
+
+    a killed worker is replaced right away, so that the rest of the items keep all the workers
+
+    :param func: the function to run
+    :param items: the items to run it with
+    :param jobs: number of worker processes (default: number of CPUs)
+    :param timeout: wall-clock time limit of each item in seconds, no limit if None
+    :param max_rss: resident set size limit of a worker in bytes, no limit if None (or not supported)
+    :param stats: where to record how busy the workers are kept
+    :return: iterator of item, result, and the reason if it failed, in the order they are done
+    """
+    if jobs is None:
+        jobs = default_jobs()
+    items = iter(items)
+    workers = [IsolatedWorker(func) for _ in range(max(jobs, 1))]
+    exhausted = False
+    start = monotonic()
+
+    def record(worker: IsolatedWorker):
+        if stats is not None:
+            now = monotonic()
+            stats.busy += now - worker.started
+            stats.wall = now - start
+
+    try:
+        while True:
+            for worker in workers:
+                if worker.item is None and not exhausted:
+                    try:
+                        worker.submit(next(items))
+                    except StopIteration:
+                        exhausted = True
+            busy = {worker.conn: worker for worker in workers if worker.item is not None}
+            if not busy:
+                return
+
+            for conn in wait(list(busy), WATCH_INTERVAL):
+                worker = busy.pop(conn)
+                record(worker)
+                item, worker.item = worker.item, None
+                try:
+                    ok, result = conn.recv()
+                except (EOFError, OSError):
+                    worker.kill()
+                    workers[workers.index(worker)] = IsolatedWorker(func)
+                    yield item, None, f'worker died with exit code {worker.process.exitcode}'
+                    continue
+                if ok:
+                    yield item, result, None
+                else:
+                    yield item, None, result
+
+            now = monotonic()
+            for worker in busy.values():
+                if timeout is not None and now - worker.started > timeout:
+                    reason = f'killed after {timeout}s'
+                elif max_rss is not None and (rss := get_rss(worker.process.pid)) is not None and rss > max_rss:
+                    reason = f'killed at {rss // 1024 // 1024} MiB'
+                else:
+                    continue
+                record(worker)
+                item, worker.item = worker.item, None
+                worker.kill()
+                workers[workers.index(worker)] = IsolatedWorker(func)
+                yield item, None, reason
+    finally:
+        for worker in workers:
+            worker.stop()
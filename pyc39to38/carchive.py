@@ -0,0 +1,337 @@
+"""
+conversion of the bytecode in PyInstaller executables (the CArchive and the PYZ archive in it)
+
+the output is meant to be extracted and decompiled, it still bundles the 3.9 runtime
+"""
+
+from io import BytesIO
+from functools import partial
+from logging import getLogger
+from marshal import (
+    loads,
+    dumps
+)
+from struct import (
+    pack,
+    unpack,
+    calcsize
+)
+from traceback import print_exc
+from typing import (
+    Optional,
+    BinaryIO,
+    Iterator,
+    List,
+    Tuple
+)
+from zlib import (
+    compress,
+    decompress,
+    error as ZlibError
+)
+
+from xdis.magics import magics
+from xdis.version_info import version_tuple_to_str
+
+from .asm import reasm_bytes
+from .batch import run_pool_ordered
+from .rules import RULE_APPLIER
+from .cfg import Config
+from .utils import (
+    copy_range,
+    atomic_open
+)
+from . import (
+    PY38_VER,
+    PY39_VER
+)
+
+
+logger = getLogger('carchive')
+
+# the cookie at the end of the CArchive, PyInstaller 2.1 and later
+COOKIE_MAGIC = b'MEI\014\013\012\013\016'
+# magic, length of the whole archive, offset and length of the TOC, python version, python library name
+COOKIE_FMT = '!8sIIii64s'
+COOKIE_SIZE = calcsize(COOKIE_FMT)
+COOKIE_SEARCH_CHUNK = 8192
+
+# entry size, offset, compressed size, size, compressed or not, typecode, then the name
+TOC_ENTRY_FMT = '!iIIIBc'
+TOC_ENTRY_SIZE = calcsize(TOC_ENTRY_FMT)
+TOC_ENTRY_ALIGN = 16
+
+# the code objects in the CArchive, script, module and package
+CODE_TYPECODES = (b's', b'm', b'M')
+PYZ_TYPECODE = b'z'
+
+PYZ_MAGIC = b'PYZ\0'
+# magic, python magic, offset of the TOC
+PYZ_HEADER_FMT = '!4s4si'
+PYZ_HEADER_SIZE = calcsize(PYZ_HEADER_FMT)
+# the code objects in the PYZ, module and package (the others are data and namespace packages)
+PYZ_CODE_TYPES = (0, 1)
+
+ZLIB_LEVEL = 9
+
+# magic, flags, timestamp, source size
+PYC_HEADER_FMT = '<4sIII'
+PYC_HEADER_SIZE = calcsize(PYC_HEADER_FMT)
+PY38_MAGIC = magics[version_tuple_to_str(PY38_VER, end=2)]
+PY39_MAGIC = magics[version_tuple_to_str(PY39_VER, end=2)]
+
+
+class CArchiveEntry:
+    """
+    an entry in the TOC of a CArchive
+    """
+    __slots__ = ('offset', 'compressed_size', 'size', 'compressed', 'typecode', 'name')
+
+    def __init__(self, offset: int, compressed_size: int, size: int, compressed: int, typecode: bytes, name: bytes):
+        # relative to the start of the CArchive
+        self.offset = offset
+        self.compressed_size = compressed_size
+        self.size = size
+        self.compressed = compressed
+        self.typecode = typecode
+        self.name = name
+
+    def pack(self) -> bytes:
+        """
+        :return: the entry in the TOC format, with the name padded like PyInstaller does
+        """
+        name = self.name + b'\0'
+        entry_size = TOC_ENTRY_SIZE + len(name)
+        name += b'\0' * (-entry_size % TOC_ENTRY_ALIGN)
+        return pack(TOC_ENTRY_FMT, TOC_ENTRY_SIZE + len(name), self.offset, self.compressed_size,
+                    self.size, self.compressed, self.typecode) + name
+
+
+def find_cookie(fp: BinaryIO) -> int:
+    """
+    find the cookie of the CArchive by searching backwards from the end
+
+    :param fp: the executable
+    :return: offset of the cookie
+
+    :raises ValueError: if it's not a PyInstaller executable
+    """
+    end = fp.seek(0, 2)
+    pos = end
+    while pos > 0:
+        # overlap the chunks so that a magic across them is found too
+        start = max(pos - COOKIE_SEARCH_CHUNK, 0)
+        fp.seek(start)
+        chunk = fp.read(min(pos + len(COOKIE_MAGIC) - 1, end) - start)
+        if (idx := chunk.rfind(COOKIE_MAGIC)) >= 0:
+            return start + idx
+        pos = start
+    raise ValueError('no PyInstaller cookie found')
+
+
+def read_toc(fp: BinaryIO, toc_offset: int, toc_len: int) -> List[CArchiveEntry]:
+    """
+    read the TOC of a CArchive
+
+    :param fp: the executable
+    :param toc_offset: absolute offset of the TOC
+    :param toc_len: length of the TOC
+    :return: the entries
+    """
+    fp.seek(toc_offset)
+    toc = fp.read(toc_len)
+    entries = []
+    pos = 0
+    while pos < len(toc):
+        entry_size, offset, compressed_size, size, compressed, typecode = unpack(
+            TOC_ENTRY_FMT, toc[pos:pos + TOC_ENTRY_SIZE])
+        if entry_size < TOC_ENTRY_SIZE:
+            raise ValueError(f'broken TOC entry at {pos}')
+        name = toc[pos + TOC_ENTRY_SIZE:pos + entry_size].rstrip(b'\0')
+        entries.append(CArchiveEntry(offset, compressed_size, size, compressed, typecode, name))
+        pos += entry_size
+    return entries
+
+
+def convert_code(name: str, data: bytes, cfg: Config, rule_applier: RULE_APPLIER) -> Optional[bytes]:
+    """
+    convert a marshalled code object, with or without the pyc header
+
+    :param name: name of the module, only for the messages
+    :param data: the marshalled code object, or a whole bytecode file
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :return: the converted one in the same form, None if failed
+    """
+    # the bare ones start with the marshal type of a code object, before PyInstaller 5.3 the header is kept
+    has_header = data[2:4] == b'\r\n'
+    if not has_header:
+        data = pack(PYC_HEADER_FMT, PY39_MAGIC, 0, 0, 0) + data
+    try:
+        new_data = reasm_bytes(data, name, cfg, rule_applier)
+    except Exception:
+        # don't let a single module take down the whole executable
+        print_exc()
+        return None
+    if new_data is None or has_header:
+        return new_data
+    return new_data[PYC_HEADER_SIZE:]
+
+
+def convert_pyz_entry(item: Tuple[str, bytes], cfg: Config, rule_applier: RULE_APPLIER) -> Optional[bytes]:
+    """
+    convert a module in the PYZ archive, run in the worker processes
+
+    :param item: name and compressed marshalled code object of the module
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :return: the converted one compressed, None if failed
+    """
+    name, data = item
+    try:
+        data = decompress(data)
+    except ZlibError:
+        logger.error(f'failed to decompress {name}, is the PYZ archive encrypted?')
+        return None
+    if (new_data := convert_code(name, data, cfg, rule_applier)) is None:
+        return None
+    return compress(new_data, ZLIB_LEVEL)
+
+
+def convert_pyz(src: BinaryIO, src_offset: int, src_len: int, dst: BinaryIO, cfg: Config,
+                rule_applier: RULE_APPLIER, jobs: Optional[int]) -> Tuple[int, int, int]:
+    """
+    convert the modules in a PYZ archive, and write the new one at the current position of dst
+
+    :param src: file object containing the PYZ archive
+    :param src_offset: offset of the PYZ archive in src
+    :param src_len: length of the PYZ archive
+    :param dst: seekable file object to write to
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param jobs: number of worker processes (default: number of CPUs)
+    :return: length of the new PYZ archive, converted and failed module count
+
+    :raises ValueError: if it's not a PYZ archive
+    """
+    src.seek(src_offset)
+    magic, _, toc_offset = unpack(PYZ_HEADER_FMT, src.read(PYZ_HEADER_SIZE))
+    if magic != PYZ_MAGIC:
+        raise ValueError('not a PYZ archive')
+    src.seek(src_offset + toc_offset)
+    toc = loads(src.read(src_len - toc_offset))
+    # a list since PyInstaller 4, a dict before that
+    toc_items = list(toc.items()) if isinstance(toc, dict) else toc
+
+    def iter_entries() -> Iterator[Tuple[Tuple[str, Tuple[int, int, int]], Optional[Tuple[str, bytes]]]]:
+        for name, (typecode, pos, length) in toc_items:
+            src.seek(src_offset + pos)
+            data = src.read(length)
+            yield (name, (typecode, pos, length)), (name, data) if typecode in PYZ_CODE_TYPES else None
+
+    dst_offset = dst.tell()
+    dst.write(pack(PYZ_HEADER_FMT, PYZ_MAGIC, PY38_MAGIC, 0))
+    new_toc = []
+    converted = failed = 0
+    func = partial(convert_pyz_entry, cfg=cfg, rule_applier=rule_applier)
+    for (name, (typecode, pos, length)), data in run_pool_ordered(func, iter_entries(), jobs):
+        if data is None:
+            if typecode in PYZ_CODE_TYPES:
+                logger.error(f'failed to convert {name}, copied as it is')
+                failed += 1
+            src.seek(src_offset + pos)
+            data = src.read(length)
+        else:
+            converted += 1
+        new_toc.append((name, (typecode, dst.tell() - dst_offset, len(data))))
+        dst.write(data)
+
+    new_toc_offset = dst.tell() - dst_offset
+    dst.write(dumps(dict(new_toc) if isinstance(toc, dict) else new_toc))
+    end = dst.tell()
+    dst.seek(dst_offset)
+    dst.write(pack(PYZ_HEADER_FMT, PYZ_MAGIC, PY38_MAGIC, new_toc_offset))
+    dst.seek(end)
+    return end - dst_offset, converted, failed
+
+
+def convert_carchive(input_path: str, output_path: str, cfg: Config, rule_applier: RULE_APPLIER,
+                     jobs: Optional[int] = None) -> bool:
+    """
+    convert the bytecode in a PyInstaller executable into a new one
+
+    the scripts and modules in the CArchive and the PYZ archive are converted, with the offsets,
+    the TOCs and the cookie rewritten, everything else is copied as it is
+
+    :param input_path: input executable path
+    :param output_path: output executable path
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param jobs: number of worker processes (default: number of CPUs)
+    :return: True if all the bytecode is converted, False if not
+    """
+    converted = failed = 0
+    try:
+        with open(input_path, 'rb') as fp, atomic_open(output_path) as out:
+            cookie_offset = find_cookie(fp)
+            end = fp.seek(0, 2)
+            fp.seek(cookie_offset)
+            _, archive_len, toc_offset, toc_len, pyvers, pylib_name = unpack(COOKIE_FMT, fp.read(COOKIE_SIZE))
+            start = cookie_offset + COOKIE_SIZE - archive_len
+            entries = read_toc(fp, start + toc_offset, toc_len)
+
+            # the bootloader
+            fp.seek(0)
+            copy_range(fp, out, start)
+            for entry in entries:
+                fp.seek(start + entry.offset)
+                new_offset = out.tell() - start
+                if entry.typecode == PYZ_TYPECODE:
+                    if entry.compressed:
+                        src, src_offset = BytesIO(decompress(fp.read(entry.compressed_size))), 0
+                        dst = BytesIO()
+                    else:
+                        src, src_offset, dst = fp, start + entry.offset, out
+                    size, pyz_converted, pyz_failed = convert_pyz(src, src_offset, entry.size, dst,
+                                                                  cfg, rule_applier, jobs)
+                    converted += pyz_converted
+                    failed += pyz_failed
+                    entry.size = entry.compressed_size = size
+                    if entry.compressed:
+                        data = compress(dst.getvalue(), ZLIB_LEVEL)
+                        entry.compressed_size = len(data)
+                        out.write(data)
+                elif entry.typecode in CODE_TYPECODES:
+                    data = fp.read(entry.compressed_size)
+                    name = entry.name.decode()
+                    if (new_data := convert_code(name, decompress(data) if entry.compressed else data,
+                                                 cfg, rule_applier)) is None:
+                        logger.error(f'failed to convert {name}, copied as it is')
+                        failed += 1
+                    else:
+                        converted += 1
+                        entry.size = len(new_data)
+                        data = compress(new_data, ZLIB_LEVEL) if entry.compressed else new_data
+                        entry.compressed_size = len(data)
+                    out.write(data)
+                else:
+                    copy_range(fp, out, entry.compressed_size)
+                entry.offset = new_offset
+
+            new_toc_offset = out.tell() - start
+            for entry in entries:
+                out.write(entry.pack())
+            new_toc_len = out.tell() - start - new_toc_offset
+            # PyInstaller 5 and later writes 309 for 3.9, 39 before that
+            new_pyvers = PY38_VER[0] * (100 if pyvers >= 100 else 10) + PY38_VER[1]
+            out.write(pack(COOKIE_FMT, COOKIE_MAGIC, out.tell() + COOKIE_SIZE - start,
+                           new_toc_offset, new_toc_len, new_pyvers, pylib_name))
+            # anything after the cookie, like a signature
+            fp.seek(cookie_offset + COOKIE_SIZE)
+            copy_range(fp, out, end - cookie_offset - COOKIE_SIZE)
+    except (OSError, IOError, ValueError, EOFError, ZlibError):
+        print_exc()
+        return False
+
+    logger.info(f'{converted} code objects converted, {failed} failed')
+    return not failed
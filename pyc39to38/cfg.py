@@ -2,6 +2,11 @@
 some configurable options
 """
 
+from typing import (
+    Optional,
+    List
+)
+
 
 class Config:
     def __init__(self):
@@ -10,3 +15,19 @@ class Config:
         self.preserve_lineno_after_extarg = False
         # disable the "finally" block patching
         self.no_begin_finally = False
+        # disable the list creation patching, it's only turned off for the degraded code objects
+        self.no_list_from_tuple = False
+        # convert the code objects in place and release each one once it is done,
+        # keeps the peak memory usage low for huge files
+        self.low_memory = False
+        # check the converted code objects for broken stack depth and jumps before writing
+        self.verify = False
+        # glob patterns of the qualified names of the code objects to convert, with the ones defined in them
+        # and the ones they are defined in, the rest are replaced with stubs (None is all of them)
+        self.only: Optional[List[str]] = None
+        # retry a code object failing to convert without the "finally" block patching, then also without
+        # the list creation patching, instead of failing the whole file
+        self.degrade = False
+        # thread the jump chains and drop the jumps to the next instruction after the rules,
+        # for a smaller output with fewer EXTENDED_ARG
+        self.optimize = False
@@ -0,0 +1,202 @@
+"""
+handing the converted code objects to a decompiler in the same process, no 3.8 bytecode file is written
+
+the decompilers are optional, decompyle3 and uncompyle6 are supported
+"""
+
+from functools import (
+    partial,
+    lru_cache
+)
+from importlib import import_module
+from io import StringIO
+from logging import getLogger
+from os import makedirs
+from os.path import (
+    join,
+    relpath,
+    dirname
+)
+from time import perf_counter
+from typing import (
+    Optional,
+    Callable,
+    Iterable,
+    Iterator,
+    Tuple,
+    Dict,
+    Any
+)
+
+from .load import load_pyc
+from .asm import convert_pyc
+from .archive import rename_member
+from .batch import (
+    find_pycs,
+    run_pool
+)
+from .rules import RULE_APPLIER
+from .cfg import Config
+from .utils import atomic_open
+from . import (
+    FILE_ENCODING,
+    PY38_VER,
+    PY39_VER,
+    PYC_SUFFIX
+)
+
+
+logger = getLogger('decompile')
+
+# in the order they are tried
+DECOMPILERS = ('decompyle3', 'uncompyle6')
+
+PY_SUFFIX = '.py'
+
+# the stages of each file, in order
+STAGES = ('load', 'convert', 'decompile', 'write')
+
+REPORT = Dict[str, Any]
+# input path, output path
+DECOMPILE_ITEM = Tuple[str, str]
+
+
+@lru_cache(maxsize=None)
+def load_decompiler(name: Optional[str] = None) -> Optional[Tuple[str, Callable]]:
+    """
+    import a decompiler, once per process
+
+    :param name: name of the decompiler, None for the first one installed
+    :return: name and decompile function of the decompiler, None if not installed
+    """
+    for candidate in DECOMPILERS if name is None else (name,):
+        try:
+            return candidate, import_module(f'{candidate}.main').decompile
+        except ImportError:
+            continue
+    return None
+
+
+def source_name(rel_input: str) -> str:
+    """
+    get the name of the source file of a bytecode file, like foo.cpython-39.pyc -> foo.py
+    """
+    rel_input = rename_member(rel_input)
+    base = rel_input[:-len(PYC_SUFFIX)] if rel_input.endswith(PYC_SUFFIX) else rel_input
+    if (tag := base.rfind('.cpython-')) >= 0:
+        base = base[:tag]
+    return base + PY_SUFFIX
+
+
+def decompile_file(item: DECOMPILE_ITEM, cfg: Config, rule_applier: RULE_APPLIER,
+                   decompiler: Optional[str] = None) -> REPORT:
+    """
+    convert a bytecode file and decompile the code objects right away, run in the worker processes
+
+    the output of a failed decompilation is still written, the decompilers mark where they stopped
+
+    :param item: input path and output path
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param decompiler: name of the decompiler, None for the first one installed
+    :return: report of the file, with the seconds taken by each stage
+    """
+    input_path, output_path = item
+    report: REPORT = {
+        'path': input_path,
+        'ok': False,
+        'error': None,
+        'timings': dict.fromkeys(STAGES, 0.0)
+    }
+    timings = report['timings']
+    if (loaded := load_decompiler(decompiler)) is None:
+        report['error'] = 'no decompiler installed'
+        return report
+    name, decompile = loaded
+
+    start = perf_counter()
+    try:
+        pyc = load_pyc(input_path, PY39_VER, cfg.low_memory or cfg.only is not None)
+    except Exception as e:
+        # a corrupted file can fail in many ways inside xdis
+        report['error'] = f'failed to load: {e.__class__.__name__}: {e}'
+        return report
+    timings['load'] = perf_counter() - start
+    if pyc is None:
+        report['error'] = 'failed to load'
+        return report
+
+    start = perf_counter()
+    try:
+        new_asm = convert_pyc(pyc, cfg, rule_applier)
+    except Exception as e:
+        # don't let a single file take down the whole batch
+        report['error'] = f'conversion failed: {e.__class__.__name__}: {e}'
+        return report
+    timings['convert'] = perf_counter() - start
+    if new_asm is None:
+        report['error'] = 'conversion failed'
+        return report
+
+    start = perf_counter()
+    out = StringIO()
+    try:
+        # the first one is the module itself
+        decompile(new_asm.code_list[0], PY38_VER, out, timestamp=pyc.timestamp, source_size=pyc.size,
+                  is_pypy=pyc.is_pypy)
+    except Exception as e:
+        # the decompilers have their own errors, not worth importing them for this
+        report['error'] = f'{name} failed: {e.__class__.__name__}: {e}'
+    timings['decompile'] = perf_counter() - start
+
+    start = perf_counter()
+    try:
+        makedirs(dirname(output_path) or '.', exist_ok=True)
+        with atomic_open(output_path) as fp:
+            fp.write(out.getvalue().encode(FILE_ENCODING))
+    except (OSError, IOError) as e:
+        report['error'] = f'failed to write: {e}'
+        return report
+    timings['write'] = perf_counter() - start
+    report['ok'] = report['error'] is None
+    return report
+
+
+def decompile_files(items: Iterable[DECOMPILE_ITEM], cfg: Config, rule_applier: RULE_APPLIER,
+                    decompiler: Optional[str] = None, jobs: Optional[int] = None) -> Iterator[REPORT]:
+    """
+    convert and decompile bytecode files in worker processes
+
+    :param items: input path and output path of each file
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param decompiler: name of the decompiler, None for the first one installed
+    :param jobs: number of worker processes (default: number of CPUs)
+    :return: iterator of the reports of each file, in the order they are done
+    """
+    return run_pool(partial(decompile_file, cfg=cfg, rule_applier=rule_applier, decompiler=decompiler), items, jobs)
+
+
+def decompile_tree(input_root: str, output_root: str) -> Iterator[DECOMPILE_ITEM]:
+    """
+    pair the bytecode files under a directory with the source files to write in another one
+
+    :param input_root: input directory
+    :param output_root: output directory
+    :return: iterator of input path and output path
+    """
+    for input_path in find_pycs(input_root):
+        yield input_path, join(output_root, source_name(relpath(input_path, input_root)))
+
+
+def log_timings(reports: Iterable[REPORT]):
+    """
+    log the total seconds taken by each stage
+    """
+    totals = dict.fromkeys(STAGES, 0.0)
+    count = 0
+    for report in reports:
+        count += 1
+        for stage, seconds in report['timings'].items():
+            totals[stage] += seconds
+    logger.info(f'{count} files, ' + ', '.join(f'{stage} {seconds:.2f}s' for stage, seconds in totals.items()))
@@ -0,0 +1,96 @@
+"""
+bytecode emitter
+"""
+
+from types import ModuleType
+from typing import (
+    Dict,
+    Set
+)
+
+from xdis.cross_dis import op_has_argument
+
+from .patch import Code38WithInstructions
+from .utils import (
+    Instruction,
+    genlinestarts
+)
+
+
+EXTENDED_ARG = 'EXTENDED_ARG'
+
+# every instruction is a 16-bit word since 3.6
+INST_SIZE = 2
+ARG_BITS = 8
+ARG_MASK = (1 << ARG_BITS) - 1
+
+
+def resolve_arg(opc: ModuleType, inst: Instruction, label: Dict[int, int], backpatch_inst: Set[Instruction]) -> int:
+    """
+    get the real integer argument of an instruction
+
+    :param opc: opcode map (it's a module ig)
+    :param inst: the instruction
+    :param label: label id to offset mapping
+    :param backpatch_inst: jump instructions with label id as target
+    :return: the argument, 0 if the instruction takes no argument
+
+    :raises ValueError: if the label cannot be dereferenced or the argument is invalid
+    """
+    if inst in backpatch_inst:
+        try:
+            target = label[inst.arg]
+        except KeyError:
+            raise ValueError(f'unknown label {inst.arg!r} for {inst.opname} at offset {inst.offset}')
+        if inst.opcode in opc.JREL_OPS:
+            arg = target - inst.offset - INST_SIZE
+        elif inst.opcode in opc.JABS_OPS:
+            arg = target
+        else:
+            raise ValueError(f'unsupported jump opcode {inst.opname} at offset {inst.offset}')
+    elif not op_has_argument(inst.opcode, opc) or inst.arg is None:
+        arg = 0
+    elif isinstance(inst.arg, int):
+        arg = inst.arg
+    else:
+        raise ValueError(f'non-integer argument {inst.arg!r} for {inst.opname} at offset {inst.offset}')
+    if arg < 0:
+        raise ValueError(f'negative argument {arg} for {inst.opname} at offset {inst.offset}')
+    return arg
+
+
+def emit_code(opc: ModuleType, code: Code38WithInstructions,
+              label: Dict[int, int], backpatch_inst: Set[Instruction]) -> Code38WithInstructions:
+    """
+    assemble the instructions into co_code and freeze the code object
+
+    the instructions must already be laid out, i.e. every offset is final and
+    every argument that doesn't fit in one byte is preceded by the EXTENDED_ARG(s) it needs
+
+    :param opc: opcode map (it's a module ig)
+    :param code: the code object to assemble, co_lnotab is a Dict[int, int] of offset to line_no
+    :param label: label id to offset mapping
+    :param backpatch_inst: jump instructions with label id as target
+    :return: the frozen code object (the same one as the input)
+
+    :raises ValueError: if the instructions or the line-number info are invalid
+    """
+    extended_arg = opc.opmap[EXTENDED_ARG]
+    co_code = bytearray(len(code.instructions) * INST_SIZE)
+    # the part of the argument already provided by the preceding EXTENDED_ARG(s)
+    ext = 0
+    for i, inst in enumerate(code.instructions):
+        offset = i * INST_SIZE
+        if inst.offset != offset:
+            raise ValueError(f'{inst.opname} at idx {i} has offset {inst.offset}, expected {offset}')
+        arg = resolve_arg(opc, inst, label, backpatch_inst)
+        if arg >> ARG_BITS != ext:
+            raise ValueError(f'argument {arg} of {inst.opname} at offset {offset} '
+                             f'does not match its EXTENDED_ARG prefix ({ext})')
+        co_code[offset] = inst.opcode
+        co_code[offset + 1] = arg & ARG_MASK
+        ext = arg if inst.opcode == extended_arg else 0
+
+    code.co_code = bytes(co_code)
+    code.co_lnotab = genlinestarts(code)
+    return code.freeze()
@@ -49,7 +49,7 @@ def find_inst(insts: List[Instruction], offset: int) -> int:
 
 
 def insert_inst(patcher: InPlacePatcher, opc: ModuleType, idx: int,
-                inst: Instruction, label: Optional[str], shift_line_no: bool = False):
+                inst: Instruction, label: Optional[int], shift_line_no: bool = False):
     """
     insert instruction at idx
 
@@ -65,7 +65,7 @@ def insert_inst(patcher: InPlacePatcher, opc: ModuleType, idx: int,
 
 
 def insert_insts(patcher: InPlacePatcher, opc: ModuleType, idx: int, inst: List[Instruction],
-                 label: Optional[str], shift_line_no: bool = False):
+                 label: Optional[int], shift_line_no: bool = False):
     """
     Insert multiple instructions at the given index
 
@@ -84,7 +84,7 @@ def insert_insts(patcher: InPlacePatcher, opc: ModuleType, idx: int, inst: List[
 
 
 def remove_insts(patcher: InPlacePatcher,
-                 idx: int, count: int) -> List[Tuple[Instruction, bool, Optional[str], Optional[int]]]:
+                 idx: int, count: int) -> List[Tuple[Instruction, bool, Optional[int], Optional[int]]]:
     """
     remove instructions at idx
 
@@ -92,7 +92,7 @@ def remove_insts(patcher: InPlacePatcher,
     :param idx: the index to remove at
     :param count: number of instructions to remove
     :return: list of tuple of instruction, whether it needs to be backpatched,
-             and label name (if any), line number (if any)
+             and label id (if any), line number (if any)
     """
     buff = []
     for _ in range(count):
@@ -102,7 +102,7 @@ def remove_insts(patcher: InPlacePatcher,
 
 
 def replace_op_with_inst(patcher: InPlacePatcher, opc: ModuleType,
-                         opname: str, callback: REPLACE_OP_WITH_INST_CALLBACK):
+                         opname: str, callback: REPLACE_OP_WITH_INST_CALLBACK) -> int:
     """
     replace all matching op by given opname with the given instruction
 
@@ -110,7 +110,9 @@ def replace_op_with_inst(patcher: InPlacePatcher, opc: ModuleType,
     :param opc: the opcode map (it's a module ig)
     :param opname: name of instruction to search
     :param callback: callback to get the instruction to replace with
+    :return count of instructions replaced
     """
+    count = 0
     while (idx := find_op(patcher.code.instructions, opname)) != -1:
         inst, _, label, line_no = patcher.pop_inst(idx)
         inst = callback(opc, inst)
@@ -118,6 +120,8 @@ def replace_op_with_inst(patcher: InPlacePatcher, opc: ModuleType,
         # restore line number if any
         if line_no is not None:
             patcher.code.co_lnotab[inst.offset] = line_no
+        count += 1
+    return count
 
 
 def replace_op_with_insts(patcher: InPlacePatcher, opc: ModuleType, opname: str,
@@ -0,0 +1,245 @@
+"""
+bytecode loader
+"""
+
+from types import ModuleType
+from fnmatch import fnmatchcase
+from logging import getLogger
+from typing import (
+    Optional,
+    BinaryIO,
+    Iterable,
+    Iterator,
+    List,
+    Dict,
+    Set,
+    Tuple
+)
+
+from xdis.load import (
+    load_module,
+    load_module_from_file_object
+)
+from xdis.disasm import get_opcode
+from xdis.version_info import version_tuple_to_str
+from xdis.codetype import codeType2Portable
+from xdis.codetype.base import iscode
+from xdis.codetype.code38 import Code38
+
+from .patch import Code38WithInstructions
+from .utils import Instruction
+from .emit import (
+    INST_SIZE,
+    ARG_BITS
+)
+
+
+logger = getLogger('load')
+
+MODULE_QUALNAME = '<module>'
+
+CO_NEWLOCALS = 0x2
+
+# the fields of a code object that have to be mutable for the patcher
+MUTABLE_FIELDS = ('co_consts', 'co_names', 'co_varnames', 'co_freevars', 'co_cellvars')
+
+
+class LoadedPyc:
+    """
+    a loaded bytecode file, every code object comes with its instructions, labels and backpatch tags
+
+    the code objects are stored children first, the last one is the module itself
+    """
+
+    def __init__(self, version: Tuple[int, ...], timestamp: int, is_pypy: bool, size: int):
+        self.version = version
+        self.timestamp = timestamp
+        self.is_pypy = is_pypy
+        # size of the source code
+        self.size = size
+        self.codes: List[Code38WithInstructions] = []
+        # label id to offset mapping, one for each code object
+        self.label: List[Dict[int, int]] = []
+        # jump instructions, one set for each code object
+        self.backpatch: List[Set[Instruction]] = []
+        # qualified name of each code object, like __qualname__
+        self.qualnames: List[str] = []
+        # opcode map (it's a module ig), for decoding lazily
+        self.opc: Optional[ModuleType] = None
+
+    def iter_codes(self, release: bool = False, skip: Optional[Set[int]] = None) -> Iterator[
+            Tuple[Code38WithInstructions, Optional[Dict[int, int]], Optional[Set[Instruction]]]]:
+        """
+        iterate the code objects children first, decode them if they were loaded lazily
+
+        :param release: drop the references to each code object once the next one is requested
+        :param skip: indexes of the code objects not to decode, they come with None as labels and jump instructions
+        :return: iterator of code object, labels, jump instructions
+        """
+        for idx in range(len(self.codes)):
+            code = self.codes[idx]
+            if idx < len(self.label):
+                label, backpatch_inst = self.label[idx], self.backpatch[idx]
+            elif skip is not None and idx in skip:
+                label = backpatch_inst = None
+            else:
+                code.instructions, label, backpatch_inst = decode_insts(self.opc, code)
+            if release:
+                self.codes[idx] = None
+                if idx < len(self.label):
+                    self.label[idx] = self.backpatch[idx] = None
+            yield code, label, backpatch_inst
+
+    def select(self, patterns: Iterable[str]) -> Set[int]:
+        """
+        find the code objects whose qualified names match any of the glob patterns,
+        together with everything defined in them, and everything they are defined in
+
+        :param patterns: glob patterns of the qualified names, like MyClass.* or func.<locals>.*
+        :return: indexes of the code objects
+        """
+        patterns = list(patterns)
+        index = {id(code): idx for idx, code in enumerate(self.codes)}
+        parents: Dict[int, int] = {}
+        children: Dict[int, List[int]] = {}
+        for idx, code in enumerate(self.codes):
+            for const in code.co_consts:
+                if iscode(const) and (child := index.get(id(const))) is not None:
+                    parents[child] = idx
+                    children.setdefault(idx, []).append(child)
+
+        selected: Set[int] = set()
+        todo = [idx for idx, qualname in enumerate(self.qualnames)
+                if any(fnmatchcase(qualname, pattern) for pattern in patterns)]
+        while todo:
+            if (idx := todo.pop()) not in selected:
+                selected.add(idx)
+                todo.extend(children.get(idx, ()))
+        for idx in list(selected):
+            while (idx := parents.get(idx)) is not None and idx not in selected:
+                selected.add(idx)
+        return selected
+
+
+def decode_insts(opc: ModuleType, code: Code38) -> Tuple[List[Instruction], Dict[int, int], Set[Instruction]]:
+    """
+    decode co_code into instructions
+
+    the arg of a jump is left as it is in co_code, and the target gets a label whose id is its offset
+
+    :param opc: opcode map (it's a module ig)
+    :param code: the code object to decode
+    :return: instructions, labels, jump instructions
+    """
+    co_code = code.co_code
+    opname = opc.opname
+    have_argument = opc.HAVE_ARGUMENT
+    extended_arg = opc.EXTENDED_ARG
+    jrel_ops = opc.JREL_OPS
+    jabs_ops = opc.JABS_OPS
+
+    insts: List[Instruction] = []
+    label: Dict[int, int] = {}
+    backpatch_inst: Set[Instruction] = set()
+    ext = 0
+    for offset in range(0, len(co_code), INST_SIZE):
+        opcode = co_code[offset]
+        if opcode >= have_argument:
+            arg = co_code[offset + 1] | ext
+            ext = arg << ARG_BITS if opcode == extended_arg else 0
+        else:
+            arg = None
+            ext = 0
+        inst = Instruction(opname[opcode], opcode, arg, offset)
+        insts.append(inst)
+        if opcode in jrel_ops:
+            target = offset + INST_SIZE + arg
+        elif opcode in jabs_ops:
+            target = arg
+        else:
+            continue
+        label[target] = target
+        backpatch_inst.add(inst)
+    return insts, label, backpatch_inst
+
+
+def load_pyc(path: str, expect_version: Tuple[int, ...], lazy: bool = False,
+             fp: Optional[BinaryIO] = None) -> Optional[LoadedPyc]:
+    """
+    load a bytecode file and decode every code object in it
+
+    :param path: path of the bytecode file, or only its name for the messages if fp is given
+    :param expect_version: the bytecode version the file must be
+    :param lazy: leave the decoding to LoadedPyc.iter_codes, so that only one code object is decoded at a time
+    :param fp: read the bytecode from this file object instead of the path, it's closed when done
+    :return: the loaded file, None if the version doesn't match
+
+    :raises OSError: if failed to read the file
+    """
+    if fp is None:
+        version, timestamp, _, co, is_pypy, source_size, _ = load_module(path)
+    else:
+        version, timestamp, _, co, is_pypy, source_size, _ = load_module_from_file_object(fp, path)
+    if version != expect_version:
+        logger.error(f'input bytecode version is not {version_tuple_to_str(expect_version, end=2)}')
+        return None
+    opc = get_opcode(version, is_pypy)
+    pyc = LoadedPyc(version, timestamp, is_pypy, source_size or 0)
+    pyc.opc = opc
+
+    # walk the code objects children first, so that they are done before their parents
+    # (iterative, because the nesting of generated code can be very deep)
+    stack = [(to_mutable(co, version), MODULE_QUALNAME, False)]
+    while stack:
+        code, qualname, visited = stack.pop()
+        if visited:
+            pyc.codes.append(code)
+            pyc.qualnames.append(qualname)
+            if not lazy:
+                code.instructions, label, backpatch_inst = decode_insts(opc, code)
+                pyc.label.append(label)
+                pyc.backpatch.append(backpatch_inst)
+            continue
+        stack.append((code, qualname, True))
+        for idx in range(len(code.co_consts) - 1, -1, -1):
+            const = code.co_consts[idx]
+            if iscode(const):
+                code.co_consts[idx] = const = to_mutable(const, version)
+                stack.append((const, child_qualname(code, qualname, const.co_name), False))
+    return pyc
+
+
+def to_mutable(code, version: Tuple[int, ...]) -> Code38WithInstructions:
+    """
+    make sure the code object is a portable one with mutable fields
+
+    :param code: a native or portable code object
+    :param version: bytecode version of the code object
+    :return: the portable code object
+    """
+    if not isinstance(code, Code38):
+        code = codeType2Portable(code, version)
+    for field in MUTABLE_FIELDS:
+        val = getattr(code, field)
+        if not isinstance(val, list):
+            setattr(code, field, list(val))
+    return code
+
+
+def child_qualname(parent: Code38, parent_qualname: str, name: str) -> str:
+    """
+    get the qualified name of a code object the same way as __qualname__
+
+    :param parent: the code object containing it
+    :param parent_qualname: qualified name of the parent
+    :param name: co_name of the code object
+    :return: the qualified name
+    """
+    if parent_qualname == MODULE_QUALNAME:
+        return name
+    elif parent.co_flags & CO_NEWLOCALS:
+        # defined in a function
+        return f'{parent_qualname}.<locals>.{name}'
+    else:
+        # defined in a class body
+        return f'{parent_qualname}.{name}'
@@ -0,0 +1,153 @@
+"""
+optional jump optimization, run after the rules to make the output smaller
+"""
+
+from typing import (
+    Optional,
+    Dict
+)
+
+from xdis.cross_dis import op_size
+
+from .patch import InPlacePatcher
+from .utils import Instruction
+from .emit import (
+    resolve_arg,
+    INST_SIZE,
+    ARG_BITS
+)
+
+
+# names of the counters in InPlacePatcher.stats
+OPT_THREADED = 'threaded_jumps'
+OPT_DROPPED = 'dropped_jumps'
+OPT_SAVED_BYTES = 'saved_bytes'
+
+JUMP_FORWARD = 'JUMP_FORWARD'
+JUMP_ABSOLUTE = 'JUMP_ABSOLUTE'
+UNCONDITIONAL_JUMPS = (JUMP_FORWARD, JUMP_ABSOLUTE)
+# the jumps that only go somewhere, a chain of jumps can be cut short for them
+# (not SETUP_* or FOR_ITER, their targets mean more than that)
+THREADABLE_JUMPS = UNCONDITIONAL_JUMPS + (
+    'POP_JUMP_IF_FALSE',
+    'POP_JUMP_IF_TRUE',
+    'JUMP_IF_FALSE_OR_POP',
+    'JUMP_IF_TRUE_OR_POP'
+)
+
+
+def inst_size(patcher: InPlacePatcher, inst: Instruction) -> int:
+    """
+    estimate the size of an instruction with the EXTENDED_ARG it needs, from the current offsets
+    """
+    arg = resolve_arg(patcher.opc, inst, patcher.label, patcher.backpatch_inst)
+    size = INST_SIZE
+    while arg := arg >> ARG_BITS:
+        size += INST_SIZE
+    return size
+
+
+def estimate_size(patcher: InPlacePatcher) -> int:
+    """
+    estimate the size of co_code once the EXTENDED_ARG are added back, from the current offsets
+    """
+    return sum(inst_size(patcher, inst) for inst in patcher.code.instructions)
+
+
+def thread_jumps(patcher: InPlacePatcher) -> int:
+    """
+    retarget the jumps to an unconditional jump at the target of that jump
+
+    a jump with a line number is kept as a target, so that no line event is skipped,
+    and a jump isn't retargeted if the new target needs more EXTENDED_ARG
+
+    :return: how many jumps are retargeted
+    """
+    by_offset = {inst.offset: inst for inst in patcher.code.instructions}
+    count = 0
+    for inst in patcher.backpatch_inst:
+        if inst.opname not in THREADABLE_JUMPS:
+            continue
+        arg = inst.arg
+        seen = {inst}
+        while (target := by_offset.get(patcher.label[arg])) is not None \
+                and target.opname in UNCONDITIONAL_JUMPS and target not in seen \
+                and target.offset not in patcher.code.co_lnotab:
+            # a relative jump can only go forward
+            if inst.opcode in patcher.opc.JREL_OPS and patcher.label[target.arg] <= inst.offset:
+                break
+            seen.add(target)
+            arg = target.arg
+        if arg != inst.arg:
+            old_arg, old_size = inst.arg, inst_size(patcher, inst)
+            inst.arg = arg
+            if inst_size(patcher, inst) > old_size:
+                inst.arg = old_arg
+            else:
+                count += 1
+    return count
+
+
+def drop_jumps_to_next(patcher: InPlacePatcher) -> int:
+    """
+    remove the unconditional jumps to the next instruction
+
+    the line number of a removed jump goes to the next instruction,
+    so a jump is kept if both of them have one
+
+    :return: how many jumps are removed
+    """
+    insts = patcher.code.instructions
+    lnotab = patcher.code.co_lnotab
+    count = 0
+    # from the end, so that the indexes before stay the same
+    for idx in range(len(insts) - 2, -1, -1):
+        inst = insts[idx]
+        if inst.opname not in UNCONDITIONAL_JUMPS:
+            continue
+        next_offset = inst.offset + op_size(inst.opcode, patcher.opc)
+        if patcher.label[inst.arg] != next_offset:
+            continue
+        if inst.offset in lnotab and next_offset in lnotab:
+            continue
+        next_label: Optional[int] = None
+        for iterating_label, label_off in patcher.label.items():
+            if label_off == next_offset:
+                next_label = iterating_label
+                break
+
+        _, _, label, line_no = patcher.pop_inst(idx)
+        next_inst = insts[idx]
+        if label is not None:
+            if next_label is not None:
+                # redirect all reference of the removed label to the label of next inst
+                for jump in patcher.backpatch_inst:
+                    if jump.arg == label:
+                        jump.arg = next_label
+            else:
+                patcher.label[label] = next_inst.offset
+        if line_no is not None:
+            lnotab[next_inst.offset] = line_no
+        count += 1
+    return count
+
+
+def optimize_jumps(patcher: InPlacePatcher):
+    """
+    thread the jump chains and drop the jumps to the next instruction,
+    the counts and the estimated bytes saved go to the stats of the patcher
+    """
+    before = estimate_size(patcher)
+    patcher.stats[OPT_THREADED] += thread_jumps(patcher)
+    patcher.stats[OPT_DROPPED] += drop_jumps_to_next(patcher)
+    patcher.stats[OPT_SAVED_BYTES] += before - estimate_size(patcher)
+
+
+def pop_opt_stats(stats: Dict[str, int]) -> Dict[str, int]:
+    """
+    take the counters of the optimization out of the counters of the rules
+
+    :param stats: the counters of a file
+    :return: the counters of the optimization
+    """
+    return {name: stats.pop(name, 0) for name in (OPT_THREADED, OPT_DROPPED, OPT_SAVED_BYTES)}
@@ -6,14 +6,14 @@ from typing import (
     Optional,
     List,
     Dict,
-    Set
+    Set,
+    Counter
 )
 from types import ModuleType
 
 from xdis.codetype.code38 import Code38
 from .utils import Instruction
 from xdis.cross_dis import op_size
-from xasm.assemble import is_int
 
 
 # making IDE happy
@@ -28,43 +28,28 @@ class InPlacePatcher:
     """
 
     def __init__(self, opc: ModuleType, code: Code38WithInstructions,
-                 label: Dict[str, int], backpatch_inst: Set[Instruction]):
+                 label: Dict[int, int], backpatch_inst: Set[Instruction]):
         # opcode map (it's a module ig)
         self.opc = opc
         # code.co_lnotab is a Dict[int, int], where the first int is offset, the second is line_no
         self.code = code
-        # label is a Dict[str, int], where str is label name, int is offset
+        # label is a Dict[int, int], where the first int is label id, the second is offset
+        # (the ids are the offsets of the targets in the input, they stay the same when the code moves)
         self.label = label
-        # a set of jump instructions with string label as target,
-        # these have to be patched to int offset later in create_code
+        # a set of jump instructions with label id as target,
+        # these have to be patched to the offset later in emit_code
         self.backpatch_inst = backpatch_inst
-
-    def get_inst2label(self, idx: int) -> Dict[Instruction, str]:
-        """
-        get a dict of instruction to label name
-
-        :param idx: start index of instruction to iterate
-        :return: dict of instruction to label name
-        """
-        inst2label = {}
-        for inst in self.code.instructions[idx:]:
-            for _label, _offset in self.label.items():
-                if _offset == inst.offset:
-                    inst2label[inst] = _label
-                    break
-        return inst2label
+        # how many times each rule is applied, the rules count by themselves
+        self.stats: Counter[str] = Counter()
 
     def need_backpatch(self, inst: Instruction) -> bool:
         """
-        check if instruction needs backpatching
+        check if instruction needs backpatching, i.e. it's a jump (every jump has a label id as target)
 
         :param inst: instruction to check
         :return: whether it needs backpatching
         """
-        if inst.opcode in self.opc.JUMP_OPS:
-            if not is_int(inst.arg):
-                return True
-        return False
+        return inst.opcode in self.opc.JUMP_OPS
 
     def shift_line_no(self, offset: int, val: int, allow_equal: bool = False):
         """
@@ -102,7 +87,7 @@ class InPlacePatcher:
                 new_lnotab[new_off] = line_no
         self.code.co_lnotab = new_lnotab
 
-    def pop_inst(self, idx: int) -> (Instruction, bool, Optional[str], Optional[int]):
+    def pop_inst(self, idx: int) -> (Instruction, bool, Optional[int], Optional[int]):
         """
         remove instruction at idx
 
@@ -111,35 +96,30 @@ class InPlacePatcher:
 
         :param idx: index of instruction to remove
         :return: removed instruction, whether it is in backpatch_inst,
-                 and label name if present, line number (if any)
+                 and label id if present, line number (if any)
         """
-        # backup inst to label mapping
-        old_inst2label = self.get_inst2label(idx + 1)
-
         popped_inst = self.code.instructions.pop(idx)
 
         backpatch = popped_inst in self.backpatch_inst
         if backpatch:
             self.backpatch_inst.remove(popped_inst)
 
-        # remove label if present
+        # get the size of the popped instruction
+        size = op_size(popped_inst.opcode, self.opc)
+
+        # find the label if present, the labels after it move with their instructions
         label = None
         for _label, _offset in self.label.items():
             if _offset == popped_inst.offset:
                 label = _label
-                break
+            elif _offset > popped_inst.offset:
+                self.label[_label] = _offset - size
         if label is not None:
             del self.label[label]
 
-        # get the size of the popped instruction
-        size = op_size(popped_inst.opcode, self.opc)
-
         # adjust offset of all instructions after popping
         for inst in self.code.instructions[idx:]:
             inst.offset -= size
-            _label = old_inst2label.get(inst)
-            if _label is not None:
-                self.label[_label] = inst.offset
 
         # remove line number at offset if any
         line_no = None
@@ -152,20 +132,20 @@ class InPlacePatcher:
         return popped_inst, backpatch, label, line_no
 
     def insert_inst(self, inst: Instruction, size: int, idx: int,
-                    label: Optional[str] = None, shift_line_no: bool = False):
+                    label: Optional[int] = None, shift_line_no: bool = False):
         """
         insert instruction at idx
 
         :param inst: instruction to insert
         :param size: size of the instruction
         :param idx: index to insert at
-        :param label: label name, None means not to add label
+        :param label: label id, None means not to add label
         :param shift_line_no: whether to shift the line number at the offset if any (default: False)
 
-        :raises ValueError: if a label with the same name already exists
+        :raises ValueError: if a label with the same id already exists
         """
-        # backup inst to label mapping
-        old_inst2label = self.get_inst2label(idx)
+        if label is not None and label in self.label:
+            raise ValueError('Label %r already exists' % label)
 
         # first calc offset for the inserting instruction
         if idx < 0:
@@ -185,52 +165,18 @@ class InPlacePatcher:
         if self.need_backpatch(inst):
             self.backpatch_inst.add(inst)
 
+        # the labels from here on move with their instructions
+        for _label, _offset in self.label.items():
+            if _offset >= offset:
+                self.label[_label] = _offset + size
+
         # add label if present
         if label is not None:
-            if label in self.label:
-                raise ValueError('Label %r already exists' % label)
-            else:
-                self.label[label] = offset
+            self.label[label] = offset
 
         # adjust offset of all instructions after insertion
         for _inst in self.code.instructions[idx + 1:]:
             _inst.offset += size
-            _label = old_inst2label.get(_inst)
-            if _label is not None:
-                self.label[_label] = _inst.offset
 
         # shift line number
         self.shift_line_no(offset, size, shift_line_no)
-
-    def fix_label(self):
-        """
-        fix label names
-
-        :raises ValueError: if label already exists (well, it shouldn't. if it does, it's our bug)
-        """
-        new_label = {}
-        for _label, _offset in self.label.items():
-            pretty = f'L{_offset}'
-            if pretty in new_label:
-                raise ValueError('Label %r already exists' % pretty)
-            else:
-                new_label[pretty] = _offset
-        self.label = new_label
-
-    def fix_backpatch(self):
-        """
-        fix backpatch tags
-        """
-        for inst in self.backpatch_inst:
-            _label = inst.arg
-            label = self.label[_label]
-            new = f'L{label}'
-            if new != _label:
-                inst.arg = new
-
-    def fix_all(self):
-        """
-        fix all
-        """
-        self.fix_backpatch()
-        self.fix_label()
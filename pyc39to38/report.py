@@ -0,0 +1,111 @@
+"""
+merging the reports of sharded runs
+"""
+
+from heapq import nlargest
+from json import (
+    loads,
+    JSONDecodeError
+)
+from logging import getLogger
+from typing import (
+    Iterable,
+    List,
+    Dict,
+    Any
+)
+
+from . import FILE_ENCODING
+
+
+logger = getLogger('report')
+
+# the same as analyze.REPORT, merging doesn't need xdis
+REPORT = Dict[str, Any]
+
+
+def load_reports(paths: Iterable[str]) -> List[REPORT]:
+    """
+    read the JSONL reports written by the directory conversion or the analysis mode
+
+    a broken line (e.g. the last one of a killed run) is skipped
+
+    :param paths: paths of the report files
+    :return: reports of each file, in the order they were read
+    """
+    reports = []
+    for path in paths:
+        with open(path, 'r', encoding=FILE_ENCODING) as fp:
+            for line_no, line in enumerate(fp, 1):
+                if not line.strip():
+                    continue
+                try:
+                    report = loads(line)
+                except JSONDecodeError:
+                    logger.warning(f'{path}:{line_no}: broken line skipped')
+                    continue
+                if isinstance(report, dict) and 'path' in report:
+                    reports.append(report)
+    return reports
+
+
+def merge_reports(reports: Iterable[REPORT], top: int) -> REPORT:
+    """
+    combine the reports of the shards into one summary
+
+    a file reported more than once (e.g. by a resumed run) counts only with its last report
+
+    :param reports: reports of each file
+    :param top: how many of the slowest files to list
+    :return: the summary
+    """
+    latest: Dict[str, REPORT] = {}
+    for report in reports:
+        # the last one wins, so move it to the end
+        latest.pop(report['path'], None)
+        latest[report['path']] = report
+    merged = list(latest.values())
+
+    rules: Dict[str, Dict[str, int]] = {}
+    for report in merged:
+        for rule, hits in (report.get('rules') or {}).items():
+            rule_summary = rules.setdefault(rule, {'hits': 0, 'files': 0})
+            rule_summary['hits'] += hits
+            rule_summary['files'] += 1 if hits else 0
+    slowest = nlargest(top, merged, key=lambda r: r.get('seconds') or 0.0)
+
+    return {
+        'files': len(merged),
+        'ok': sum(1 for report in merged if report.get('ok')),
+        'failed': sum(1 for report in merged if not report.get('ok')),
+        'seconds': sum(report.get('seconds') or 0.0 for report in merged),
+        'saved_bytes': sum((report.get('optimized') or {}).get('saved_bytes', 0)
+                           for report in merged if report.get('ok')),
+        'shards': sorted({report['shard'] for report in merged if report.get('shard')}),
+        'rules': {rule: rules[rule] for rule in sorted(rules)},
+        'slowest': [{'path': report['path'], 'seconds': report.get('seconds') or 0.0} for report in slowest],
+        'failures': [{'path': report['path'], 'error': report.get('error')}
+                     for report in merged if not report.get('ok')],
+        'degraded': [{'path': report['path'], 'codes': report['degraded']}
+                     for report in merged if report.get('ok') and report.get('degraded')]
+    }
+
+
+def log_merged(summary: REPORT):
+    """
+    log the merged summary in a human-readable way
+    """
+    shards = f' from shards {", ".join(summary["shards"])}' if summary['shards'] else ''
+    logger.info(f'{summary["files"]} files{shards}, {summary["ok"]} ok, {summary["failed"]} failed, '
+                f'{summary["seconds"]:.2f}s in total')
+    if summary['saved_bytes']:
+        logger.info(f'about {summary["saved_bytes"]} bytes saved by the jump optimization')
+    for rule, rule_summary in summary['rules'].items():
+        logger.info(f'rule {rule}: {rule_summary["hits"]} hits in {rule_summary["files"]} files')
+    for report in summary['slowest']:
+        logger.info(f'slow: {report["path"]} ({report["seconds"]:.3f}s)')
+    for report in summary['failures']:
+        logger.error(f'failed: {report["path"]}: {report["error"]}')
+    for report in summary['degraded']:
+        for code in report['codes']:
+            logger.warning(f'degraded: {report["path"]}: {code}')
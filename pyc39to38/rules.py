@@ -47,6 +47,13 @@ COMPARE_OPS: Dict[str, Tuple[int, str]] = {
 
 COMPARE_OP = 'COMPARE_OP'
 
+# names of the rules in InPlacePatcher.stats
+RULE_COMPARE_OPS = 'compare_ops'
+RULE_RERAISE = 'reraise'
+RULE_LIST_FROM_TUPLE = 'list_from_tuple'
+RULE_BEGIN_FINALLY = 'begin_finally'
+RULES = (RULE_COMPARE_OPS, RULE_RERAISE, RULE_LIST_FROM_TUPLE, RULE_BEGIN_FINALLY)
+
 RERAISE = 'RERAISE'
 END_FINALLY = 'END_FINALLY'
 BEGIN_FINALLY = 'BEGIN_FINALLY'
@@ -106,6 +113,7 @@ def do_38_to_39_list_creation(patcher: InPlacePatcher, opc: ModuleType, records:
     # the const of the original tuple, the first element of the expended tuple and the elements count
     const_map: Dict[int, Tuple[int, int]] = {}
     warn_tuple = False
+    extra_stack = 0
     for record in records:
         if record.const_idx not in const_map:
             orig_tuple = patcher.code.co_consts[record.const_idx]
@@ -130,6 +138,9 @@ def do_38_to_39_list_creation(patcher: InPlacePatcher, opc: ModuleType, records:
         inst = build_inst(opc, 'BUILD_LIST', elem_count)
         insert_inst(patcher, opc, recalc_idx(history, record.pos + elem_count), inst, label, True)
         history.append((record.pos, -3 + elem_count + 1))
+        # the original ones only take 2 slots on the stack at most, but now all the elements are pushed
+        extra_stack = max(extra_stack, elem_count - 2)
+    patcher.code.co_stacksize += extra_stack
 
 
 def do_39_to_38(patcher: InPlacePatcher, is_pypy: bool, cfg: Config):
@@ -138,12 +149,17 @@ def do_39_to_38(patcher: InPlacePatcher, is_pypy: bool, cfg: Config):
     """
     opc = get_opcode(PY38_VER, is_pypy)
     for op in COMPARE_OPS.keys():
-        replace_op_with_insts(patcher, opc, op, compare_op_callback)
-    replace_op_with_inst(patcher, opc, RERAISE, reraise_callback)
-    do_38_to_39_list_creation(patcher, opc, scan_py39_list_from_tuple(patcher))
+        patcher.stats[RULE_COMPARE_OPS] += replace_op_with_insts(patcher, opc, op, compare_op_callback)
+    patcher.stats[RULE_RERAISE] += replace_op_with_inst(patcher, opc, RERAISE, reraise_callback)
+    if not cfg.no_list_from_tuple:
+        list_records = scan_py39_list_from_tuple(patcher)
+        patcher.stats[RULE_LIST_FROM_TUPLE] += len(list_records)
+        do_38_to_39_list_creation(patcher, opc, list_records)
     # do this at last if you could, because it may cause some big chunk of deletions
     if not cfg.no_begin_finally:
+        finally_objs = scan_finally(patcher)
+        patcher.stats[RULE_BEGIN_FINALLY] += len(finally_objs)
         do_38_to_39_finally(
             patcher, opc, [],
-            parse_finally_info(scan_finally(patcher))
+            parse_finally_info(finally_objs)
         )
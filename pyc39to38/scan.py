@@ -218,50 +218,48 @@ def parse_finally_info(finally_objs: List[_Finally], sort: bool = True) -> List[
         # sort the "finally" objects by start position
         finally_objs.sort(key=lambda x: x.setup_finally)
 
-    # the first "finally" object is definitely one of the root "finally" objects
-    one_root_obj = finally_objs.pop(0)
-
-    # let's see what are the children of the first "finally" object
-    scope_children_obj = []
-    block1_children_obj = []
-    block2_children_obj = []
-    remove = []
-
-    # iterate through the rest of the "finally" objects
-    for i, finally_obj in enumerate(finally_objs):
-        # if this "finally" object is a "scope" child of the root "finally" object
-        if one_root_obj.scope.start <= finally_obj.setup_finally <= one_root_obj.scope.end:
-            scope_children_obj.append(finally_obj)
-        # if this "finally" object is a "block1" child of the root "finally" object
-        elif one_root_obj.block1.start <= finally_obj.setup_finally <= one_root_obj.block1.end:
-            block1_children_obj.append(finally_obj)
-        # if this "finally" object is a "block2" child of the root "finally" object
-        elif one_root_obj.block2.start <= finally_obj.setup_finally <= one_root_obj.block2.end:
-            block2_children_obj.append(finally_obj)
-        else:
-            continue
-        # remove it from the list if it's a child
-        remove.append(i)
-
-    # remove those are children
-    for i in reversed(remove):
-        finally_objs.pop(i)
-
-    # recursively parse the children
-    one_root_info = FinallyInfo(
-        obj=one_root_obj,
-        scope_children=parse_finally_info(scope_children_obj, sort=False) if scope_children_obj else [],
-        block1_children=parse_finally_info(block1_children_obj, sort=False) if block1_children_obj else [],
-        block2_children=parse_finally_info(block2_children_obj, sort=False) if block2_children_obj else []
-    )
-
-    # result
-    finally_infos = [one_root_info]
-
-    # if there's still "finally" objects left, it means there's more than one root "finally" object
-    if finally_objs:
-        # recursively parse the next root "finally" object as well as its children
-        finally_infos.extend(parse_finally_info(finally_objs, sort=False))
+    finally_infos = []
+    # the first "finally" object left is definitely one of the root "finally" objects,
+    # the roots are walked in a loop, only the nesting (at most CO_MAXBLOCKS deep) is recursive
+    idx = 0
+    while idx < len(finally_objs):
+        one_root_obj = finally_objs[idx]
+        idx += 1
+        end = max(one_root_obj.scope.end, one_root_obj.block1.end, one_root_obj.block2.end)
+
+        # let's see what are the children of this "finally" object
+        scope_children_obj = []
+        block1_children_obj = []
+        block2_children_obj = []
+        # in its range but not a child, still roots
+        other_roots = []
+
+        # they are sorted, so the ones after its end can't be children
+        while idx < len(finally_objs) and finally_objs[idx].setup_finally <= end:
+            finally_obj = finally_objs[idx]
+            idx += 1
+            # if this "finally" object is a "scope" child of the root "finally" object
+            if one_root_obj.scope.start <= finally_obj.setup_finally <= one_root_obj.scope.end:
+                scope_children_obj.append(finally_obj)
+            # if this "finally" object is a "block1" child of the root "finally" object
+            elif one_root_obj.block1.start <= finally_obj.setup_finally <= one_root_obj.block1.end:
+                block1_children_obj.append(finally_obj)
+            # if this "finally" object is a "block2" child of the root "finally" object
+            elif one_root_obj.block2.start <= finally_obj.setup_finally <= one_root_obj.block2.end:
+                block2_children_obj.append(finally_obj)
+            else:
+                other_roots.append(finally_obj)
+        if other_roots:
+            finally_objs = other_roots + finally_objs[idx:]
+            idx = 0
+
+        # recursively parse the children
+        finally_infos.append(FinallyInfo(
+            obj=one_root_obj,
+            scope_children=parse_finally_info(scope_children_obj, sort=False) if scope_children_obj else [],
+            block1_children=parse_finally_info(block1_children_obj, sort=False) if block1_children_obj else [],
+            block2_children=parse_finally_info(block2_children_obj, sort=False) if block2_children_obj else []
+        ))
 
     return finally_infos
 
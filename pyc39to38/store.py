@@ -0,0 +1,183 @@
+"""
+packed output store, the converted files of a tree go into a single SQLite database instead of a directory,
+so that millions of small files don't cost an inode and a few metadata syscalls each
+
+the rows are written in batched transactions, and the selected files can be exported back to a tree
+"""
+
+from fnmatch import fnmatchcase
+from json import dumps
+from logging import getLogger
+from os import makedirs
+from os.path import (
+    join,
+    dirname,
+    exists
+)
+from pathlib import Path
+from sqlite3 import (
+    connect,
+    Error as SQLiteError
+)
+from typing import (
+    Optional,
+    Iterator,
+    List,
+    Tuple,
+    Dict,
+    Any
+)
+
+from .utils import atomic_open
+
+
+logger = getLogger('store')
+
+# rows written in a transaction
+DEFAULT_BATCH_SIZE = 1000
+# bytes of output buffered before a batch is written, even if it's not full
+DEFAULT_BATCH_BYTES = 64 * 1024 * 1024
+
+# path: relative path of the input file, output: relative path of the output file,
+# entry: what the manifest would know about the file, as JSON, data: content of the output file, NULL if failed
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    output TEXT NOT NULL,
+    hash TEXT,
+    size INTEGER,
+    ok INTEGER NOT NULL,
+    entry TEXT NOT NULL,
+    data BLOB
+)
+'''
+INSERT_SQL = 'INSERT OR REPLACE INTO files (path, output, hash, size, ok, entry, data) VALUES (?, ?, ?, ?, ?, ?, ?)'
+SELECT_SQL = 'SELECT path, output FROM files WHERE ok ORDER BY path'
+SELECT_DATA_SQL = 'SELECT data FROM files WHERE path = ?'
+CHECK_SQL = 'SELECT 1 FROM files LIMIT 1'
+
+ROW = Tuple[str, str, Optional[str], Optional[int], bool, str, Optional[bytes]]
+
+
+class PycStore:
+    """
+    a SQLite database of converted files, the rows added are buffered and written in batches
+    """
+
+    def __init__(self, path: str, read_only: bool = False, batch_size: int = DEFAULT_BATCH_SIZE,
+                 batch_bytes: int = DEFAULT_BATCH_BYTES):
+        """
+        :param path: path of the database, created if not read only
+        :param read_only: open an existing database for reading only
+        :param batch_size: rows written in a transaction
+        :param batch_bytes: bytes of output buffered before a batch is written
+
+        :raises sqlite3.Error: if it can't be opened, or if it's not a store when read only
+        """
+        if read_only:
+            # the path is escaped, a '?', '#' or '%' in it would be taken as a part of the URI
+            self.conn = connect(f'{Path(path).absolute().as_uri()}?mode=ro', uri=True)
+            # the file is only read when queried
+            try:
+                self.conn.execute(CHECK_SQL).fetchall()
+            except SQLiteError:
+                self.conn.close()
+                raise
+        else:
+            self.conn = connect(path)
+            # a single writer, the batches are the durability unit anyway
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute(SCHEMA)
+            self.conn.commit()
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.pending: List[ROW] = []
+        self.pending_bytes = 0
+
+    def add(self, rel_input: str, rel_output: str, entry: Dict[str, Any], data: Optional[bytes]):
+        """
+        add or replace a file, written with the next batch
+
+        :param rel_input: relative path of the input file
+        :param rel_output: relative path of the output file
+        :param entry: the entry of the file, without the content
+        :param data: content of the output file, None if failed
+        """
+        self.pending.append((rel_input, rel_output, entry.get('hash'), entry.get('size'), bool(entry['ok']),
+                             dumps(entry, sort_keys=True), data))
+        self.pending_bytes += len(data) if data is not None else 0
+        if len(self.pending) >= self.batch_size or self.pending_bytes >= self.batch_bytes:
+            self.flush()
+
+    def flush(self):
+        """
+        write the buffered rows in one transaction
+        """
+        if not self.pending:
+            return
+        with self.conn:
+            self.conn.executemany(INSERT_SQL, self.pending)
+        self.pending.clear()
+        self.pending_bytes = 0
+
+    def iter_files(self, patterns: Optional[List[str]] = None) -> Iterator[Tuple[str, str, bytes]]:
+        """
+        :param patterns: glob patterns of the relative paths of the input or the output files, None for all
+        :return: iterator of the relative input path, the relative output path and the content
+                 of the files converted, in the order of the paths
+        """
+        for rel_input, rel_output in self.conn.execute(SELECT_SQL):
+            if patterns is None or any(fnmatchcase(rel_input, pattern) or fnmatchcase(rel_output, pattern)
+                                       for pattern in patterns):
+                # only the content of the selected ones is loaded
+                yield rel_input, rel_output, self.conn.execute(SELECT_DATA_SQL, (rel_input,)).fetchone()[0]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.conn.close()
+
+    def __enter__(self) -> 'PycStore':
+        return self
+
+    def __exit__(self, *_):
+        # the files done before an error are kept, like the journal of a directory conversion
+        self.close()
+
+
+def export_store(store_path: str, output_root: str, patterns: Optional[List[str]] = None,
+                 force: bool = False) -> Tuple[int, int]:
+    """
+    write the converted files in a store back to a directory tree
+
+    :param store_path: path of the database
+    :param output_root: output directory
+    :param patterns: glob patterns of the relative paths of the input or the output files, None for all
+    :param force: overwrite the existing output files
+    :return: how many files are exported and how many failed
+    """
+    exported = failed = 0
+    try:
+        store = PycStore(store_path, True)
+    except SQLiteError as e:
+        logger.error(f'failed to open the store {store_path}: {e}')
+        return exported, 1
+    with store:
+        for _, rel_output, data in store.iter_files(patterns):
+            output_path = join(output_root, rel_output)
+            if not force and exists(output_path):
+                logger.error(f'failed to export {rel_output}: output file already exists')
+                failed += 1
+                continue
+            try:
+                makedirs(dirname(output_path) or '.', exist_ok=True)
+                with atomic_open(output_path) as fp:
+                    fp.write(data)
+            except OSError as e:
+                logger.error(f'failed to export {rel_output}: {e.__class__.__name__}: {e}')
+                failed += 1
+                continue
+            exported += 1
+    return exported, failed
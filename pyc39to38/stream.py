@@ -0,0 +1,118 @@
+"""
+conversion of a framed stream of bytecode files passed through pipes
+
+a frame is the length of the name and the length of the content (big endian, 4 and 8 bytes),
+then the name in UTF-8 and the content, the output frames are the same with the converted content,
+in the same order as the input ones, an empty content means that the file failed to convert
+"""
+
+from functools import partial
+from logging import getLogger
+from struct import (
+    pack,
+    unpack,
+    calcsize
+)
+from traceback import print_exc
+from typing import (
+    Optional,
+    BinaryIO,
+    Iterator,
+    Tuple
+)
+
+from .archive import convert_member
+from .batch import run_pool_ordered
+from .rules import RULE_APPLIER
+from .cfg import Config
+
+
+logger = getLogger('stream')
+
+# length of the name, length of the content
+FRAME_HEADER_FMT = '!IQ'
+FRAME_HEADER_SIZE = calcsize(FRAME_HEADER_FMT)
+FRAME_NAME_ENCODING = 'utf-8'
+
+
+def read_exact(fp: BinaryIO, size: int) -> bytes:
+    """
+    read exactly size bytes, a pipe may give less at a time
+
+    :raises EOFError: if the stream ends before that
+    """
+    chunks = []
+    while size:
+        if not (chunk := fp.read(size)):
+            raise EOFError('unexpected end of stream')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_frames(fp: BinaryIO) -> Iterator[Tuple[str, bytes]]:
+    """
+    read the frames until the end of the stream
+
+    :param fp: the input stream
+    :return: iterator of name and content
+
+    :raises EOFError: if the stream ends in the middle of a frame
+    """
+    while header := fp.read(FRAME_HEADER_SIZE):
+        if len(header) < FRAME_HEADER_SIZE:
+            header += read_exact(fp, FRAME_HEADER_SIZE - len(header))
+        name_len, data_len = unpack(FRAME_HEADER_FMT, header)
+        name = read_exact(fp, name_len).decode(FRAME_NAME_ENCODING, 'surrogateescape')
+        yield name, read_exact(fp, data_len)
+
+
+def write_frame(fp: BinaryIO, name: str, data: bytes):
+    """
+    write a frame
+
+    :param fp: the output stream
+    :param name: name of the file
+    :param data: content of the file
+    """
+    name_bytes = name.encode(FRAME_NAME_ENCODING, 'surrogateescape')
+    fp.write(pack(FRAME_HEADER_FMT, len(name_bytes), len(data)))
+    fp.write(name_bytes)
+    fp.write(data)
+
+
+def convert_stream(input_fp: BinaryIO, output_fp: BinaryIO, cfg: Config, rule_applier: RULE_APPLIER,
+                   jobs: Optional[int] = None) -> bool:
+    """
+    convert a framed stream of bytecode files, every frame is written back once converted
+
+    with more than one worker, the next frames are read while the workers are busy,
+    so the producer must not wait for the output of a frame before sending the next one
+
+    :param input_fp: the input stream
+    :param output_fp: the output stream
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param jobs: number of worker processes (default: number of CPUs)
+    :return: True if all the files are converted, False if not
+    """
+    converted = failed = 0
+    func = partial(convert_member, cfg=cfg, rule_applier=rule_applier)
+    try:
+        for name, data in run_pool_ordered(func, ((name, (name, data)) for name, data in read_frames(input_fp)),
+                                           jobs):
+            if data is None:
+                logger.error(f'failed to convert {name}')
+                failed += 1
+                data = b''
+            else:
+                converted += 1
+            write_frame(output_fp, name, data)
+            # the consumer may be waiting for it
+            output_fp.flush()
+    except (OSError, IOError, EOFError):
+        print_exc()
+        return False
+
+    logger.info(f'{converted} bytecode files converted, {failed} failed')
+    return not failed
@@ -0,0 +1,690 @@
+"""
+conversion of directory trees, optionally incremental with a manifest in the output directory
+
+every finished file is recorded in a journal as soon as it is done, so that a killed run can be resumed
+"""
+
+from functools import partial
+from hashlib import sha256
+from json import (
+    load,
+    loads,
+    dumps
+)
+from logging import getLogger
+from os import (
+    stat,
+    makedirs,
+    fsync,
+    unlink
+)
+from os.path import (
+    join,
+    splitext,
+    getsize,
+    relpath,
+    dirname,
+    exists,
+    isfile
+)
+from time import perf_counter
+from traceback import print_exc
+from typing import (
+    Optional,
+    Counter,
+    TextIO,
+    Iterator,
+    List,
+    Tuple,
+    Dict,
+    Any
+)
+
+from .asm import reasm_bytes
+from .archive import rename_member
+from .batch import (
+    find_pycs,
+    run_scheduled,
+    run_isolated,
+    lpt_order,
+    default_jobs,
+    in_shard,
+    PoolStats
+)
+from .rules import RULE_APPLIER
+from .optimize import (
+    pop_opt_stats,
+    OPT_SAVED_BYTES
+)
+from .aio import run_async_io
+from .store import PycStore
+from .analyze import to_json_line
+from .cfg import Config
+from .utils import (
+    atomic_open,
+    remove_atomic_leftovers,
+    link_or_copy
+)
+from . import (
+    __version__,
+    FILE_ENCODING
+)
+
+
+logger = getLogger('tree')
+
+HASH_CHUNK_SIZE = 1 << 20
+
+MANIFEST_NAME = '.pyc39to38-manifest.json'
+JOURNAL_NAME = '.pyc39to38-journal.jsonl'
+
+# what the manifest knows about an input file, and the result of converting it
+ENTRY = Dict[str, Any]
+# input path, output path, and whether to overwrite the existing output file
+TODO_ITEM = Tuple[str, str, bool]
+
+
+def state_path(output_root: str, name: str, shard: Optional[Tuple[int, int]]) -> str:
+    """
+    get the path of the manifest or the journal, each shard has its own
+
+    :param output_root: output directory
+    :param name: file name of the manifest or the journal
+    :param shard: index and count of the shards, None if not sharded
+    :return: the path
+    """
+    if shard is not None:
+        base, ext = splitext(name)
+        name = f'{base}-{shard[0]}-of-{shard[1]}{ext}'
+    return join(output_root, name)
+
+
+def report_line(rel_input: str, entry: ENTRY, shard: Optional[Tuple[int, int]], **extra: Any) -> str:
+    """
+    :param extra: more fields of the report
+    :return: the report of a file as one line of JSON, the same fields as the ones of the analysis mode
+    """
+    return to_json_line({
+        'path': rel_input,
+        'ok': entry['ok'],
+        'error': entry['error'],
+        'size': entry['size'],
+        'seconds': entry.get('seconds', 0.0),
+        'rules': entry.get('rules', {}),
+        'degraded': entry.get('degraded', []),
+        'optimized': entry.get('optimized'),
+        'shard': None if shard is None else f'{shard[0]}/{shard[1]}',
+        **extra
+    })
+
+
+def file_hash(data: bytes) -> str:
+    """
+    :return: the content hash of a file in the manifest
+    """
+    return sha256(data).hexdigest()
+
+
+def hash_file(path: str) -> str:
+    """
+    :return: the content hash of a file in the manifest, without reading it into memory at once
+    """
+    digest = sha256()
+    with open(path, 'rb') as fp:
+        while chunk := fp.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path: str) -> Dict[str, ENTRY]:
+    """
+    load the manifest of the last run
+
+    :param path: path of the manifest
+    :return: relative input path to entry mapping, empty if there's no usable manifest
+    """
+    if not isfile(path):
+        return {}
+    try:
+        with open(path, 'r', encoding=FILE_ENCODING) as fp:
+            return load(fp)['files']
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f'ignoring the broken manifest {path}: {e}')
+        return {}
+
+
+def save_manifest(path: str, files: Dict[str, ENTRY]):
+    """
+    write the manifest, replacing the old one only once it is complete
+
+    :param path: path of the manifest
+    :param files: relative input path to entry mapping
+    """
+    with atomic_open(path, True) as fp:
+        fp.write(dumps({'files': files}, indent=1, sort_keys=True).encode(FILE_ENCODING))
+
+
+def load_journal(path: str) -> Dict[str, ENTRY]:
+    """
+    load the files finished by the last run
+
+    :param path: path of the journal
+    :return: relative input path to entry mapping
+    """
+    if not isfile(path):
+        return {}
+    files = {}
+    with open(path, 'r', encoding=FILE_ENCODING) as fp:
+        for line in fp:
+            try:
+                entry = loads(line)
+                files[entry.pop('input')] = entry
+            except (ValueError, KeyError, TypeError, AttributeError):
+                # the last one can be cut off by the crash
+                logger.warning(f'ignoring a broken record in the journal {path}')
+    return files
+
+
+def drop_partial_line(path: str):
+    """
+    cut off the last line of a file if it's not complete, so that the lines appended next are not glued to it
+
+    :param path: path of the file, nothing is done if it doesn't exist
+    """
+    if not isfile(path):
+        return
+    with open(path, 'r+b') as fp:
+        pos = end = fp.seek(0, 2)
+        while pos > 0:
+            start = max(pos - HASH_CHUNK_SIZE, 0)
+            fp.seek(start)
+            if (idx := fp.read(pos - start).rfind(b'\n')) >= 0:
+                pos = start + idx + 1
+                break
+            pos = start
+        if pos != end:
+            fp.truncate(pos)
+
+
+def append_journal(fp: TextIO, rel_input: str, entry: ENTRY):
+    """
+    record a finished file in the journal, it's on the disk once this returns
+
+    :param fp: the journal
+    :param rel_input: relative input path
+    :param entry: the entry of the file
+    """
+    fp.write(dumps(dict(entry, input=rel_input), sort_keys=True) + '\n')
+    fp.flush()
+    fsync(fp.fileno())
+
+
+def check_unchanged(entry: ENTRY, input_path: str, output_path: str, config: Dict[str, Any]) -> Optional[ENTRY]:
+    """
+    check if an input file is converted the same way since the last run
+
+    the content is only hashed if the size is the same but the mtime is not
+
+    :param entry: the entry of the file in the manifest
+    :param input_path: path of the input file
+    :param output_path: path of the output file
+    :param config: the config options of this run
+    :return: the entry to keep (with the new mtime if only that changed), None if it has to be converted
+    """
+    if entry.get('version') != __version__ or entry.get('config') != config:
+        return None
+    if entry.get('ok') and not isfile(output_path):
+        return None
+    try:
+        st = stat(input_path)
+    except OSError:
+        return None
+    if st.st_size != entry.get('size'):
+        return None
+    if st.st_mtime_ns == entry.get('mtime_ns'):
+        return entry
+    # touched, but maybe not changed
+    if hash_file(input_path) != entry.get('hash'):
+        return None
+    return dict(entry, mtime_ns=st.st_mtime_ns)
+
+
+def failed_entry(input_path: str, error: Optional[str]) -> ENTRY:
+    """
+    :return: the entry of a file not converted, with the absolute input path as 'path'
+    """
+    return {
+        'path': input_path,
+        'ok': False,
+        'error': error,
+        'size': None,
+        'mtime_ns': None,
+        'hash': None
+    }
+
+
+def input_size(item: TODO_ITEM) -> int:
+    """
+    :return: size of the input file, the estimated cost of converting it
+    """
+    try:
+        return getsize(item[0])
+    except OSError:
+        return 0
+
+
+def iter_converted(todo: List[TODO_ITEM], cfg: Config, rule_applier: RULE_APPLIER,
+                   jobs: int, timeout: Optional[float], max_rss: Optional[int],
+                   chunk_size: Optional[int], stats: PoolStats, async_io: bool = False,
+                   prefetch: Optional[int] = None, max_in_flight: Optional[int] = None,
+                   keep_data: bool = False) -> Iterator[ENTRY]:
+    """
+    convert the files of a tree in worker processes, largest first,
+    isolated from each other if there's any limit, or in chunks of small files if asked,
+    or with the files read and written by an asyncio front end while the workers only convert
+
+    :param todo: input path, output path, and whether to overwrite the existing output file
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param jobs: number of worker processes
+    :param timeout: wall-clock time limit of each file in seconds
+    :param max_rss: memory limit of each worker in bytes
+    :param chunk_size: group the files smaller than this many bytes into chunks of about this size
+    :param stats: where to record how busy the workers are kept
+    :param async_io: read and write the files with the asyncio front end (not with the limits or the chunks)
+    :param prefetch: how many files can be read, converted or written at the same time with async_io
+    :param max_in_flight: how many bytes of input can be read, converted or written at the same time with async_io
+    :param keep_data: don't write the output files, return their content as 'data' of the entries (not with async_io)
+    :return: iterator of the entries, in the order they are done
+    """
+    if async_io:
+        convert = partial(convert_tree_data, cfg=cfg, rule_applier=rule_applier)
+        yield from run_async_io(todo, input_size, read_tree_file, convert, write_tree_file,
+                                lambda item, error: failed_entry(item[0], error),
+                                jobs, prefetch, max_in_flight, stats)
+        return
+    func = partial(convert_tree_file, cfg=cfg, rule_applier=rule_applier, keep_data=keep_data)
+    if timeout is None and max_rss is None:
+        yield from run_scheduled(func, todo, input_size, jobs, chunk_size, stats)
+        return
+    for (input_path, output_path, _), entry, error in run_isolated(func, lpt_order(todo, input_size), jobs,
+                                                                   timeout, max_rss, stats):
+        if error is not None:
+            if not keep_data:
+                # the worker may be killed while writing
+                remove_atomic_leftovers(output_path)
+            entry = failed_entry(input_path, error)
+        yield entry
+
+
+def read_tree_file(item: TODO_ITEM) -> Tuple[ENTRY, Optional[bytes]]:
+    """
+    read a bytecode file of a tree
+
+    :param item: input path, output path, and whether to overwrite the existing output file
+    :return: the entry so far and the content of the file, None as the content if it's not to be converted
+    """
+    input_path, output_path, force = item
+    entry = failed_entry(input_path, None)
+    try:
+        st = stat(input_path)
+        with open(input_path, 'rb') as fp:
+            data = fp.read()
+    except OSError as e:
+        entry['error'] = f'{e.__class__.__name__}: {e}'
+        return entry, None
+    entry['size'], entry['mtime_ns'], entry['hash'] = st.st_size, st.st_mtime_ns, file_hash(data)
+
+    if not force and exists(output_path):
+        entry['error'] = 'output file already exists'
+        return entry, None
+    return entry, data
+
+
+def convert_tree_data(entry: ENTRY, data: bytes, cfg: Config,
+                      rule_applier: RULE_APPLIER) -> Tuple[ENTRY, Optional[bytes]]:
+    """
+    convert the content of a bytecode file of a tree
+
+    :param entry: the entry from read_tree_file
+    :param data: content of the file
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :return: the entry so far and the content of the output file, None as the content if failed
+    """
+    start = perf_counter()
+    stats: Counter[str] = Counter()
+    degraded: List[str] = []
+    error = 'conversion failed'
+    try:
+        new_data = reasm_bytes(data, entry['path'], cfg, rule_applier, stats, degraded)
+    except Exception as e:
+        # don't let a single file take down the whole tree
+        print_exc()
+        new_data = None
+        error = f'{e.__class__.__name__}: {e}'
+    entry['seconds'] = perf_counter() - start
+    if cfg.optimize:
+        entry['optimized'] = pop_opt_stats(stats)
+    entry['rules'] = dict(stats)
+    entry['degraded'] = degraded
+    if new_data is None:
+        entry['error'] = error
+    return entry, new_data
+
+
+def write_tree_file(item: TODO_ITEM, entry: ENTRY, new_data: bytes) -> ENTRY:
+    """
+    write the output file of a bytecode file of a tree
+
+    :param item: input path, output path, and whether to overwrite the existing output file
+    :param entry: the entry from convert_tree_data
+    :param new_data: content of the output file
+    :return: the entry for the manifest, with the absolute input path as 'path'
+    """
+    output_path = item[1]
+    try:
+        makedirs(dirname(output_path), exist_ok=True)
+        with atomic_open(output_path, True) as fp:
+            fp.write(new_data)
+    except OSError as e:
+        entry['error'] = f'{e.__class__.__name__}: {e}'
+        return entry
+    entry['ok'] = True
+    return entry
+
+
+def convert_tree_file(item: TODO_ITEM, cfg: Config, rule_applier: RULE_APPLIER, keep_data: bool = False) -> ENTRY:
+    """
+    convert a bytecode file of a tree, run in the worker processes
+
+    :param item: input path, output path, and whether to overwrite the existing output file
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param keep_data: don't write the output file, return its content as 'data' of the entry
+    :return: the entry for the manifest, with the absolute input path as 'path'
+    """
+    entry, data = read_tree_file(item)
+    if data is None:
+        return entry
+    entry, new_data = convert_tree_data(entry, data, cfg, rule_applier)
+    if new_data is None:
+        return entry
+    if keep_data:
+        entry['ok'], entry['data'] = True, new_data
+        return entry
+    return write_tree_file(item, entry, new_data)
+
+
+def dedup_todo(todo: List[TODO_ITEM]) -> Tuple[List[TODO_ITEM], Dict[str, Tuple[str, List[TODO_ITEM]]]]:
+    """
+    find the input files with the same content, so that each content is only converted once
+
+    :param todo: input path, output path, and whether to overwrite the existing output file
+    :return: the files to convert, and input path of each of them to its output path and the files with
+             the same content
+    """
+    # content hash to the first file with it
+    seen: Dict[str, TODO_ITEM] = {}
+    unique = []
+    duplicates: Dict[str, Tuple[str, List[TODO_ITEM]]] = {}
+    for item in todo:
+        try:
+            digest = hash_file(item[0])
+        except OSError:
+            # the worker will report it
+            unique.append(item)
+            continue
+        if (first := seen.get(digest)) is None:
+            seen[digest] = item
+            unique.append(item)
+        else:
+            duplicates.setdefault(first[0], (first[1], []))[1].append(item)
+    return unique, duplicates
+
+
+def copy_converted(entry: ENTRY, src_output_path: str, item: TODO_ITEM) -> ENTRY:
+    """
+    give an input file the output of another one with the same content
+
+    :param entry: the entry of the converted one
+    :param src_output_path: the output file of the converted one
+    :param item: input path, output path, and whether to overwrite the existing output file
+    :return: the entry of the input file, with the absolute input path as 'path'
+    """
+    input_path, output_path, force = item
+    new_entry = failed_entry(input_path, entry['error'])
+    if entry['hash'] is None:
+        # not even read, or the worker is killed
+        return new_entry
+    try:
+        st = stat(input_path)
+    except OSError as e:
+        new_entry['error'] = f'{e.__class__.__name__}: {e}'
+        return new_entry
+    # it fails the same way for the same content, so it's recorded like the converted one
+    new_entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns, hash=entry['hash'])
+    if not entry['ok']:
+        return new_entry
+    if not force and exists(output_path):
+        new_entry['error'] = 'output file already exists'
+        return new_entry
+    try:
+        makedirs(dirname(output_path), exist_ok=True)
+        link_or_copy(src_output_path, output_path)
+    except OSError as e:
+        new_entry['error'] = f'{e.__class__.__name__}: {e}'
+        return new_entry
+    new_entry['ok'] = True
+    return new_entry
+
+
+def fan_out(entries: Iterator[ENTRY], duplicates: Dict[str, Tuple[str, List[TODO_ITEM]]]) -> Iterator[ENTRY]:
+    """
+    follow each converted file with the files of the same content, sharing its output
+
+    :param entries: the entries of the converted files
+    :param duplicates: input path of each converted file to its output path and the files with the same content
+    :return: iterator of the entries of all of them
+    """
+    for entry in entries:
+        # before the entry is touched by the caller
+        src_output_path, items = duplicates.get(entry['path'], (None, []))
+        copied = [copy_converted(entry, src_output_path, item) for item in items]
+        yield entry
+        yield from copied
+
+
+def convert_tree(input_root: str, output_root: str, cfg: Config, rule_applier: RULE_APPLIER,
+                 jobs: Optional[int] = None, force: bool = False, incremental: bool = False,
+                 resume: bool = False, timeout: Optional[float] = None, max_rss: Optional[int] = None,
+                 chunk_size: Optional[int] = None, dedup: bool = False,
+                 shard: Optional[Tuple[int, int]] = None, report_path: Optional[str] = None,
+                 async_io: bool = False, prefetch: Optional[int] = None, max_in_flight: Optional[int] = None) -> bool:
+    """
+    convert all bytecode files under a directory into another one with the same layout
+
+    in incremental mode, the files not changed since the last run are skipped,
+    and the output files of the input files gone are deleted
+
+    the output files are written atomically, so a killed run never leaves a half-written one behind
+
+    :param input_root: input directory
+    :param output_root: output directory
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param jobs: number of worker processes (default: number of CPUs)
+    :param force: overwrite the existing output files (always, in incremental mode)
+    :param incremental: keep a manifest in the output directory and only convert what's changed
+    :param resume: skip the files finished by the last run according to the journal
+    :param timeout: wall-clock time limit of each file in seconds, the worker is killed and replaced if exceeded
+    :param max_rss: memory limit of each worker in bytes, the worker is killed and replaced if exceeded
+    :param chunk_size: group the files smaller than this many bytes into chunks of about this size,
+                       so that each of them doesn't cost a round trip to a worker (not with the limits)
+    :param dedup: convert the files with the same content only once, the others get a hardlink to the output
+    :param shard: index and count of the shards, only convert the files of this shard (by a stable hash of the path)
+    :param report_path: write the report of each file converted in this run to this JSONL file
+    :param async_io: read and write the files with an asyncio front end, so that the I/O overlaps with
+                     the conversion in the workers (for slow filesystems, not with the limits or the chunks)
+    :param prefetch: how many files can be read, converted or written at the same time with async_io
+                     (default: 4 per worker)
+    :param max_in_flight: how many bytes of input can be held in flight with async_io (default: 256 MiB)
+    :return: True if all the files converted in this run are done, False if not
+    """
+    manifest_path = state_path(output_root, MANIFEST_NAME, shard)
+    journal_path = state_path(output_root, JOURNAL_NAME, shard)
+    config = vars(cfg)
+    old_files = load_manifest(manifest_path) if incremental else {}
+    journalled = load_journal(journal_path) if resume else {}
+    files: Dict[str, ENTRY] = {}
+
+    todo = []
+    rel_inputs = set()
+    for input_path in find_pycs(input_root):
+        rel_input = relpath(input_path, input_root)
+        rel_inputs.add(rel_input)
+        if shard is not None and not in_shard(rel_input, shard):
+            continue
+        output_path = join(output_root, rename_member(rel_input))
+        if (entry := journalled.get(rel_input)) is not None:
+            files[rel_input] = entry
+            continue
+        if (entry := old_files.get(rel_input)) is not None:
+            if (entry := check_unchanged(entry, input_path, output_path, config)) is not None:
+                files[rel_input] = entry
+                continue
+        # the existing ones of a killed run are complete, as they are written atomically
+        todo.append((input_path, output_path, force or incremental or resume))
+
+    deleted = 0
+    for rel_input, entry in old_files.items():
+        if rel_input in rel_inputs:
+            continue
+        # the input file is gone
+        if isfile(output_path := join(output_root, entry['output'])):
+            unlink(output_path)
+            deleted += 1
+
+    saved = 0
+    duplicates = {}
+    if dedup:
+        todo, duplicates = dedup_todo(todo)
+        saved = sum(len(items) for _, items in duplicates.values())
+
+    converted = failed = degraded = saved_bytes = 0
+    if jobs is None:
+        jobs = default_jobs()
+    stats = PoolStats(jobs)
+    makedirs(output_root, exist_ok=True)
+    if resume:
+        # the last record can be cut off by the crash
+        drop_partial_line(journal_path)
+        if report_path:
+            drop_partial_line(report_path)
+    report_fp = open(report_path, 'a' if resume else 'w', encoding=FILE_ENCODING) if report_path else None
+    try:
+        with open(journal_path, 'a' if resume else 'w', encoding=FILE_ENCODING) as journal_fp:
+            for entry in fan_out(iter_converted(todo, cfg, rule_applier, jobs, timeout, max_rss, chunk_size, stats,
+                                                async_io, prefetch, max_in_flight),
+                                 duplicates):
+                rel_input = relpath(entry.pop('path'), input_root)
+                entry['output'] = rename_member(rel_input)
+                entry['version'] = __version__
+                entry['config'] = config
+                files[rel_input] = entry
+                if entry['ok']:
+                    converted += 1
+                    degraded += 1 if entry.get('degraded') else 0
+                    saved_bytes += (entry.get('optimized') or {}).get(OPT_SAVED_BYTES, 0)
+                else:
+                    logger.error(f'failed to convert {rel_input}: {entry["error"]}')
+                    failed += 1
+                    if incremental and isfile(output_path := join(output_root, entry['output'])):
+                        # don't leave the output of the old version behind
+                        unlink(output_path)
+                append_journal(journal_fp, rel_input, entry)
+                if report_fp is not None:
+                    report_fp.write(report_line(rel_input, entry, shard))
+    finally:
+        if report_fp is not None:
+            report_fp.close()
+
+    if incremental:
+        save_manifest(manifest_path, files)
+    resumed = sum(1 for rel_input in journalled if rel_input in rel_inputs)
+    logger.info(f'{converted} files converted, {failed} failed, {resumed} done by the last run, '
+                f'{len(files) - converted - failed - resumed} unchanged, {deleted} deleted')
+    if degraded:
+        logger.warning(f'{degraded} files converted with degraded code objects')
+    if cfg.optimize:
+        logger.info(f'about {saved_bytes} bytes saved by the jump optimization')
+    if dedup:
+        logger.info(f'{saved} conversions saved by deduplication')
+    if todo:
+        logger.info(f'worker utilization: {stats.utilization:.0%} '
+                    f'({stats.busy:.2f}s busy in {stats.wall:.2f}s with {stats.jobs} workers)')
+    return not failed
+
+
+def convert_tree_to_store(input_root: str, store_path: str, cfg: Config, rule_applier: RULE_APPLIER,
+                          jobs: Optional[int] = None, timeout: Optional[float] = None, max_rss: Optional[int] = None,
+                          chunk_size: Optional[int] = None, shard: Optional[Tuple[int, int]] = None,
+                          report_path: Optional[str] = None) -> bool:
+    """
+    convert all bytecode files under a directory into a store, instead of a directory with the same layout
+
+    the output files go into the store with their paths, content hashes and stats, in batched transactions,
+    the files already in the store are replaced
+
+    :param input_root: input directory
+    :param store_path: path of the store, created if it doesn't exist
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param jobs: number of worker processes (default: number of CPUs)
+    :param timeout: wall-clock time limit of each file in seconds, the worker is killed and replaced if exceeded
+    :param max_rss: memory limit of each worker in bytes, the worker is killed and replaced if exceeded
+    :param chunk_size: group the files smaller than this many bytes into chunks of about this size
+    :param shard: index and count of the shards, only convert the files of this shard (by a stable hash of the path)
+    :param report_path: write the report of each file to this JSONL file
+    :return: True if all the files are done, False if not
+    """
+    config = vars(cfg)
+    todo = []
+    for input_path in find_pycs(input_root):
+        rel_input = relpath(input_path, input_root)
+        if shard is not None and not in_shard(rel_input, shard):
+            continue
+        # nothing is written at the output path
+        todo.append((input_path, rename_member(rel_input), True))
+
+    converted = failed = 0
+    if jobs is None:
+        jobs = default_jobs()
+    stats = PoolStats(jobs)
+    report_fp = open(report_path, 'w', encoding=FILE_ENCODING) if report_path else None
+    try:
+        with PycStore(store_path) as store:
+            for entry in iter_converted(todo, cfg, rule_applier, jobs, timeout, max_rss, chunk_size, stats,
+                                        keep_data=True):
+                rel_input = relpath(entry.pop('path'), input_root)
+                data = entry.pop('data', None)
+                entry['output'] = rename_member(rel_input)
+                entry['version'] = __version__
+                entry['config'] = config
+                if entry['ok']:
+                    converted += 1
+                else:
+                    logger.error(f'failed to convert {rel_input}: {entry["error"]}')
+                    failed += 1
+                store.add(rel_input, entry['output'], entry, data)
+                if report_fp is not None:
+                    report_fp.write(report_line(rel_input, entry, shard))
+    finally:
+        if report_fp is not None:
+            report_fp.close()
+
+    logger.info(f'{converted} files converted into {store_path}, {failed} failed')
+    if todo:
+        logger.info(f'worker utilization: {stats.utilization:.0%} '
+                    f'({stats.busy:.2f}s busy in {stats.wall:.2f}s with {stats.jobs} workers)')
+    return not failed
@@ -2,12 +2,31 @@
 utility functions
 """
 
+from contextlib import contextmanager
+from os import (
+    getpid,
+    fsync,
+    replace,
+    unlink,
+    link
+)
 from os.path import (
     basename,
-    extsep
+    extsep,
+    exists,
+    samefile
+)
+from shutil import copyfileobj
+from glob import (
+    glob,
+    escape
 )
+from sys import platform
 from typing import (
+    Optional,
     Union,
+    BinaryIO,
+    Iterator,
     List,
     Tuple,
     Dict
@@ -15,20 +34,41 @@ from typing import (
 from types import ModuleType
 from xdis.codetype.code38 import Code38
 
-from xasm.assemble import Instruction as InstructionStub
-from xdis.instruction import Instruction as RealInstruction
+try:
+    from resource import (
+        getrusage,
+        RUSAGE_SELF,
+        RUSAGE_CHILDREN
+    )
+except ImportError:
+    # not available on Windows
+    getrusage = None
+try:
+    from os import sysconf
+except ImportError:
+    # neither is this
+    sysconf = None
 
 
-# for making IDE happy again
-class InstructionStubWithLineNo(InstructionStub):
-    line_no: int
+class Instruction:
+    """
+    a compact mutable instruction, only has what the patcher needs
+
+    line numbers are kept in the co_lnotab of the code object, and the jump target
+    is the label id in arg if the instruction is to be backpatched
+    """
+    __slots__ = ('opname', 'opcode', 'arg', 'offset')
 
+    def __init__(self, opname: str, opcode: int, arg: Optional[int] = None, offset: int = -1):
+        self.opname = opname
+        self.opcode = opcode
+        self.arg = arg
+        self.offset = offset
 
-Instruction = Union[RealInstruction, InstructionStub, InstructionStubWithLineNo]
+    def __repr__(self) -> str:
+        return f'Instruction(opname={self.opname!r}, arg={self.arg!r}, offset={self.offset})'
 
 
-# the RealInstruction has some properties readonly, use the one from xasm, so it will work well
-# TODO: is this the correct way
 def build_inst(opc: ModuleType, opname: str, arg) -> Instruction:
     """
     Build an instruction from the given parameters
@@ -36,11 +76,7 @@ def build_inst(opc: ModuleType, opname: str, arg) -> Instruction:
     :param opname: the name of the instruction
     :param arg: the argument for the instruction
     """
-    stub = InstructionStub()
-    stub.opname = opname
-    stub.opcode = opc.opmap[opname]
-    stub.arg = arg
-    return stub
+    return Instruction(opname, opc.opmap[opname], arg)
 
 
 def rm_suffix(path: str, n_suffixes: int = 1) -> str:
@@ -91,11 +127,7 @@ def find_lino_no(lnotab: Dict[int, int], offset: int) -> int:
 
 def genlinestarts(code: Code38) -> bytes:
     """
-    HACK: Generate line-number table by the given code object
-
-    because xasm's behavior is strange, so I am doing this
-
-    :raises ValueError: if the line-number info in code object is invalid
+    Generate line-number table by the given code object
     """
     lnotab: Union[bytes, Dict[int, int]] = code.co_lnotab
     if isinstance(lnotab, bytes):
@@ -121,20 +153,132 @@ def genlinestarts(code: Code38) -> bytes:
             else:
                 offset_inc = offset - last_offset
                 lineno_inc = lineno - last_lineno
-            if offset_inc > 127:
-                raise ValueError(f'Too long gap between two line numbers (idx={idx})')
-            else:
+            # ref: https://towardsdatascience.com/understanding-python-bytecode-e7edaae8734d
+            # offset increments are unsigned bytes, split the long gaps
+            while offset_inc > 255:
+                out.append(255)
+                out.append(0)
+                offset_inc -= 255
+            # line increments are signed bytes, split the big jumps
+            while lineno_inc > 127:
                 out.append(offset_inc)
-                # ref: https://towardsdatascience.com/understanding-python-bytecode-e7edaae8734d
-                neg_lineno_inc = lineno_inc < 0
-                while lineno_inc < -128 if neg_lineno_inc else lineno_inc > 127:
-                    out.append(255 if neg_lineno_inc else 127)
-                    out.append(0)
-                    if neg_lineno_inc:
-                        lineno_inc += 128
-                    else:
-                        lineno_inc -= 127
-                out.append(256 + lineno_inc if neg_lineno_inc else lineno_inc)
+                out.append(127)
+                offset_inc = 0
+                lineno_inc -= 127
+            while lineno_inc < -128:
+                out.append(offset_inc)
+                out.append(128)
+                offset_inc = 0
+                lineno_inc += 128
+            out.append(offset_inc)
+            out.append(lineno_inc & 0xff)
             last_offset = offset
             last_lineno = lineno
         return bytes(out)
+
+
+def get_peak_memory(children: bool = False) -> Optional[int]:
+    """
+    Get the peak resident set size of this process, or of the largest of its finished child processes
+
+    :param children: get the one of the largest child process (the workers) instead,
+                     only the ones already waited for count, 0 if there's none
+    :return: peak memory usage in bytes, None if not supported on this platform
+    """
+    if getrusage is None:
+        return None
+    maxrss = getrusage(RUSAGE_CHILDREN if children else RUSAGE_SELF).ru_maxrss
+    # it's in bytes on macOS, but in kilobytes elsewhere
+    return maxrss if platform == 'darwin' else maxrss * 1024
+
+
+def copy_range(src: BinaryIO, dst: BinaryIO, length: int, chunk_size: int = 1 << 20):
+    """
+    copy bytes from the current position of a file to another in chunks
+
+    :param src: file object to read from
+    :param dst: file object to write to
+    :param length: how many bytes to copy
+    :param chunk_size: size of each read
+
+    :raises EOFError: if src ends before that
+    """
+    while length:
+        chunk = src.read(min(length, chunk_size))
+        if not chunk:
+            raise EOFError(f'{length} more bytes expected')
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def get_rss(pid: int) -> Optional[int]:
+    """
+    Get the resident set size of a process
+
+    :param pid: the process
+    :return: memory usage in bytes, None if not supported on this platform or the process is gone
+    """
+    if sysconf is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/statm', 'rb') as fp:
+            return int(fp.read().split()[1]) * sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def remove_atomic_leftovers(path: str):
+    """
+    remove the temp files left by atomic_open in the processes killed while writing the path
+    """
+    for tmp_path in glob(f'{escape(path)}.*.tmp'):
+        try:
+            unlink(tmp_path)
+        except OSError:
+            pass
+
+
+@contextmanager
+def atomic_open(path: str, sync: bool = False) -> Iterator[BinaryIO]:
+    """
+    open a file for writing, it only shows up at the path once it is completely written
+
+    it's written to a temp file next to it, which is renamed over the path when done, or removed if failed
+
+    :param path: path of the file
+    :param sync: make sure the content is on the disk before renaming
+    :return: the temp file object
+    """
+    tmp_path = f'{path}.{getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as fp:
+            yield fp
+            if sync:
+                fp.flush()
+                fsync(fp.fileno())
+        replace(tmp_path, path)
+    except BaseException:
+        try:
+            unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def link_or_copy(src: str, dst: str):
+    """
+    hardlink a file to another path atomically, or copy it if the filesystem can't do that
+
+    :param src: the existing file
+    :param dst: the new path, replaced if it exists
+    """
+    if exists(dst) and samefile(src, dst):
+        return
+    tmp_path = f'{dst}.{getpid()}.tmp'
+    try:
+        link(src, tmp_path)
+    except OSError:
+        with open(src, 'rb') as src_fp, atomic_open(dst) as dst_fp:
+            copyfileobj(src_fp, dst_fp)
+        return
+    replace(tmp_path, dst)
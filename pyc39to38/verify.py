@@ -0,0 +1,264 @@
+"""
+static checks for the converted code, no need to run a decompiler to find the broken ones
+"""
+
+from types import ModuleType
+from typing import (
+    Optional,
+    Iterator,
+    List,
+    Dict,
+    Tuple
+)
+
+from xdis.codetype.base import iscode
+
+from .emit import (
+    INST_SIZE,
+    ARG_BITS
+)
+
+
+# stack effects of 3.8, see stack_effect() in Python/compile.c of CPython 3.8
+FIXED_STACK_EFFECTS: Dict[str, int] = {
+    'NOP': 0, 'EXTENDED_ARG': 0,
+    'POP_TOP': -1, 'ROT_TWO': 0, 'ROT_THREE': 0, 'ROT_FOUR': 0, 'DUP_TOP': 1, 'DUP_TOP_TWO': 2,
+    'UNARY_POSITIVE': 0, 'UNARY_NEGATIVE': 0, 'UNARY_NOT': 0, 'UNARY_INVERT': 0,
+    'SET_ADD': -1, 'LIST_APPEND': -1, 'MAP_ADD': -2,
+    'BINARY_POWER': -1, 'BINARY_MULTIPLY': -1, 'BINARY_MATRIX_MULTIPLY': -1, 'BINARY_MODULO': -1,
+    'BINARY_ADD': -1, 'BINARY_SUBTRACT': -1, 'BINARY_SUBSCR': -1, 'BINARY_FLOOR_DIVIDE': -1,
+    'BINARY_TRUE_DIVIDE': -1, 'BINARY_LSHIFT': -1, 'BINARY_RSHIFT': -1, 'BINARY_AND': -1,
+    'BINARY_XOR': -1, 'BINARY_OR': -1,
+    'INPLACE_POWER': -1, 'INPLACE_MULTIPLY': -1, 'INPLACE_MATRIX_MULTIPLY': -1, 'INPLACE_MODULO': -1,
+    'INPLACE_ADD': -1, 'INPLACE_SUBTRACT': -1, 'INPLACE_FLOOR_DIVIDE': -1, 'INPLACE_TRUE_DIVIDE': -1,
+    'INPLACE_LSHIFT': -1, 'INPLACE_RSHIFT': -1, 'INPLACE_AND': -1, 'INPLACE_XOR': -1, 'INPLACE_OR': -1,
+    'STORE_SUBSCR': -3, 'DELETE_SUBSCR': -2,
+    'GET_ITER': 0, 'PRINT_EXPR': -1, 'LOAD_BUILD_CLASS': 1,
+    'WITH_CLEANUP_START': 2, 'WITH_CLEANUP_FINISH': -3,
+    'RETURN_VALUE': -1, 'IMPORT_STAR': -1, 'SETUP_ANNOTATIONS': 0, 'YIELD_VALUE': 0, 'YIELD_FROM': -1,
+    'POP_BLOCK': 0, 'POP_EXCEPT': -3, 'END_FINALLY': -6, 'POP_FINALLY': -6,
+    'STORE_NAME': -1, 'DELETE_NAME': 0,
+    'STORE_ATTR': -2, 'DELETE_ATTR': -1, 'STORE_GLOBAL': -1, 'DELETE_GLOBAL': 0,
+    'LOAD_CONST': 1, 'LOAD_NAME': 1, 'LOAD_ATTR': 0, 'COMPARE_OP': -1, 'IMPORT_NAME': -1, 'IMPORT_FROM': 1,
+    'JUMP_FORWARD': 0, 'JUMP_ABSOLUTE': 0, 'POP_JUMP_IF_FALSE': -1, 'POP_JUMP_IF_TRUE': -1,
+    'LOAD_GLOBAL': 1, 'BEGIN_FINALLY': 6,
+    'LOAD_FAST': 1, 'STORE_FAST': -1, 'DELETE_FAST': 0,
+    'LOAD_CLOSURE': 1, 'LOAD_DEREF': 1, 'LOAD_CLASSDEREF': 1, 'STORE_DEREF': -1, 'DELETE_DEREF': 0,
+    'GET_AWAITABLE': 0, 'BEFORE_ASYNC_WITH': 1, 'GET_AITER': 0, 'GET_ANEXT': 1, 'GET_YIELD_FROM_ITER': 0,
+    'END_ASYNC_FOR': -7, 'LOAD_METHOD': 1
+}
+
+# stack effects when jumping, if different from not jumping
+JUMP_STACK_EFFECTS: Dict[str, Tuple[int, int]] = {
+    # opname: (not jumping, jumping)
+    'FOR_ITER': (1, -1),
+    'JUMP_IF_TRUE_OR_POP': (-1, 0),
+    'JUMP_IF_FALSE_OR_POP': (-1, 0),
+    # the handler gets 6 values pushed
+    'SETUP_FINALLY': (0, 6),
+    'SETUP_WITH': (1, 6),
+    'SETUP_ASYNC_WITH': (0, 5),
+    'CALL_FINALLY': (0, 1)
+}
+
+# instructions never going to the next one
+NO_FALLTHROUGH = frozenset(('JUMP_ABSOLUTE', 'JUMP_FORWARD', 'RETURN_VALUE', 'RAISE_VARARGS'))
+
+# jumping to the exception handlers
+SETUP_OPS = frozenset(('SETUP_FINALLY', 'SETUP_WITH', 'SETUP_ASYNC_WITH'))
+BEGIN_FINALLY = 'BEGIN_FINALLY'
+END_FINALLY = 'END_FINALLY'
+CALL_FINALLY = 'CALL_FINALLY'
+# leaving an exception handler, or a "finally" block early (return/break/continue in it)
+HANDLER_LEAVES = frozenset(('END_ASYNC_FOR', 'POP_EXCEPT', 'POP_FINALLY'))
+
+# how a "finally" block or an exception handler is entered
+ENTERED_BY_HANDLER = 'h'
+ENTERED_BY_BEGIN_FINALLY = 'b'
+# both, END_FINALLY may go on to the next instruction
+ENTERED_BY_EITHER = '*'
+
+EXTENDED_ARG = 'EXTENDED_ARG'
+
+# stack depth, and how each of the "finally" blocks or handlers not left yet is entered
+STATE = Tuple[int, Tuple[str, ...]]
+
+
+def stack_effect(opname: str, arg: int, jump: bool) -> Optional[int]:
+    """
+    get the stack effect of a 3.8 instruction
+
+    :param opname: name of the instruction
+    :param arg: argument of the instruction
+    :param jump: whether it's jumping
+    :return: the stack effect, None if it's not a 3.8 instruction
+    """
+    if (effect := FIXED_STACK_EFFECTS.get(opname)) is not None:
+        return effect
+    if (effects := JUMP_STACK_EFFECTS.get(opname)) is not None:
+        return effects[jump]
+    if opname == 'UNPACK_SEQUENCE':
+        return arg - 1
+    elif opname == 'UNPACK_EX':
+        return (arg & 0xff) + (arg >> 8)
+    elif opname in ('BUILD_TUPLE', 'BUILD_LIST', 'BUILD_SET', 'BUILD_STRING',
+                    'BUILD_LIST_UNPACK', 'BUILD_TUPLE_UNPACK', 'BUILD_TUPLE_UNPACK_WITH_CALL',
+                    'BUILD_SET_UNPACK', 'BUILD_MAP_UNPACK', 'BUILD_MAP_UNPACK_WITH_CALL'):
+        return 1 - arg
+    elif opname == 'BUILD_MAP':
+        return 1 - 2 * arg
+    elif opname == 'BUILD_CONST_KEY_MAP':
+        return -arg
+    elif opname == 'RAISE_VARARGS':
+        return -arg
+    elif opname == 'CALL_FUNCTION':
+        return -arg
+    elif opname in ('CALL_METHOD', 'CALL_FUNCTION_KW'):
+        return -arg - 1
+    elif opname == 'CALL_FUNCTION_EX':
+        return -1 - (arg & 0x01)
+    elif opname == 'MAKE_FUNCTION':
+        return -1 - bin(arg & 0x0f).count('1')
+    elif opname == 'BUILD_SLICE':
+        return -2 if arg == 3 else -1
+    elif opname == 'FORMAT_VALUE':
+        # if there's a format spec on the stack
+        return -1 if arg & 0x04 else 0
+    return None
+
+
+def verify_code(opc: ModuleType, code) -> List[str]:
+    """
+    check a converted code object with a dataflow over the stack depth
+
+    checks that every jump lands on an instruction (and not right after an EXTENDED_ARG),
+    every instruction is a 3.8 one, the stack depth is the same at every join and never negative,
+    every END_FINALLY is paired with a BEGIN_FINALLY or an exception handler (so is POP_EXCEPT with the latter),
+    and co_stacksize is big enough
+
+    :param opc: opcode map of 3.8 (it's a module ig)
+    :param code: the code object, only co_code and co_stacksize are used
+    :return: problems found, empty if none
+    """
+    co_code = code.co_code
+    size = len(co_code)
+    problems: List[str] = []
+    if size % INST_SIZE:
+        return [f'co_code size {size} is not a multiple of {INST_SIZE}']
+
+    # decode all instructions, the args include the EXTENDED_ARG prefixes
+    opnames: List[str] = []
+    args: List[int] = []
+    targets: Dict[int, int] = {}
+    # the instructions right after an EXTENDED_ARG can't be jumped to
+    extended = set()
+    ext = None
+    for offset in range(0, size, INST_SIZE):
+        opcode = co_code[offset]
+        opname = opc.opname[opcode]
+        arg = co_code[offset + 1] | (ext or 0) if opcode >= opc.HAVE_ARGUMENT else 0
+        if ext is not None:
+            extended.add(offset)
+        # even EXTENDED_ARG 0 is a prefix
+        ext = arg << ARG_BITS if opname == EXTENDED_ARG else None
+        opnames.append(opname)
+        args.append(arg)
+        if opcode in opc.JREL_OPS:
+            targets[offset] = offset + INST_SIZE + arg
+        elif opcode in opc.JABS_OPS:
+            targets[offset] = arg
+
+    for offset, target in targets.items():
+        if target % INST_SIZE or not 0 <= target < size:
+            problems.append(f'{opnames[offset // INST_SIZE]} at {offset} jumps to {target}, '
+                            f'which is not an instruction')
+        elif target in extended:
+            problems.append(f'{opnames[offset // INST_SIZE]} at {offset} jumps to {target}, '
+                            f'which is in the middle of an EXTENDED_ARG prefixed instruction')
+    if problems:
+        return problems
+
+    # the dataflow, instructions are visited again only if "finally" blocks are entered in another way
+    states: Dict[int, STATE] = {0: (0, ())}
+    todo = [0]
+    max_depth = 0
+
+    def flow(from_offset: int, to_offset: int, state: STATE):
+        if to_offset >= size:
+            problems.append(f'{opnames[from_offset // INST_SIZE]} at {from_offset} falls off the end of the code')
+        elif (old_state := states.get(to_offset)) is None:
+            states[to_offset] = state
+            todo.append(to_offset)
+        elif old_state[0] != state[0] or len(old_state[1]) != len(state[1]):
+            problems.append(f'inconsistent stack at {to_offset}: depth {old_state[0]} in {len(old_state[1])} '
+                            f'"finally" blocks, but depth {state[0]} in {len(state[1])} from {from_offset}')
+        elif old_state != state:
+            # the same depth, but entered in different ways
+            merged = tuple(
+                old if old == new else ENTERED_BY_EITHER
+                for old, new in zip(old_state[1], state[1])
+            )
+            if merged != old_state[1]:
+                states[to_offset] = (state[0], merged)
+                todo.append(to_offset)
+
+    while todo:
+        offset = todo.pop()
+        depth, entered = states[offset]
+        opname, arg = opnames[offset // INST_SIZE], args[offset // INST_SIZE]
+        if (effect := stack_effect(opname, arg, False)) is None:
+            problems.append(f'{opname} at {offset} is not a 3.8 instruction')
+            continue
+        # CALL_FINALLY comes back after the "finally" block, which is checked through the other ways in
+        if (target := targets.get(offset)) is not None and opname != CALL_FINALLY:
+            jump_depth = depth + stack_effect(opname, arg, True)
+            max_depth = max(max_depth, jump_depth)
+            flow(offset, target, (jump_depth, entered + (ENTERED_BY_HANDLER,) if opname in SETUP_OPS else entered))
+        fallthrough = opname not in NO_FALLTHROUGH
+        if opname == BEGIN_FINALLY:
+            entered += (ENTERED_BY_BEGIN_FINALLY,)
+        elif opname == END_FINALLY or opname in HANDLER_LEAVES:
+            if not entered:
+                problems.append(f'{opname} at {offset} has no matching BEGIN_FINALLY or exception handler')
+                continue
+            if opname == END_FINALLY and entered[-1] == ENTERED_BY_HANDLER:
+                # there's always an exception to re-raise
+                fallthrough = False
+            entered = entered[:-1]
+        depth += effect
+        if depth < 0:
+            problems.append(f'stack underflow at {offset} ({opname})')
+            continue
+        max_depth = max(max_depth, depth)
+        if fallthrough:
+            flow(offset, offset + INST_SIZE, (depth, entered))
+
+    if max_depth > code.co_stacksize:
+        problems.append(f'co_stacksize is {code.co_stacksize}, but the stack can be {max_depth} deep')
+    return problems
+
+
+def iter_codes(code) -> Iterator:
+    """
+    iterate a code object and all the code objects in its constants
+    """
+    stack = [code]
+    while stack:
+        code = stack.pop()
+        yield code
+        stack.extend(const for const in code.co_consts if iscode(const))
+
+
+def verify_codes(opc: ModuleType, code) -> List[Tuple[str, List[str]]]:
+    """
+    check a converted code object and all the code objects in its constants
+
+    :param opc: opcode map of 3.8 (it's a module ig)
+    :param code: the code object of the module
+    :return: list of co_name and problems of the broken code objects
+    """
+    broken = []
+    for child in iter_codes(code):
+        if problems := verify_code(opc, child):
+            broken.append((child.co_name, problems))
+    return broken
@@ -7,226 +7,379 @@ from types import ModuleType
 from traceback import print_exc
 from typing import (
     Optional,
+    Counter,
+    List,
     Set,
     Dict,
-    Callable
+    Tuple
 )
 from logging import getLogger
 
-from xasm.assemble import (
-    Assembler,
-    create_code
-)
+from xasm.assemble import Assembler
 from xdis.cross_dis import (
     op_size,
     findlinestarts
 )
 from xdis.codetype.code38 import Code38
 from xdis.codetype.base import iscode
-from xdis.version_info import PYTHON_VERSION_TRIPLE
 
 from .utils import (
     Instruction,
-    build_inst,
-    genlinestarts
+    build_inst
+)
+from .patch import (
+    InPlacePatcher,
+    Code38WithInstructions
+)
+from .load import (
+    LoadedPyc,
+    MUTABLE_FIELDS
+)
+from .emit import (
+    emit_code,
+    resolve_arg,
+    EXTENDED_ARG,
+    INST_SIZE
+)
+from .rules import (
+    RULE_APPLIER,
+    RULE_BEGIN_FINALLY,
+    RULE_LIST_FROM_TUPLE
 )
-from .patch import InPlacePatcher
-from .rules import RULE_APPLIER
+from .optimize import optimize_jumps
 from .cfg import Config
 from . import PY38_VER
 
 
 logger = getLogger('walk')
 
-EXTENDED_ARG = 'EXTENDED_ARG'
+LOAD_CONST = 'LOAD_CONST'
+RETURN_VALUE = 'RETURN_VALUE'
+
+# the config options disabling the rules a failed code object can be retried without, in this order
+DEGRADABLE_RULES = (
+    ('no_begin_finally', RULE_BEGIN_FINALLY),
+    # this leaves the 3.9 list creation in place, the decompilers may still handle it
+    ('no_list_from_tuple', RULE_LIST_FROM_TUPLE)
+)
 
 
-def walk_codes(opc: ModuleType, asm: Assembler, is_pypy: bool,
-               cfg: Config, rule_applier: RULE_APPLIER) -> Optional[Assembler]:
+def prepare_patcher(opc: ModuleType, old_code: Code38WithInstructions, old_label: Dict[int, int],
+                    old_backpatch_inst: Set[Instruction], cfg: Config,
+                    in_place: bool = False) -> Tuple[InPlacePatcher, Set[Instruction]]:
     """
-    Walk through the codes and downgrade them
+    Get a code object ready for the rules
+
+    :param opc: opcode map (it's a module ig)
+    :param old_code: input code object
+    :param old_label: labels of the input code object
+    :param old_backpatch_inst: jump instructions of the input code object
+    :param cfg: config options
+    :param in_place: patch the input directly instead of a copy
+    :return: the patcher, and the instructions whose line number should be shifted when adding back EXTENDED_ARG
+    """
+    new_code = old_code if in_place else copy(old_code)
+    new_label = old_label if in_place else copy(old_label)
+    new_backpatch_inst: Set[Instruction] = set()
+    new_code.co_lnotab = dict(findlinestarts(old_code))
+    new_insts = []
+    for old_inst in old_code.instructions:
+        new_inst = old_inst if in_place else copy(old_inst)
+        new_insts.append(new_inst)
+        if old_inst in old_backpatch_inst:
+            # restore the backpatch tag
+            # the label id is the offset of the target
+            if new_inst.opcode in opc.JREL_OPS:
+                new_inst.arg += new_inst.offset + op_size(new_inst.opcode, opc)
+
+            new_backpatch_inst.add(new_inst)
+    new_code.instructions = new_insts
+    # TODO: IDK when the `instructions` is going to be removed
+
+    # note that patch can change the label and backpatch_inst
+    patcher = InPlacePatcher(opc, new_code, new_label, new_backpatch_inst)
+
+    # before applying the patches, we need to remove EXTENDED_ARG
+    shift_on_add_extarg: Set[Instruction] = set()
+    for inst_idx in range(len(patcher.code.instructions) - 1, -1, -1):
+        inst = patcher.code.instructions[inst_idx]
+        if inst.opname == EXTENDED_ARG:
+            _, _, label, line_no = patcher.pop_inst(inst_idx)
+            next_inst = patcher.code.instructions[inst_idx]
+            # if the removed inst has a label, we need some extra handling
+            if label is not None:
+                # if next inst has label, we need to redirect all reference of the original label to it
+                for iterating_label, label_off in patcher.label.items():
+                    if label_off == next_inst.offset:
+                        # replace all reference of the original label to the label of next inst
+                        for inst in patcher.backpatch_inst:
+                            if inst.arg == label:
+                                inst.arg = iterating_label
+                        break
+                else:
+                    # no label found for next inst, just add the original label back to there
+                    patcher.label[label] = next_inst.offset
+            # restore the line number if needed
+            if line_no:
+                patcher.code.co_lnotab[next_inst.offset] = line_no
+            else:
+                # see if the next inst has a line number
+                if next_inst.offset in patcher.code.co_lnotab:
+                    # we may want to shift the line number if we are going to re-add EXTENDED_ARG
+                    if cfg.preserve_lineno_after_extarg:
+                        shift_on_add_extarg.add(next_inst)
+
+    return patcher, shift_on_add_extarg
+
+
+def degraded_configs(cfg: Config) -> List[Tuple[Config, str]]:
+    """
+    get the configs to retry a failed code object with, each one disables one more of the rules
+
+    :param cfg: config options
+    :return: list of config and what it disables
+    """
+    configs = []
+    disabled = []
+    for option, rule in DEGRADABLE_RULES:
+        if getattr(cfg, option):
+            continue
+        cfg = copy(cfg)
+        setattr(cfg, option, True)
+        disabled.append(rule)
+        configs.append((cfg, 'without ' + ', '.join(disabled)))
+    return configs
+
+
+def stub_code(new_opc: ModuleType, old_code: Code38WithInstructions) -> Code38:
+    """
+    make a code object doing nothing but returning None in place of one not selected for conversion,
+    the signature, the names of the variables and the flags are kept, so that it can still be created
+
+    :param new_opc: opcode map of the output (it's a module ig)
+    :param old_code: input code object
+    :return: the frozen code object
+    """
+    new_code = copy(old_code)
+    new_code.instructions = [
+        Instruction(LOAD_CONST, new_opc.opmap[LOAD_CONST], 0, 0),
+        Instruction(RETURN_VALUE, new_opc.opmap[RETURN_VALUE], None, INST_SIZE)
+    ]
+    new_code.co_consts = [None]
+    new_code.co_names = []
+    new_code.co_stacksize = 1
+    new_code.co_lnotab = {0: new_code.co_firstlineno}
+    return emit_code(new_opc, new_code, {}, set())
+
+
+def patch_code(opc: ModuleType, new_opc: ModuleType, old_code: Code38WithInstructions, old_label: Dict[int, int],
+               old_backpatch_inst: Set[Instruction], methods: Dict[int, Code38], code_idx: int, is_pypy: bool,
+               cfg: Config, rule_applier: RULE_APPLIER, in_place: bool) -> Optional[Tuple[InPlacePatcher, Code38]]:
+    """
+    apply the rules to a code object and assemble it
 
     :param opc: opcode map (it's a module ig)
-    :param asm: input Assembler
+    :param new_opc: opcode map of the output (also a module)
+    :param old_code: input code object
+    :param old_label: labels of the input code object
+    :param old_backpatch_inst: jump instructions of the input code object
+    :param methods: the converted code objects, indexed by the input ones
+    :param code_idx: index of the code object, only for the messages
     :param is_pypy: set if is PyPy
     :param cfg: config options
     :param rule_applier: rule applier
-    :return: output Assembler, None if failed
+    :param in_place: patch the input directly instead of a copy
+    :return: the patcher and the frozen code object, None if failed
     """
+    patcher, shift_on_add_extarg = prepare_patcher(opc, old_code, old_label, old_backpatch_inst, cfg, in_place)
 
-    new_asm = Assembler(PY38_VER, is_pypy)
-    new_asm.size = asm.size
+    try:
+        rule_applier(patcher, is_pypy, cfg)
+        if cfg.optimize:
+            optimize_jumps(patcher)
+    except (ValueError, TypeError):
+        logger.error(f'failed to apply rules for code #{code_idx}:')
+        print_exc()
+        return None
 
-    methods: Dict[str, Code38] = {}
-
-    for code_idx, old_code in enumerate(asm.codes):
-        new_code = copy(old_code)
-        new_label = copy(asm.label[code_idx])
-        old_backpatch_inst = asm.backpatch[code_idx]
-        new_backpatch_inst: Set[Instruction] = set()
-        new_code.co_lnotab = dict(findlinestarts(old_code))
-        new_insts = []
-        for old_inst in old_code.instructions:
-            new_inst = copy(old_inst)
-            new_insts.append(new_inst)
-            if old_inst in old_backpatch_inst:
-                # restore the backpatch tag
-                if new_inst.opcode in opc.JREL_OPS:
-                    new_inst.arg += new_inst.offset + op_size(new_inst.opcode, opc)
-                new_inst.arg = f'L{new_inst.arg}'
-
-                new_backpatch_inst.add(new_inst)
-        new_code.instructions = new_insts
-        # TODO: IDK when the `instructions` is going to be removed
-
-        # note that patch can change the label and backpatch_inst
-        patcher = InPlacePatcher(opc, new_code, new_label, new_backpatch_inst)
-
-        # before applying the patches, we need to remove EXTENDED_ARG
-        shift_on_add_extarg: Set[Instruction] = set()
-        for inst_idx in range(len(patcher.code.instructions) - 1, -1, -1):
-            inst = patcher.code.instructions[inst_idx]
-            if inst.opname == EXTENDED_ARG:
-                _, _, label, line_no = patcher.pop_inst(inst_idx)
+    if (co := assemble_code(opc, new_opc, patcher, shift_on_add_extarg, methods, code_idx, cfg)) is None:
+        return None
+    return patcher, co
+
+
+def assemble_code(opc: ModuleType, new_opc: ModuleType, patcher: InPlacePatcher, shift_on_add_extarg: Set[Instruction],
+                  methods: Dict[int, Code38], code_idx: int, cfg: Config) -> Optional[Code38]:
+    """
+    assemble a code object the rules are applied to
+
+    :param opc: opcode map (it's a module ig)
+    :param new_opc: opcode map of the output (also a module)
+    :param patcher: the patcher from prepare_patcher, after the rules
+    :param shift_on_add_extarg: the instructions from prepare_patcher whose line starts move to an EXTENDED_ARG
+    :param methods: the converted code objects, indexed by the input ones
+    :param code_idx: index of the code object, only for the messages
+    :param cfg: config options
+    :return: the frozen code object, None if failed
+    """
+    new_code = patcher.code
+
+    # add back the EXTENDED_ARG where needed
+    while True:
+        dirty_insert = False
+        for inst_idx, inst in enumerate(patcher.code.instructions):
+            try:
+                # deref the label if any and calculate the real arg
+                arg = resolve_arg(new_opc, inst, patcher.label, patcher.backpatch_inst)
+            except ValueError:
+                logger.error(f'failed to resolve the arg at idx {inst_idx} in code #{code_idx}:')
+                print_exc()
+                return None
+            # check if we already have an EXTENDED_ARG on top
+            if inst_idx > 0 and (
+                    last_inst := patcher.code.instructions[inst_idx - 1]
+            ).opname == EXTENDED_ARG:
+                # this is after the first run, we need to update the arg
+                # (an EXTENDED_ARG 0 is harmless if the arg doesn't need it anymore)
+                last_inst.arg = arg >> 8
+            elif arg > 255:
+                # if the arg is bigger than one byte, we need to add EXTENDED_ARG
+                # the arg for EXTENDED_ARG is how many extra bytes we need to extend,
+                # if that is still bigger than one byte, it will get its own EXTENDED_ARG in the next run
+                size = op_size(opc.opmap[EXTENDED_ARG], opc)
+                extended_arg_inst = build_inst(patcher.opc, EXTENDED_ARG, arg >> 8)
+                # get the next inst
                 next_inst = patcher.code.instructions[inst_idx]
-                # if the removed inst has a label, we need some extra handling
-                if label:
-                    # if next inst has label, we need to redirect all reference of the original label to it
-                    for iterating_label, label_off in patcher.label.items():
-                        if label_off == next_inst.offset:
-                            # replace all reference of the original label to the label of next inst
-                            for inst in patcher.code.instructions:
-                                if patcher.need_backpatch(inst):
-                                    # this inst has a label as arg
-                                    if inst.arg == label:
-                                        inst.arg = iterating_label
-                            break
-                    else:
-                        # no label found for next inst, just add the original label back to there
-                        patcher.label[label] = next_inst.offset
-                # restore the line number if needed
-                if line_no:
-                    patcher.code.co_lnotab[next_inst.offset] = line_no
+                if cfg.preserve_lineno_after_extarg:
+                    shift_on_add = next_inst in shift_on_add_extarg
                 else:
-                    # see if the next inst has a line number
-                    if next_inst.offset in patcher.code.co_lnotab:
-                        # we may want to shift the line number if we are going to re-add EXTENDED_ARG
-                        if cfg.preserve_lineno_after_extarg:
-                            shift_on_add_extarg.add(next_inst)
-
-        try:
-            rule_applier(patcher, is_pypy, cfg)
-        except (ValueError, TypeError):
-            logger.error(f'failed to apply rules for code #{code_idx}:')
-            print_exc()
-            return None
-
-        # add back the EXTENDED_ARG where needed
-        while True:
-            dirty_insert = False
-            for inst_idx, inst in enumerate(patcher.code.instructions):
-                if patcher.need_backpatch(inst):
-                    # this inst has a label as arg
-                    # deref the label
-                    label_off = patcher.label[inst.arg]
-                    # calculate the real arg
-                    if inst.opcode in opc.JREL_OPS:
-                        arg = label_off - inst.offset - op_size(inst.opcode, opc)
-                    elif inst.opcode in opc.JABS_OPS:
-                        arg = label_off
-                    else:
-                        raise ValueError(f'unsupported jump opcode {inst.opname} at idx {inst_idx} in code #{code_idx}')
-                    # if the arg is bigger than one byte, we need to add EXTENDED_ARG
-                    # the arg for EXTENDED_ARG is how many extra bytes we need to extend
-                    if arg > 255:
-                        # check if we already have an EXTENDED_ARG on top
-                        if inst_idx > 0 and (
-                                last_inst := patcher.code.instructions[inst_idx - 1]
-                        ).opname == EXTENDED_ARG:
-                            # this is after the first run, we need to update the arg
-                            last_inst.arg = arg // 256
-                        else:
-                            # we need to add EXTENDED_ARG
-                            size = op_size(opc.opmap[EXTENDED_ARG], opc)
-                            extended_arg_inst = build_inst(patcher.opc, EXTENDED_ARG, arg // 256)
-                            # get the next inst
-                            next_inst = patcher.code.instructions[inst_idx]
-                            if cfg.preserve_lineno_after_extarg:
-                                shift_on_add = next_inst in shift_on_add_extarg
-                            else:
-                                shift_on_add = False
-                            patcher.insert_inst(extended_arg_inst, size, inst_idx, None, shift_on_add)
-                            dirty_insert = True
-                            # if the next inst has a label, just set it to here
-                            # iterate all labels
-                            for iterating_label, label_off in patcher.label.items():
-                                if label_off == next_inst.offset:
-                                    # set the offset to this inst
-                                    patcher.label[iterating_label] = extended_arg_inst.offset
-                                    break
-                            break
-            if not dirty_insert:
+                    shift_on_add = False
+                patcher.insert_inst(extended_arg_inst, size, inst_idx, None, shift_on_add)
+                dirty_insert = True
+                # if the next inst has a label, just set it to here
+                # iterate all labels
+                for iterating_label, label_off in patcher.label.items():
+                    if label_off == next_inst.offset:
+                        # set the offset to this inst
+                        patcher.label[iterating_label] = extended_arg_inst.offset
+                        break
                 break
+        if not dirty_insert:
+            break
 
-        try:
-            # messes are done, fix the stuffs xDD
-            patcher.fix_all()
-        except ValueError:
-            logger.error(f'failed to fix the code #{code_idx}:')
-            print_exc()
-            return None
+    # fix the code objects in constants
+    const_is_tuple = isinstance(new_code.co_consts, tuple)
+    if const_is_tuple:
+        new_code.co_consts = list(new_code.co_consts)
+    for idx, const in enumerate(new_code.co_consts):
+        if iscode(const):
+            if id(const) in methods:
+                new_code.co_consts[idx] = methods[id(const)]
+            else:
+                logger.error(f'missing method \'{const.co_name}\' in code #{code_idx}')
+                return None
+    if const_is_tuple:
+        new_code.co_consts = tuple(new_code.co_consts)
 
-        new_asm.code = new_code
-        # fix the code objects in constants
-        const_is_tuple = isinstance(new_asm.code.co_consts, tuple)
-        if const_is_tuple:
-            new_asm.code.co_consts = list(new_asm.code.co_consts)
-        for idx, const in enumerate(new_asm.code.co_consts):
-            if iscode(const):
-                if const.co_name in methods:
-                    new_asm.code.co_consts[idx] = methods[const.co_name]
-                else:
-                    logger.error(f'missing method \'{const.co_name}\' in code #{code_idx}')
-                    return None
-        if const_is_tuple:
-            new_asm.code.co_consts = tuple(new_asm.code.co_consts)
+    try:
+        # this assembles the instructions and writes the code.co_code
+        # after that it also freezes the code object
+        return emit_code(new_opc, new_code, patcher.label, patcher.backpatch_inst)
+    except ValueError:
+        logger.error(f'failed to assemble the code #{code_idx}:')
+        print_exc()
+        return None
 
-        # backup the lnotab for the following hack
-        lnotab_backup = new_code.co_lnotab
 
-        native_code = new_asm.python_version[:2] == PYTHON_VERSION_TRIPLE[:2]
-        old_to_native: Optional[Callable] = None
+def walk_codes(opc: ModuleType, asm: LoadedPyc, is_pypy: bool,
+               cfg: Config, rule_applier: RULE_APPLIER, stats: Optional[Counter[str]] = None,
+               degraded: Optional[List[str]] = None) -> Optional[Assembler]:
+    """
+    Walk through the codes and downgrade them
 
-        if native_code:
-            old_to_native = new_code.to_native
-            new_code.to_native = new_code.freeze
+    :param opc: opcode map (it's a module ig)
+    :param asm: the loaded input file
+    :param is_pypy: set if is PyPy
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param stats: where to count how many times each rule applies
+    :param degraded: where to list the code objects converted with some rules disabled, if cfg.degrade is set
+    :return: output Assembler, None if failed
 
-        # this assembles the instructions and writes the code.co_code
-        # after that it also freezes the code object
-        co = create_code(new_asm, patcher.label, patcher.backpatch_inst)
-
-        # rollback the lnotab for the hack
-        co.co_lnotab = lnotab_backup
-        try:
-            # HACK: xasm has a bug encoding lnotab with big numbers and negative line number increments
-            #       use our own lnotab encoder here to fix it
-            co.co_lnotab = genlinestarts(co)
-        except ValueError:
-            logger.error(f'failed to fix the line number table for code #{code_idx}:')
-            print_exc()
-            return None
+    if cfg.only is set, the code objects not selected by it are replaced with stubs
+    """
 
-        if native_code:
-            old_to_native()
+    new_asm = Assembler(PY38_VER, is_pypy)
+    new_asm.size = asm.size
+
+    # the names are not unique (think of lambdas), so index the methods by the input code objects
+    methods: Dict[int, Code38] = {}
+
+    # in low memory mode, the input is patched in place and released once converted
+    low_memory = cfg.low_memory
+    # a failed code object is retried from the input, so it can't be patched in place then
+    attempts = [(cfg, None)] + degraded_configs(cfg) if cfg.degrade else [(cfg, None)]
+    in_place = low_memory and not cfg.degrade
+    co: Optional[Code38] = None
+    stubbed = set(range(len(asm.codes))) - asm.select(cfg.only) if cfg.only is not None else set()
+    if stubbed and len(stubbed) == len(asm.codes):
+        logger.warning(f'no code object matches {", ".join(cfg.only)}, the output does nothing')
+
+    for code_idx, (old_code, old_label, old_backpatch_inst) in enumerate(asm.iter_codes(low_memory, stubbed)):
+        children = [id(const) for const in old_code.co_consts if iscode(const)]
+        if code_idx in stubbed:
+            co = stub_code(new_asm.opc, old_code)
+            methods[id(old_code)] = co
+            for child in children:
+                methods.pop(child, None)
+            if low_memory:
+                del co.instructions
+            else:
+                new_asm.update_lists(co, {}, set())
+            continue
+
+        # the rules may change the lists of the input, as they are shared with the copy
+        saved = {field: list(getattr(old_code, field)) for field in MUTABLE_FIELDS} if cfg.degrade else None
+        for attempt_cfg, reason in attempts:
+            if reason is not None:
+                for field, val in saved.items():
+                    setattr(old_code, field, list(val))
+                logger.warning(f'retrying code #{code_idx} {reason}')
+            if (result := patch_code(opc, new_asm.opc, old_code, old_label, old_backpatch_inst, methods, code_idx,
+                                     is_pypy, attempt_cfg, rule_applier, in_place)) is not None:
+                break
+        else:
+            return None
+        patcher, co = result
+        if reason is not None:
+            qualname = asm.qualnames[code_idx]
+            logger.warning(f'code #{code_idx} {qualname!r} is converted {reason}')
+            if degraded is not None:
+                degraded.append(f'{qualname}: {reason}')
+        if stats is not None:
+            stats.update(patcher.stats)
+        new_asm.code = patcher.code
 
-        # register the method name
-        methods[co.co_name] = co
-        # append data to lists, also backup the code
-        # TODO: i hope i understand this correctly
-        new_asm.update_lists(co, patcher.label, patcher.backpatch_inst)
+        if low_memory:
+            # every method belongs to only one parent, so we can forget them
+            for child in children:
+                methods.pop(child, None)
+        # register the method
+        methods[id(old_code)] = co
+        if low_memory:
+            # only the frozen code object is needed from now on
+            del co.instructions
+        else:
+            # append data to lists, also backup the code
+            # TODO: i hope i understand this correctly
+            new_asm.update_lists(co, patcher.label, patcher.backpatch_inst)
 
-    # TODO: why is this getting reversed?
-    new_asm.code_list.reverse()
+    if low_memory:
+        # the last one is the module itself, the rest are already in its constants
+        if co is not None:
+            new_asm.code_list.append(co)
+    else:
+        # TODO: why is this getting reversed?
+        new_asm.code_list.reverse()
     # TODO: what does this do?
     new_asm.finished = 'finished'
     return new_asm
@@ -0,0 +1,255 @@
+"""
+watching a spool directory and converting the bytecode files as they land in it
+"""
+
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    Future,
+    wait,
+    FIRST_COMPLETED
+)
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from functools import partial
+from logging import getLogger
+from os import (
+    stat,
+    makedirs
+)
+from os.path import (
+    join,
+    relpath
+)
+from signal import (
+    signal,
+    SIGTERM,
+    SIGINT,
+    SIG_IGN
+)
+from time import (
+    monotonic,
+    sleep
+)
+from typing import (
+    Optional,
+    TextIO,
+    Deque,
+    Tuple,
+    Dict
+)
+
+from .archive import rename_member
+from .batch import (
+    find_pycs,
+    default_jobs
+)
+from .tree import (
+    convert_tree_file,
+    failed_entry,
+    report_line
+)
+from .rules import RULE_APPLIER
+from .cfg import Config
+from . import FILE_ENCODING
+
+
+logger = getLogger('watch')
+
+# how often to look for new files, in seconds
+POLL_INTERVAL = 0.5
+# how long a file must stay the same before it's taken as fully written, in seconds
+SETTLE_TIME = 1.0
+# how often to log the latency, in seconds
+METRICS_INTERVAL = 60.0
+# how many of the latest latencies the percentiles are taken from
+LATENCY_WINDOW = 10000
+
+# size and mtime of a file
+FILE_STATE = Tuple[int, int]
+
+
+class LatencyStats:
+    """
+    latency from the arrival of a file to its converted output, in seconds
+
+    only the latest ones are kept for the percentiles, so that a long watch doesn't keep them all
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.converted = 0
+        self.failed = 0
+        self.max_latency = 0.0
+
+    def add(self, latency: float):
+        self.latencies.append(latency)
+        self.converted += 1
+        self.max_latency = max(self.max_latency, latency)
+
+    def percentile(self, fraction: float) -> float:
+        """
+        :param fraction: from 0 to 1
+        :return: the latency below which this fraction of the files are
+        """
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+    def log(self):
+        if not self.latencies:
+            logger.info(f'no files converted yet, {self.failed} failed')
+            return
+        logger.info(f'{self.converted} files converted, {self.failed} failed, latency '
+                    f'p50 {self.percentile(0.5):.2f}s, p95 {self.percentile(0.95):.2f}s '
+                    f'of the last {len(self.latencies)}, max {self.max_latency:.2f}s')
+
+
+class Stop(Exception):
+    """
+    raised by the signal handler to stop watching
+    """
+
+
+def raise_stop(*_):
+    raise Stop()
+
+
+def ignore_sigint():
+    """
+    the workers leave Ctrl-C to the main process, which lets them finish the files being converted
+    """
+    signal(SIGINT, SIG_IGN)
+
+
+def new_pool(jobs: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=jobs, initializer=ignore_sigint)
+
+
+def watch_tree(spool_root: str, output_root: str, cfg: Config, rule_applier: RULE_APPLIER,
+               jobs: Optional[int] = None, report_path: Optional[str] = None) -> LatencyStats:
+    """
+    convert the bytecode files in a spool directory as they land in it, until interrupted or terminated
+
+    a file is converted once it stays the same for SETTLE_TIME, and again if it changes after that
+
+    :param spool_root: the directory to watch
+    :param output_root: output directory
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param jobs: number of worker processes (default: number of CPUs)
+    :param report_path: write the report of each file converted to this JSONL file, with its latency
+    :return: the latency of the converted files
+    """
+    if jobs is None:
+        jobs = default_jobs()
+    stats = LatencyStats()
+    # files seen but not settled yet: state, when it was first seen, when it last changed
+    arriving: Dict[str, Tuple[FILE_STATE, float, float]] = {}
+    # the state of the files already submitted
+    submitted: Dict[str, FILE_STATE] = {}
+    # futures of the files being converted, with when they were first seen
+    in_flight: Dict[Future, Tuple[str, float]] = {}
+
+    old_handler = signal(SIGTERM, raise_stop)
+    makedirs(output_root, exist_ok=True)
+    report_fp = open(report_path, 'a', encoding=FILE_ENCODING) if report_path else None
+    func = partial(convert_tree_file, cfg=cfg, rule_applier=rule_applier)
+    next_metrics = monotonic() + METRICS_INTERVAL
+    executor = new_pool(jobs)
+    try:
+        try:
+            while True:
+                now = monotonic()
+                input_paths = find_pycs(spool_root)
+                for input_path in input_paths:
+                    try:
+                        st = stat(input_path)
+                    except OSError:
+                        # moved away in the meantime
+                        continue
+                    state = (st.st_size, st.st_mtime_ns)
+                    if submitted.get(input_path) == state:
+                        continue
+                    if (arrival := arriving.get(input_path)) is None or arrival[0] != state:
+                        first_seen = now if arrival is None else arrival[1]
+                        arriving[input_path] = (state, first_seen, now)
+                        continue
+                    if now - arrival[2] < SETTLE_TIME:
+                        continue
+                    del arriving[input_path]
+                    submitted[input_path] = state
+                    output_path = join(output_root, rename_member(relpath(input_path, spool_root)))
+                    try:
+                        future = executor.submit(func, (input_path, output_path, True))
+                    except BrokenProcessPool:
+                        # a worker died, the files being converted are lost with the pool
+                        logger.error(f'the worker pool is broken, {len(in_flight)} files being converted failed, '
+                                     f'starting a new one')
+                        for lost, (lost_path, lost_seen) in in_flight.items():
+                            finish(lost, lost_path, lost_seen, spool_root, stats, report_fp)
+                        in_flight.clear()
+                        executor.shutdown()
+                        executor = new_pool(jobs)
+                        future = executor.submit(func, (input_path, output_path, True))
+                    in_flight[future] = (input_path, arrival[1])
+
+                if len(submitted) > len(input_paths):
+                    # forget the files moved away, so that the memory doesn't grow forever
+                    present = set(input_paths)
+                    submitted = {path: state for path, state in submitted.items() if path in present}
+                    arriving = {path: arrival for path, arrival in arriving.items() if path in present}
+
+                if monotonic() >= next_metrics:
+                    stats.log()
+                    next_metrics += METRICS_INTERVAL
+
+                # record the finished files as soon as they are done until the next poll
+                deadline = now + POLL_INTERVAL
+                while (timeout := deadline - monotonic()) > 0:
+                    if not in_flight:
+                        sleep(timeout)
+                        break
+                    done, _ = wait(in_flight, timeout, FIRST_COMPLETED)
+                    for future in done:
+                        input_path, first_seen = in_flight.pop(future)
+                        finish(future, input_path, first_seen, spool_root, stats, report_fp)
+        except (KeyboardInterrupt, Stop):
+            logger.info(f'stopping, waiting for {len(in_flight)} files being converted')
+        for future, (input_path, first_seen) in in_flight.items():
+            finish(future, input_path, first_seen, spool_root, stats, report_fp)
+    finally:
+        executor.shutdown()
+        signal(SIGTERM, old_handler)
+        if report_fp is not None:
+            report_fp.close()
+    stats.log()
+    return stats
+
+
+def finish(future: Future, input_path: str, first_seen: float, spool_root: str, stats: LatencyStats,
+           report_fp: Optional[TextIO]):
+    """
+    record the result of a file converted in watch mode
+
+    :param future: the future of the conversion
+    :param input_path: path of the input file
+    :param first_seen: when the file was first seen
+    :param spool_root: the directory watched
+    :param stats: where to record the latency
+    :param report_fp: the report file, None if not written
+    """
+    try:
+        entry = future.result()
+    except Exception as e:
+        # the pool is broken, e.g. a worker was killed
+        entry = failed_entry(input_path, f'worker failed: {e!r}')
+    latency = monotonic() - first_seen
+    rel_input = relpath(input_path, spool_root)
+    if entry['ok']:
+        stats.add(latency)
+        logger.info(f'converted {rel_input} in {latency:.2f}s')
+    else:
+        stats.failed += 1
+        logger.error(f'failed to convert {rel_input}: {entry["error"]}')
+    if report_fp is not None:
+        report_fp.write(report_line(rel_input, entry, None, latency=latency))
+        report_fp.flush()
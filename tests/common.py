@@ -0,0 +1,164 @@
+"""
+helpers shared by the tests
+"""
+
+from io import BytesIO
+from marshal import dumps
+from os import (
+    environ,
+    walk
+)
+from os.path import (
+    join,
+    dirname,
+    relpath
+)
+from shutil import which
+from subprocess import (
+    run,
+    PIPE,
+    DEVNULL,
+    CompletedProcess
+)
+from sys import executable
+from typing import (
+    Optional,
+    Set,
+    Tuple
+)
+
+from xasm.write_pyc import write_pycfile
+from xdis.disasm import get_opcode
+from xdis.magics import magics
+
+from pyc39to38.load import (
+    load_pyc,
+    LoadedPyc
+)
+from pyc39to38.patch import InPlacePatcher
+from pyc39to38.walk import prepare_patcher
+from pyc39to38.cfg import Config
+from pyc39to38 import (
+    PY38_VER,
+    PY39_VER
+)
+from tools.synthetic import SyntheticCode
+
+
+ROOT_DIR = dirname(dirname(__file__))
+DATA_DIR = join(dirname(__file__), 'data')
+# compiled by Python 3.9 from sample.py
+SAMPLE_PYC = join(DATA_DIR, 'sample.pyc')
+# what sample.run() returns
+SAMPLE_RESULT = repr([5, 7, -1, ([1, 2, 3], [(1, 2), 3], ['a', 'b']), 5, 1, 465, 'reraised'])
+# compiled by Python 3.9 from jumps.py
+JUMPS_PYC = join(DATA_DIR, 'jumps.pyc')
+# what jumps.run() returns
+JUMPS_RESULT = repr([['big odd', 'big even', 'negative', 'zero', 'none', 'small'], (3, 0), 2, 0])
+
+# a 3.9 bytecode file without a code object in it
+NOT_CODE_PYC = magics['3.9'] + bytes(12) + dumps(tuple(range(100)))
+
+# the opcodes added by 3.9, none of them may be left in the output of the rules
+PY39_ONLY_OPS = {'RERAISE', 'JUMP_IF_NOT_EXC_MATCH'}
+
+# a Python 3.8 interpreter to run the output with, the tests needing it are skipped if there's none
+PY38_ENV = 'PYC39TO38_PY38'
+
+RUN_SAMPLE = '''
+import marshal, sys
+code = marshal.loads(sys.stdin.buffer.read()[16:])
+namespace = {}
+exec(code, namespace)
+print(repr(namespace['run']()))
+'''
+
+
+def read_sample(path: str = SAMPLE_PYC) -> bytes:
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
+def find_py38() -> Optional[str]:
+    """
+    :return: path of a working Python 3.8 interpreter, None if not found
+    """
+    for candidate in (environ.get(PY38_ENV), which('python3.8')):
+        if not candidate:
+            continue
+        # pyenv shims exist even if the version isn't selected
+        if run([candidate, '-c', 'import sys; assert sys.version_info[:2] == (3, 8)'],
+               stdout=DEVNULL, stderr=DEVNULL).returncode == 0:
+            return candidate
+    return None
+
+
+def run_sample_py38(py38: str, data: bytes) -> str:
+    """
+    run the converted sample module with Python 3.8
+
+    :return: repr of what run() returns
+    """
+    proc = run([py38, '-c', RUN_SAMPLE], input=data, stdout=PIPE, stderr=PIPE, check=False)
+    assert proc.returncode == 0, proc.stderr.decode(errors='replace')
+    return proc.stdout.decode().strip()
+
+
+def load_output(data: bytes) -> LoadedPyc:
+    """
+    load a converted bytecode file, decoding the instructions with the 3.8 opcodes
+    """
+    pyc = load_pyc('<output>', PY38_VER, fp=BytesIO(data))
+    assert pyc is not None, 'the output is not 3.8 bytecode'
+    return pyc
+
+
+def load_input(data: bytes) -> LoadedPyc:
+    pyc = load_pyc('<input>', PY39_VER, fp=BytesIO(data))
+    assert pyc is not None
+    return pyc
+
+
+def output_opnames(data: bytes) -> Set[str]:
+    """
+    :return: names of all the opcodes used in a converted bytecode file
+    """
+    return {inst.opname for code in load_output(data).codes for inst in code.instructions}
+
+
+def synthetic_pyc(code: SyntheticCode) -> bytes:
+    """
+    :return: a 3.9 bytecode file with the generated code object as its module
+    """
+    with BytesIO() as fp:
+        write_pycfile(fp, [code.build(get_opcode(PY39_VER, False), 0)], 0, PY39_VER)
+        return fp.getvalue()
+
+
+def synthetic_patcher(code: SyntheticCode) -> Tuple[LoadedPyc, InPlacePatcher, Set]:
+    """
+    load a generated code object and get it ready for the rules
+
+    :return: the loaded file, the patcher, and the instructions whose line starts move to an EXTENDED_ARG
+    """
+    pyc = load_input(synthetic_pyc(code))
+    (code, label, backpatch_inst), = pyc.iter_codes()
+    return (pyc, *prepare_patcher(pyc.opc, code, label, backpatch_inst, Config()))
+
+
+def list_files(root: str) -> Set[str]:
+    """
+    :return: relative paths of all the files under a directory
+    """
+    return {relpath(join(dir_path, name), root) for dir_path, _, names in walk(root) for name in names}
+
+
+def run_cli(*args: str, stdin: bytes = b'', python_args=(), module: str = 'pyc39to38') -> CompletedProcess:
+    """
+    run the command line interface in another process
+
+    :param module: the module run, e.g. one of the tools
+    """
+    env = dict(environ, PYTHONPATH=ROOT_DIR)
+    return run([executable, *python_args, '-m', module, *args],
+               input=stdin, stdout=PIPE, stderr=PIPE, env=env, check=False)
@@ -0,0 +1,59 @@
+from shutil import copyfile
+from os.path import (
+    join,
+    dirname
+)
+from os import makedirs
+
+import pytest
+
+from pyc39to38.asm import reasm_bytes
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.cfg import Config
+
+from .common import (
+    SAMPLE_PYC,
+    find_py38,
+    read_sample
+)
+
+
+@pytest.fixture
+def cfg() -> Config:
+    """
+    the options the sample converts with, the "finally" block patching doesn't handle
+    a return in a try block yet
+    """
+    cfg = Config()
+    cfg.no_begin_finally = True
+    return cfg
+
+
+@pytest.fixture
+def converted_sample(cfg) -> bytes:
+    """
+    the sample converted in memory with the cfg fixture, what the other ways of converting it should write
+    """
+    data = reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38)
+    assert data is not None
+    return data
+
+
+@pytest.fixture(scope='session')
+def py38() -> str:
+    if (path := find_py38()) is None:
+        pytest.skip('no Python 3.8 interpreter to run the output with (set PYC39TO38_PY38)')
+    return path
+
+
+@pytest.fixture
+def sample_tree(tmp_path) -> str:
+    """
+    a directory tree of copies of the sample
+    """
+    root = str(tmp_path / 'in')
+    for rel in ('a.pyc', 'pkg/b.pyc', 'pkg/sub/c.pyc'):
+        path = join(root, rel)
+        makedirs(dirname(path), exist_ok=True)
+        copyfile(SAMPLE_PYC, path)
+    return root
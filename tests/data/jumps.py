@@ -0,0 +1,56 @@
+"""
+the module of the jump optimization tests, compiled by Python 3.9 into jumps.pyc:
+
+    python3.9 -c "import py_compile; py_compile.compile('jumps.py', 'jumps.pyc', doraise=True)"
+
+the branches nested in loops leave jumps to jumps, run() has to give the same result when they are threaded
+"""
+
+
+def classify(items):
+    out = []
+    for x in items:
+        if x > 10:
+            if x % 2:
+                out.append('big odd')
+            else:
+                out.append('big even')
+        elif x < 0:
+            while x < 0:
+                x += 3
+                if x == 0:
+                    break
+            else:
+                out.append('negative')
+                continue
+            out.append('zero')
+        else:
+            out.append('small' if x else 'none')
+    return out
+
+
+def scan(text):
+    state = 0
+    count = 0
+    for ch in text:
+        if state == 0:
+            if ch == '"':
+                state = 1
+            elif ch == ' ':
+                pass
+            else:
+                count += 1
+        elif state == 1:
+            if ch == '"':
+                state = 0
+        else:
+            break
+    return count, state
+
+
+def pick(a, b, c):
+    return (a and b) or (c if a else b) or (not c and a)
+
+
+def run():
+    return [classify([11, 12, -2, -3, 0, 5]), scan('ab "c d" e'), pick(1, 0, 2), pick(0, 0, 0)]
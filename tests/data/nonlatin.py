@@ -0,0 +1,9 @@
+"""
+the module of the marshalling failure test, compiled by Python 3.9 into nonlatin.pyc:
+
+    python3.9 -c "import py_compile; py_compile.compile('nonlatin.py', 'nonlatin.pyc', doraise=True)"
+
+xdis can't marshal a string beyond Latin-1 for 3.8, the conversion has to fail without writing anything
+"""
+
+NAME = '\u0100'
@@ -0,0 +1,95 @@
+"""
+the sample module of the tests, compiled by Python 3.9 into sample.pyc:
+
+    python3.9 -c "import py_compile; py_compile.compile('sample.py', 'sample.pyc', doraise=True)"
+
+run() covers what the rules rewrite, the converted module has to give the same result under Python 3.8
+"""
+
+
+def with_finally(x):
+    try:
+        y = [1, 2, 3]
+    finally:
+        x += 1
+    return x + y[0]
+
+
+def reraise(x):
+    try:
+        return int(x)
+    except ValueError:
+        if x == 'raise':
+            raise
+        return -1
+
+
+def lists():
+    return [1, 2, 3], [(1, 2), 3], ['a', 'b']
+
+
+def loops(n):
+    total = 0
+    for i in range(n):
+        if i > 5:
+            break
+        while total < i:
+            total += 1
+    return total
+
+
+class Counter:
+    def __init__(self):
+        self.count = 0
+
+    def bump(self):
+        try:
+            self.count += 1
+        except TypeError:
+            raise
+        return self.count
+
+
+def big(n):
+    total = 0
+    for i in range(n):
+        if i == 1: total += 1
+        if i == 2: total += 2
+        if i == 3: total += 3
+        if i == 4: total += 4
+        if i == 5: total += 5
+        if i == 6: total += 6
+        if i == 7: total += 7
+        if i == 8: total += 8
+        if i == 9: total += 9
+        if i == 10: total += 10
+        if i == 11: total += 11
+        if i == 12: total += 12
+        if i == 13: total += 13
+        if i == 14: total += 14
+        if i == 15: total += 15
+        if i == 16: total += 16
+        if i == 17: total += 17
+        if i == 18: total += 18
+        if i == 19: total += 19
+        if i == 20: total += 20
+        if i == 21: total += 21
+        if i == 22: total += 22
+        if i == 23: total += 23
+        if i == 24: total += 24
+        if i == 25: total += 25
+        if i == 26: total += 26
+        if i == 27: total += 27
+        if i == 28: total += 28
+        if i == 29: total += 29
+        if i == 30: total += 30
+    return total
+
+
+def run():
+    results = [with_finally(3), reraise('7'), reraise('x'), lists(), loops(10), Counter().bump(), big(40)]
+    try:
+        reraise('raise')
+    except ValueError:
+        results.append('reraised')
+    return results
@@ -0,0 +1,162 @@
+from asyncio import (
+    Queue,
+    new_event_loop,
+    wait_for,
+    TimeoutError as AsyncTimeoutError
+)
+from json import loads
+from os import _exit
+from os.path import join
+from threading import get_ident
+
+import pytest
+
+from pyc39to38 import aio
+from pyc39to38.aio import (
+    run_async_io,
+    ByteBudget
+)
+from pyc39to38.batch import PoolStats
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.tree import (
+    convert_tree,
+    JOURNAL_NAME
+)
+
+from .common import list_files
+
+
+# the items are names, the results are (name, what happened)
+def item_size(item: str) -> int:
+    return len(item)
+
+
+def read_item(item: str):
+    if item.startswith('missing'):
+        return (item, 'not read'), None
+    return (item, 'read'), item.encode()
+
+
+def convert_item(result, data: bytes):
+    """
+    run in the workers, does what the item says
+    """
+    if data == b'exit':
+        _exit(3)
+    elif data == b'raise':
+        raise ValueError('asked to')
+    elif data == b'bad':
+        return (result[0], 'not converted'), None
+    return (result[0], 'converted'), data.upper()
+
+
+def write_item(item: str, result, data: bytes):
+    return result[0], f'wrote {data.decode()} in {"main" if get_ident() == MAIN_THREAD else "thread"}'
+
+
+def failed_item(item: str, error: str):
+    return item, error
+
+
+MAIN_THREAD = get_ident()
+
+
+def test_run_async_io():
+    stats = PoolStats(2)
+    results = dict(run_async_io(['a', 'bb', 'missing', 'bad', 'raise', 'ccc'], item_size, read_item, convert_item,
+                                write_item, failed_item, 2, stats=stats))
+    assert results == {
+        'a': 'wrote A in thread',
+        'bb': 'wrote BB in thread',
+        'ccc': 'wrote CCC in thread',
+        'missing': 'not read',
+        'bad': 'not converted',
+        'raise': "worker failed: ValueError('asked to')"
+    }
+    assert stats.wall > 0 and stats.busy > 0
+
+
+def test_run_async_io_small_budget():
+    # an item larger than the budget still goes through, alone
+    results = sorted(run_async_io(['x' * 10, 'y', 'z' * 5], item_size, read_item, convert_item, write_item,
+                                  failed_item, 1, prefetch=1, max_in_flight=2))
+    assert results == [('x' * 10, 'wrote XXXXXXXXXX in thread'), ('y', 'wrote Y in thread'),
+                       ('z' * 5, 'wrote ZZZZZ in thread')]
+
+
+def test_run_async_io_dead_worker():
+    results = dict(run_async_io(['exit'], item_size, read_item, convert_item, write_item, failed_item, 1))
+    assert results['exit'].startswith('worker failed: ')
+
+
+def test_run_async_io_stop_early():
+    results = run_async_io([f'item{i}' for i in range(20)], item_size, read_item, convert_item, write_item,
+                           failed_item, 2, prefetch=2)
+    assert next(results)[1].startswith('wrote ITEM')
+    # the ones in flight are waited for, the rest are never started
+    results.close()
+
+
+async def make_budget(limit: int) -> ByteBudget:
+    # in the running loop, like the pipeline does
+    return ByteBudget(limit)
+
+
+def test_run_async_io_bounded(monkeypatch):
+    queues = []
+
+    class RecordingQueue(Queue):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.largest = 0
+            queues.append(self)
+
+        async def put(self, item):
+            await super().put(item)
+            self.largest = max(self.largest, self.qsize())
+
+    monkeypatch.setattr(aio, 'Queue', RecordingQueue)
+    results = run_async_io([f'item{i}' for i in range(20)], item_size, read_item, convert_item, write_item,
+                           failed_item, 2, prefetch=3)
+    assert len(list(results)) == 20
+    # the results wait for the caller in a bounded queue
+    done, = queues
+    assert done.maxsize == 3
+    assert 0 < done.largest <= 3
+
+
+def test_byte_budget():
+    loop = new_event_loop()
+    try:
+        budget = loop.run_until_complete(make_budget(10))
+        loop.run_until_complete(budget.acquire(100))
+        # full until released
+        with pytest.raises(AsyncTimeoutError):
+            loop.run_until_complete(wait_for(budget.acquire(1), 0.1))
+        loop.run_until_complete(budget.release(100))
+        loop.run_until_complete(wait_for(budget.acquire(4), 1))
+        loop.run_until_complete(wait_for(budget.acquire(6), 1))
+        assert budget.used == 10
+    finally:
+        loop.close()
+
+
+def test_convert_tree_async_io(cfg, sample_tree, tmp_path):
+    sync_root, async_root = str(tmp_path / 'sync'), str(tmp_path / 'async')
+    with open(join(sample_tree, 'truncated.pyc'), 'wb') as fp:
+        fp.write(b'broken')
+    reports = {}
+    for output_root, async_io in ((sync_root, False), (async_root, True)):
+        report_path = output_root + '.jsonl'
+        assert not convert_tree(sample_tree, output_root, cfg, do_39_to_38, 2, report_path=report_path,
+                                async_io=async_io, prefetch=2, max_in_flight=1)
+        with open(report_path) as fp:
+            reports[async_io] = {report['path']: (report['error'], report['rules']) for report in map(loads, fp)}
+
+    outputs = {'a.pyc', 'pkg/b.pyc', 'pkg/sub/c.pyc'}
+    assert list_files(sync_root) == list_files(async_root) == outputs | {JOURNAL_NAME}
+    for rel_path in outputs:
+        with open(join(sync_root, rel_path), 'rb') as sync_fp, open(join(async_root, rel_path), 'rb') as async_fp:
+            assert sync_fp.read() == async_fp.read()
+    assert reports[True] == reports[False]
+    assert reports[True]['truncated.pyc'][0] is not None
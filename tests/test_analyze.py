@@ -0,0 +1,64 @@
+from json import load
+from os import listdir
+
+from pyc39to38.analyze import (
+    analyze_file,
+    summarize
+)
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.cfg import Config
+
+from .common import (
+    SAMPLE_PYC,
+    run_cli
+)
+
+
+def test_analyze_sample(cfg):
+    report = analyze_file(SAMPLE_PYC, cfg, do_39_to_38)
+    assert report['ok'] and report['error'] is None
+    assert report['codes'] == 10
+    assert report['rules'] == {
+        'compare_ops': 3, 'reraise': 4, 'list_from_tuple': 2, 'begin_finally': 0, 'extended_arg': 16
+    }
+    assert report['largest'][0] == {'qualname': 'big', 'insts': 267}
+    assert sum(report['hist'].values()) == report['codes']
+
+
+def test_analyze_failed_code():
+    # a return in a try block isn't handled by the "finally" block patching yet
+    report = analyze_file(SAMPLE_PYC, Config(), do_39_to_38)
+    assert not report['ok'] and report['error'] is None
+    assert [code['qualname'] for code in report['failed_codes']] == ['reraise']
+
+
+def test_analyze_unreadable(cfg, tmp_path):
+    path = tmp_path / 'garbage.pyc'
+    path.write_bytes(b'garbage')
+    report = analyze_file(str(path), cfg, do_39_to_38)
+    assert not report['ok'] and report['error'] is not None
+
+
+def test_summarize(cfg, tmp_path):
+    path = tmp_path / 'garbage.pyc'
+    path.write_bytes(b'garbage')
+    reports = [analyze_file(SAMPLE_PYC, cfg, do_39_to_38), analyze_file(SAMPLE_PYC, cfg, do_39_to_38),
+               analyze_file(str(path), cfg, do_39_to_38)]
+    summary = summarize(reports, 1)
+    assert (summary['files'], summary['ok'], summary['unreadable']) == (3, 2, 1)
+    assert summary['codes'] == 20
+    assert summary['rules']['reraise'] == {'hits': 8, 'files': 2}
+    assert summary['rules']['begin_finally'] == {'hits': 0, 'files': 0}
+    assert summary['largest'] == [{'path': SAMPLE_PYC, 'qualname': 'big', 'insts': 267}]
+    assert len(summary['slowest']) == 1
+
+
+def test_analyze_cli_writes_no_bytecode(sample_tree, tmp_path):
+    summary_path = tmp_path / 'summary.json'
+    proc = run_cli('--analyze', '--no-begin-finally', '-j', '1', '--summary', str(summary_path), sample_tree)
+    assert proc.returncode == 0, proc.stderr.decode()
+    with open(summary_path) as fp:
+        summary = load(fp)
+    assert (summary['files'], summary['ok']) == (3, 3)
+    assert sorted(listdir(tmp_path)) == ['in', 'summary.json']
+    assert sorted(listdir(f'{sample_tree}/pkg')) == ['b.pyc', 'sub']
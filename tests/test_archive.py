@@ -0,0 +1,122 @@
+from csv import reader
+from io import (
+    BytesIO,
+    RawIOBase,
+    StringIO
+)
+from subprocess import (
+    run,
+    PIPE
+)
+from zipfile import (
+    ZipFile,
+    ZIP_DEFLATED,
+    ZIP_STORED
+)
+
+from pyc39to38.archive import (
+    convert_archive,
+    rename_member,
+    record_hash
+)
+from pyc39to38.asm import reasm_bytes
+from pyc39to38.rules import do_39_to_38
+
+from .common import (
+    SAMPLE_PYC,
+    SAMPLE_RESULT,
+    read_sample
+)
+
+SOURCE = b'print("not bytecode")\n'
+CACHED_PYC = 'pkg/__pycache__/mod.cpython-39.pyc'
+RECORD = 'pkg-1.0.dist-info/RECORD'
+
+
+class Unseekable(RawIOBase):
+    """
+    makes ZipFile write the sizes and the crc after the data
+    """
+
+    def __init__(self):
+        self.buffer = BytesIO()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        return self.buffer.write(b)
+
+
+def make_wheel(path: str):
+    sample = read_sample()
+    record = (f'pkg/mod.py,{record_hash(SOURCE)},{len(SOURCE)}\n'
+              f'{CACHED_PYC},{record_hash(sample)},{len(sample)}\n'
+              f'{RECORD},,\n')
+    with ZipFile(path, 'w') as zf:
+        zf.writestr('pkg/', b'')
+        zf.writestr('pkg/mod.py', SOURCE, ZIP_STORED)
+        zf.writestr(CACHED_PYC, sample, ZIP_DEFLATED)
+        zf.writestr('sample.pyc', sample, ZIP_DEFLATED)
+        zf.writestr(RECORD, record, ZIP_DEFLATED)
+
+
+def test_rename_member():
+    assert rename_member(CACHED_PYC) == 'pkg/__pycache__/mod.cpython-38.pyc'
+    assert rename_member('pkg/mod.pyc') == 'pkg/mod.pyc'
+
+
+def test_convert_wheel(cfg, tmp_path):
+    input_path, output_path = str(tmp_path / 'in.whl'), str(tmp_path / 'out.whl')
+    make_wheel(input_path)
+    assert convert_archive(input_path, output_path, cfg, do_39_to_38, 1)
+
+    expected = reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38)
+    with ZipFile(output_path) as zf:
+        assert zf.namelist() == ['pkg/', 'pkg/mod.py', 'pkg/__pycache__/mod.cpython-38.pyc', 'sample.pyc', RECORD]
+        assert zf.read('pkg/mod.py') == SOURCE
+        assert zf.getinfo('pkg/mod.py').compress_type == ZIP_STORED
+        assert zf.getinfo('sample.pyc').compress_type == ZIP_DEFLATED
+        assert zf.read('pkg/__pycache__/mod.cpython-38.pyc') == expected
+        assert zf.read('sample.pyc') == expected
+        record = list(reader(StringIO(zf.read(RECORD).decode())))
+    assert record == [
+        ['pkg/mod.py', record_hash(SOURCE), str(len(SOURCE))],
+        ['pkg/__pycache__/mod.cpython-38.pyc', record_hash(expected), str(len(expected))],
+        [RECORD, '', '']
+    ]
+
+
+def test_converted_wheel_imports(cfg, py38, tmp_path):
+    input_path, output_path = str(tmp_path / 'in.whl'), str(tmp_path / 'out.whl')
+    make_wheel(input_path)
+    assert convert_archive(input_path, output_path, cfg, do_39_to_38, 1)
+    proc = run([py38, '-c', 'import sys; sys.path.insert(0, sys.argv[1]); import sample; print(repr(sample.run()))',
+                output_path], stdout=PIPE, check=True)
+    assert proc.stdout.decode().strip() == SAMPLE_RESULT
+
+
+def test_failed_member_copied(cfg, tmp_path):
+    input_path, output_path = str(tmp_path / 'in.zip'), str(tmp_path / 'out.zip')
+    with ZipFile(input_path, 'w') as zf:
+        zf.writestr('truncated.pyc', read_sample()[:100], ZIP_DEFLATED)
+        zf.writestr('sample.pyc', read_sample(), ZIP_DEFLATED)
+    assert not convert_archive(input_path, output_path, cfg, do_39_to_38, 1)
+    with ZipFile(output_path) as zf:
+        assert zf.read('truncated.pyc') == read_sample()[:100]
+        assert zf.read('sample.pyc') == reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38)
+
+
+def test_data_descriptor_copied(cfg, tmp_path):
+    stream = Unseekable()
+    with ZipFile(stream, 'w') as zf:
+        zf.writestr('data.txt', SOURCE * 100, ZIP_DEFLATED)
+        zf.writestr('sample.pyc', read_sample(), ZIP_DEFLATED)
+    input_path, output_path = tmp_path / 'in.zip', tmp_path / 'out.zip'
+    input_path.write_bytes(stream.buffer.getvalue())
+    with ZipFile(input_path) as zf:
+        assert zf.getinfo('data.txt').flag_bits & 0x08
+    assert convert_archive(str(input_path), str(output_path), cfg, do_39_to_38, 1)
+    with ZipFile(output_path) as zf:
+        assert zf.testzip() is None
+        assert zf.read('data.txt') == SOURCE * 100
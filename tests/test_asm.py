@@ -0,0 +1,104 @@
+from io import BytesIO
+from os.path import join
+from struct import unpack
+
+import pytest
+
+from pyc39to38.asm import (
+    reasm_file,
+    reasm_bytes,
+    convert_pyc,
+    build_pyc,
+    write_pyc,
+    PYC_HEADER_FMT
+)
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.tree import convert_tree
+
+from .common import (
+    DATA_DIR,
+    SAMPLE_PYC,
+    read_sample,
+    load_input,
+    list_files,
+    run_cli
+)
+
+
+# compiled by Python 3.9 from nonlatin.py
+NONLATIN_PYC = join(DATA_DIR, 'nonlatin.pyc')
+
+
+def test_reasm_file(cfg, tmp_path, converted_sample):
+    output_path = str(tmp_path / 'out.pyc')
+    assert reasm_file(SAMPLE_PYC, output_path, cfg, do_39_to_38)
+    with open(output_path, 'rb') as fp:
+        data = fp.read()
+    # the timestamp of the input is kept, so the mapped input gives the same as the read one
+    assert data == converted_sample
+    _, _, timestamp, size = unpack(PYC_HEADER_FMT, data[:16])
+    assert (timestamp, size) == unpack(PYC_HEADER_FMT, read_sample()[:16])[2:]
+
+
+def test_reasm_file_empty(cfg, tmp_path):
+    input_path = tmp_path / 'empty.pyc'
+    input_path.write_bytes(b'')
+    assert not reasm_file(str(input_path), str(tmp_path / 'out.pyc'), cfg, do_39_to_38)
+    assert list_files(str(tmp_path)) == {'empty.pyc'}
+
+
+@pytest.mark.parametrize('size', [10, 200])
+def test_reasm_truncated(cfg, tmp_path, caplog, size):
+    # a valid header with a truncated body, or not even a whole header
+    input_path = str(tmp_path / 'truncated.pyc')
+    with open(input_path, 'wb') as fp:
+        fp.write(read_sample()[:size])
+    output_path = str(tmp_path / 'out.pyc')
+    assert not reasm_file(input_path, output_path, cfg, do_39_to_38)
+    assert 'failed to load the input bytecode' in caplog.text
+    assert list_files(str(tmp_path)) == {'truncated.pyc'}
+
+    # xdis prints what it failed on by itself, the error is logged after that instead of raised
+    proc = run_cli(input_path, output_path, '--no-begin-finally')
+    assert b'pyc39to38: ' in proc.stderr.splitlines()[-1]
+    assert list_files(str(tmp_path)) == {'truncated.pyc'}
+
+
+def test_write_pyc(cfg, converted_sample):
+    new_asm = convert_pyc(load_input(read_sample()), cfg, do_39_to_38)
+    with BytesIO() as fp:
+        assert write_pyc(fp, new_asm, unpack(PYC_HEADER_FMT, read_sample()[:16])[2])
+        assert fp.getvalue() == converted_sample
+
+
+def test_marshal_failure(cfg, tmp_path, caplog):
+    # the converted code objects are fine, xdis fails to marshal them
+    data = read_sample(NONLATIN_PYC)
+    new_asm = convert_pyc(load_input(data), cfg, do_39_to_38)
+    assert new_asm is not None
+    assert build_pyc(new_asm, None) is None
+    with BytesIO() as fp:
+        assert not write_pyc(fp, new_asm, None)
+        assert not fp.getvalue()
+
+    assert reasm_bytes(data, NONLATIN_PYC, cfg, do_39_to_38) is None
+    assert f'failed to marshal the converted code objects of {NONLATIN_PYC}' in caplog.text
+
+    # nothing is left behind
+    output_path = str(tmp_path / 'out.pyc')
+    assert not reasm_file(NONLATIN_PYC, output_path, cfg, do_39_to_38)
+    assert not list_files(str(tmp_path))
+
+    proc = run_cli(NONLATIN_PYC, output_path, '--no-begin-finally')
+    assert b'failed to marshal the converted code objects' in proc.stderr
+    assert b'conversion failed' in proc.stderr
+    assert not list_files(str(tmp_path))
+
+
+def test_marshal_failure_tree(cfg, sample_tree, tmp_path):
+    with open(NONLATIN_PYC, 'rb') as src, open(join(sample_tree, 'nonlatin.pyc'), 'wb') as dst:
+        dst.write(src.read())
+    output_root = str(tmp_path / 'out')
+    assert not convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1)
+    assert 'nonlatin.pyc' not in list_files(output_root)
+    assert 'a.pyc' in list_files(output_root)
@@ -0,0 +1,112 @@
+from os import _exit
+from time import (
+    monotonic,
+    sleep
+)
+
+from pyc39to38 import batch
+from pyc39to38.batch import (
+    run_isolated,
+    run_pool,
+    run_scheduled,
+    run_pool_ordered,
+    lpt_order,
+    make_chunks,
+    PoolStats
+)
+
+
+def behave(item: str) -> str:
+    """
+    run in the isolated workers, does what the item says
+    """
+    if item == 'hang':
+        sleep(60)
+    elif item == 'exit':
+        _exit(3)
+    elif item == 'raise':
+        raise ValueError('asked to')
+    elif item == 'memory':
+        data = bytearray(256 << 20)
+        sleep(60)
+        return str(len(data))
+    return item.upper()
+
+
+def test_run_isolated():
+    start = monotonic()
+    results = {item: (result, error) for item, result, error in
+               run_isolated(behave, ['a', 'hang', 'b', 'exit', 'raise', 'memory', 'c'], 2,
+                            timeout=2, max_rss=128 << 20)}
+    # the hanging one doesn't hold up the rest
+    assert monotonic() - start < 30
+    assert {item: results[item] for item in 'abc'} == {'a': ('A', None), 'b': ('B', None), 'c': ('C', None)}
+    assert results['hang'] == (None, 'killed after 2s')
+    assert results['exit'] == (None, 'worker died with exit code 3')
+    assert results['raise'][0] is None and 'ValueError: asked to' in results['raise'][1]
+    assert results['memory'][0] is None and results['memory'][1].startswith('killed at ')
+
+
+def test_run_isolated_no_limits():
+    assert sorted(result for _, result, _ in run_isolated(behave, ['x', 'y', 'z'], 2)) == ['X', 'Y', 'Z']
+
+
+def test_lpt_order():
+    items = [('a', 1), ('b', 5), ('c', 3), ('d', 5), ('e', 0)]
+    # the ones with the same cost stay in their order
+    assert lpt_order(items, lambda item: item[1]) == [('b', 5), ('d', 5), ('c', 3), ('a', 1), ('e', 0)]
+
+
+def test_make_chunks():
+    costs = [100, 60, 40, 30, 30, 20, 10, 5, 5]
+    chunks = make_chunks(costs, lambda cost: cost, 50)
+    assert chunks == [[100], [60], [40], [30], [30, 20], [10, 5, 5]]
+    # nothing lost, nothing repeated, in the order of the items
+    assert [cost for chunk in chunks for cost in chunk] == costs
+    assert make_chunks([], lambda cost: cost, 50) == []
+
+
+def test_pool_stats():
+    stats = PoolStats(4)
+    assert stats.utilization == 0.0
+    stats.busy, stats.wall = 6.0, 2.0
+    assert stats.utilization == 0.75
+
+
+def test_run_scheduled():
+    items = ['bb', 'a', 'dddd', 'ccc'] * 5
+    stats = PoolStats(2)
+    results = list(run_scheduled(behave, items, len, 2, 4, stats))
+    assert sorted(results) == sorted(item.upper() for item in items)
+    assert stats.busy > 0 and stats.wall > 0
+    # in this process, largest first
+    assert list(run_scheduled(behave, ['a', 'ccc', 'bb'], len, 1)) == ['CCC', 'BB', 'A']
+
+
+def test_run_pool_ordered():
+    items = [(i, None if i % 3 == 0 else str(i)) for i in range(20)]
+    assert list(run_pool_ordered(behave, items, 2, 3)) == [(i, None if i % 3 == 0 else str(i)) for i in range(20)]
+
+
+def test_run_pool_bounded(monkeypatch):
+    waited = []
+    wait_futures = batch.wait_futures
+
+    def record_wait(pending, **kwargs):
+        waited.append(len(pending))
+        return wait_futures(pending, **kwargs)
+
+    monkeypatch.setattr(batch, 'wait_futures', record_wait)
+    taken = []
+
+    def items():
+        for i in range(20):
+            taken.append(i)
+            yield str(i)
+
+    results = run_pool(behave, items(), 2, 3)
+    first = next(results)
+    # the items are taken only when there's room for them
+    assert len(taken) <= 3
+    assert sorted([first, *results], key=int) == [str(i) for i in range(20)]
+    assert waited and max(waited) <= 3
@@ -0,0 +1,161 @@
+from io import BytesIO
+from marshal import (
+    dumps,
+    loads
+)
+from struct import (
+    pack,
+    unpack
+)
+from zlib import (
+    compress,
+    decompress
+)
+
+import pytest
+
+from pyc39to38.asm import reasm_bytes
+from pyc39to38.carchive import (
+    CArchiveEntry,
+    convert_carchive,
+    convert_code,
+    find_cookie,
+    read_toc,
+    COOKIE_FMT,
+    COOKIE_MAGIC,
+    COOKIE_SIZE,
+    PYZ_HEADER_FMT,
+    PYZ_HEADER_SIZE,
+    PYZ_MAGIC,
+    PY38_MAGIC,
+    PY39_MAGIC
+)
+from pyc39to38.rules import do_39_to_38
+
+from .common import (
+    SAMPLE_PYC,
+    SAMPLE_RESULT,
+    read_sample,
+    run_sample_py38
+)
+
+BOOTLOADER = b'\x7fELF' + bytes(range(256)) * 4
+SIGNATURE = b'signature'
+DATA = b'some data file' * 10
+PYLIB = b'libpython3.9.so'
+
+
+def make_pyz(modules) -> bytes:
+    """
+    :param modules: name, typecode and content of the entries
+    """
+    body = BytesIO()
+    toc = []
+    for name, typecode, data in modules:
+        data = compress(data)
+        toc.append((name, (typecode, PYZ_HEADER_SIZE + body.tell(), len(data))))
+        body.write(data)
+    toc_offset = PYZ_HEADER_SIZE + body.tell()
+    return pack(PYZ_HEADER_FMT, PYZ_MAGIC, PY39_MAGIC, toc_offset) + body.getvalue() + dumps(toc)
+
+
+def make_exe(pyz: bytes) -> bytes:
+    code = read_sample()[16:]
+    # name, typecode, compressed, content
+    members = [
+        (b'main', b's', 1, code),
+        (b'data.txt', b'x', 0, DATA),
+        (b'PYZ-00.pyz', b'z', 0, pyz)
+    ]
+    archive = BytesIO()
+    entries = []
+    for name, typecode, compressed, data in members:
+        stored = compress(data) if compressed else data
+        entries.append(CArchiveEntry(archive.tell(), len(stored), len(data), compressed, typecode, name))
+        archive.write(stored)
+    toc_offset = archive.tell()
+    for entry in entries:
+        archive.write(entry.pack())
+    toc_len = archive.tell() - toc_offset
+    cookie = pack(COOKIE_FMT, COOKIE_MAGIC, archive.tell() + COOKIE_SIZE, toc_offset, toc_len, 309, PYLIB)
+    return BOOTLOADER + archive.getvalue() + cookie + SIGNATURE
+
+
+def read_exe(data: bytes):
+    """
+    :return: the entries of the CArchive with their contents, the python version and what's after the cookie
+    """
+    fp = BytesIO(data)
+    cookie_offset = find_cookie(fp)
+    _, archive_len, toc_offset, toc_len, pyvers, pylib = unpack(COOKIE_FMT, data[cookie_offset:][:COOKIE_SIZE])
+    start = cookie_offset + COOKIE_SIZE - archive_len
+    assert data[:start] == BOOTLOADER
+    members = {}
+    for entry in read_toc(fp, start + toc_offset, toc_len):
+        stored = data[start + entry.offset:][:entry.compressed_size]
+        members[entry.name] = (entry.typecode, decompress(stored) if entry.compressed else stored)
+        assert len(members[entry.name][1]) == entry.size
+    return members, pyvers, pylib.rstrip(b'\0'), data[cookie_offset + COOKIE_SIZE:]
+
+
+def read_pyz(data: bytes):
+    magic, pymagic, toc_offset = unpack(PYZ_HEADER_FMT, data[:PYZ_HEADER_SIZE])
+    assert (magic, pymagic) == (PYZ_MAGIC, PY38_MAGIC)
+    return {name: (typecode, decompress(data[pos:pos + length]))
+            for name, (typecode, pos, length) in loads(data[toc_offset:])}
+
+
+@pytest.fixture
+def converted_code(cfg) -> bytes:
+    return reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38)[16:]
+
+
+def test_convert_carchive(cfg, tmp_path, converted_code):
+    pyz = make_pyz([('sample', 0, read_sample()[16:]), ('pkg', 1, read_sample()), ('res', 2, DATA)])
+    input_path, output_path = tmp_path / 'app', tmp_path / 'app38'
+    input_path.write_bytes(make_exe(pyz))
+    assert convert_carchive(str(input_path), str(output_path), cfg, do_39_to_38, 1)
+
+    members, pyvers, pylib, trailer = read_exe(output_path.read_bytes())
+    assert (pyvers, pylib, trailer) == (308, PYLIB, SIGNATURE)
+    assert members[b'main'] == (b's', converted_code)
+    assert members[b'data.txt'] == (b'x', DATA)
+    typecode, new_pyz = members[b'PYZ-00.pyz']
+    assert typecode == b'z'
+    modules = read_pyz(new_pyz)
+    assert modules['sample'] == (0, converted_code)
+    # the header is kept if it's there
+    assert modules['pkg'][1][:4] == PY38_MAGIC and modules['pkg'][1][16:] == converted_code
+    assert modules['res'] == (2, DATA)
+
+
+def test_converted_script_runs(cfg, py38, tmp_path):
+    input_path, output_path = tmp_path / 'app', tmp_path / 'app38'
+    input_path.write_bytes(make_exe(make_pyz([])))
+    assert convert_carchive(str(input_path), str(output_path), cfg, do_39_to_38, 1)
+    members, _, _, _ = read_exe(output_path.read_bytes())
+    # run_sample_py38 skips a header
+    assert run_sample_py38(py38, bytes(16) + members[b'main'][1]) == SAMPLE_RESULT
+
+
+def test_failed_module_copied(cfg, tmp_path, converted_code):
+    broken = read_sample()[16:100]
+    pyz = make_pyz([('broken', 0, broken), ('sample', 0, read_sample()[16:])])
+    input_path, output_path = tmp_path / 'app', tmp_path / 'app38'
+    input_path.write_bytes(make_exe(pyz))
+    assert not convert_carchive(str(input_path), str(output_path), cfg, do_39_to_38, 1)
+    members, _, _, _ = read_exe(output_path.read_bytes())
+    modules = read_pyz(members[b'PYZ-00.pyz'][1])
+    assert modules['broken'] == (0, broken)
+    assert modules['sample'] == (0, converted_code)
+
+
+def test_not_pyinstaller(cfg, tmp_path):
+    input_path = tmp_path / 'app'
+    input_path.write_bytes(BOOTLOADER)
+    assert not convert_carchive(str(input_path), str(tmp_path / 'app38'), cfg, do_39_to_38, 1)
+    assert not (tmp_path / 'app38').exists()
+
+
+def test_convert_code_bare(cfg, converted_code):
+    assert convert_code('sample', read_sample()[16:], cfg, do_39_to_38) == converted_code
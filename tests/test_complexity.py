@@ -0,0 +1,136 @@
+from sys import gettrace
+
+import pytest
+
+from pyc39to38.asm import reasm_bytes
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.cfg import Config
+from tools import complexity
+from tools.complexity import (
+    check_shape,
+    count_phases,
+    count_steps,
+    fit_exponent,
+    PHASES,
+    KNOWN_ISSUES,
+    DEFAULT_MAX_EXPONENT,
+    MIN_STEPS
+)
+from tools.synthetic import (
+    gen_pyc,
+    SHAPES,
+    NESTED_CODES
+)
+
+from .common import (
+    PY39_ONLY_OPS,
+    load_input,
+    output_opnames,
+    run_cli
+)
+
+
+ALL_SHAPES = list(SHAPES) + [NESTED_CODES]
+# small enough for the known quadratic phases to take a few seconds in total
+SIZES = (250, 500, 1000)
+BOUNDS = dict.fromkeys(PHASES, DEFAULT_MAX_EXPONENT)
+
+
+def loop(n: int):
+    for i in range(n):
+        abs(i)
+
+
+def test_fit_exponent():
+    assert fit_exponent((size, size ** 2) for size in (100, 1000, 10000)) == pytest.approx(2)
+    assert fit_exponent((size, size * 10) for size in (1000, 10000)) == pytest.approx(1)
+    # too few steps to be fitted
+    assert fit_exponent([(10, MIN_STEPS / 2), (100, 10 * MIN_STEPS)]) is None
+    assert fit_exponent([(100, MIN_STEPS), (100, 2 * MIN_STEPS)]) is None
+    assert fit_exponent([]) is None
+
+
+def test_count_steps():
+    previous = gettrace()
+    _, steps = count_steps(lambda: loop(1000))
+    assert count_steps(lambda: loop(1000)) == (None, steps)
+    assert fit_exponent([(1000, steps), (10000, count_steps(lambda: loop(10000))[1])]) == pytest.approx(1, abs=0.01)
+    assert gettrace() is previous
+
+
+@pytest.mark.parametrize('shape', ALL_SHAPES)
+def test_gen_pyc(shape):
+    data, count = gen_pyc(shape, 300)
+    assert count >= 300
+    pyc = load_input(data)
+    assert sum(len(code.instructions) for code in pyc.codes) >= count
+    output = reasm_bytes(data, '<synthetic>', Config(), do_39_to_38)
+    assert output is not None
+    assert not output_opnames(output) & PY39_ONLY_OPS
+    assert set(count_phases(data, Config(), do_39_to_38)) == set(PHASES)
+
+
+@pytest.mark.parametrize('shape', ALL_SHAPES)
+def test_check_shape(shape):
+    counts, exponents = check_shape(shape, SIZES, Config(), do_39_to_38, BOUNDS)
+    assert [c['size'] for c in counts] == list(SIZES)
+    assert [result['phase'] for result in exponents] == list(PHASES)
+    # only the known ones grow faster than linear
+    for result in exponents:
+        assert result['ok'] or (result['known_issue'] and result['phase'] in KNOWN_ISSUES), result
+
+
+def test_check_shape_deterministic():
+    first, _ = check_shape('except', SIZES, Config(), do_39_to_38, BOUNDS)
+    second, _ = check_shape('except', SIZES, Config(), do_39_to_38, BOUNDS)
+    assert [{phase: c[phase] for phase in PHASES} for c in first] == \
+           [{phase: c[phase] for phase in PHASES} for c in second]
+
+
+def test_nested_codes_linear():
+    # the code objects are small, so every phase is linear in how many there are
+    _, exponents = check_shape(NESTED_CODES, (1000, 4000, 16000), Config(), do_39_to_38, BOUNDS)
+    assert all(result['ok'] and not result['known_issue'] for result in exponents), exponents
+
+
+def test_known_issue(monkeypatch):
+    # a known issue above its bound doesn't pass, it's reported as such
+    _, exponents = check_shape('jumps', SIZES, Config(), do_39_to_38, BOUNDS)
+    emit = next(result for result in exponents if result['phase'] == 'emit')
+    assert not emit['ok'] and emit['known_issue']
+    assert emit['exponent'] > DEFAULT_MAX_EXPONENT
+
+    # it fails like any other phase if it's not known
+    _, exponents = check_shape('jumps', SIZES, Config(), do_39_to_38, BOUNDS, known_issues=())
+    emit = next(result for result in exponents if result['phase'] == 'emit')
+    assert not emit['ok'] and not emit['known_issue']
+
+    # or if it's worse than known
+    monkeypatch.setattr(complexity, 'KNOWN_ISSUE_MAX_EXPONENT', 1.5)
+    _, exponents = check_shape('jumps', SIZES, Config(), do_39_to_38, BOUNDS)
+    emit = next(result for result in exponents if result['phase'] == 'emit')
+    assert not emit['ok'] and not emit['known_issue']
+
+
+def test_check_shape_over_budget():
+    counts, exponents = check_shape('jumps', SIZES, Config(), do_39_to_38, BOUNDS, budget=0)
+    assert len(counts) == 1
+    assert all(not result['ok'] and not result['known_issue']
+               and result['error'] == 'only 1 of the sizes fit in the budget' for result in exponents)
+
+
+def test_cli(tmp_path):
+    report = tmp_path / 'report.jsonl'
+    proc = run_cli('--sizes', '250', '500', '1000', '--shape', 'jumps', '--report', str(report),
+                   module='tools.complexity')
+    assert proc.returncode == 0, proc.stderr.decode(errors='replace')
+    assert b'known issue' in proc.stderr
+    assert len(report.read_text().splitlines()) == 3 + len(PHASES)
+
+    proc = run_cli('--sizes', '250', '500', '--shape', 'jumps', '--bound', 'emit=1.5', module='tools.complexity')
+    assert proc.returncode != 0
+    assert b'is above the bound' in proc.stderr
+
+    proc = run_cli('--bound', 'walk=2', module='tools.complexity')
+    assert proc.returncode != 0
+    assert b"unknown phase 'walk'" in proc.stderr
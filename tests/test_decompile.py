@@ -0,0 +1,99 @@
+import pytest
+
+from pyc39to38 import decompile as decompile_module
+from pyc39to38.decompile import (
+    decompile_file,
+    decompile_files,
+    decompile_tree,
+    source_name
+)
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.cfg import Config
+from pyc39to38 import PY38_VER
+
+from .common import (
+    NOT_CODE_PYC,
+    SAMPLE_PYC,
+    read_sample
+)
+
+
+def fake_decompile(co, version, out, **kwargs):
+    out.write(f'# {co.co_name} for {version}\n')
+
+
+@pytest.fixture
+def fake_decompiler(monkeypatch):
+    # the decompilers are optional, and the output of a real one isn't what's tested here
+    monkeypatch.setattr(decompile_module, 'load_decompiler', lambda name=None: ('fake', fake_decompile))
+
+
+def test_source_name():
+    assert source_name('pkg/__pycache__/mod.cpython-39.pyc') == 'pkg/__pycache__/mod.py'
+    assert source_name('mod.pyc') == 'mod.py'
+
+
+def test_decompile_file(cfg, tmp_path, fake_decompiler):
+    output_path = tmp_path / 'sample.py'
+    report = decompile_file((SAMPLE_PYC, str(output_path)), cfg, do_39_to_38)
+    assert report['ok'] and report['error'] is None
+    assert output_path.read_text() == f'# <module> for {PY38_VER}\n'
+    assert all(seconds >= 0 for seconds in report['timings'].values())
+
+
+@pytest.mark.parametrize('data, error', [
+    (NOT_CODE_PYC, 'failed to load: TypeError: '),
+    (read_sample()[:100], 'failed to load'),
+])
+def test_broken_input(cfg, tmp_path, fake_decompiler, data, error):
+    input_path, output_path = tmp_path / 'broken.pyc', tmp_path / 'broken.py'
+    input_path.write_bytes(data)
+    report = decompile_file((str(input_path), str(output_path)), cfg, do_39_to_38)
+    assert not report['ok'] and report['error'].startswith(error)
+    assert not output_path.exists()
+
+
+def test_conversion_failed(tmp_path, fake_decompiler):
+    # a return in a try block isn't handled by the "finally" block patching yet
+    report = decompile_file((SAMPLE_PYC, str(tmp_path / 'sample.py')), Config(), do_39_to_38)
+    assert report['error'] == 'conversion failed'
+
+
+def test_conversion_raises(cfg, tmp_path, fake_decompiler, monkeypatch):
+    def broken_convert_pyc(*args):
+        raise IndexError('asked to')
+
+    monkeypatch.setattr(decompile_module, 'convert_pyc', broken_convert_pyc)
+    report = decompile_file((SAMPLE_PYC, str(tmp_path / 'sample.py')), cfg, do_39_to_38)
+    assert report['error'] == 'conversion failed: IndexError: asked to'
+
+
+def test_decompiler_failed(cfg, tmp_path, monkeypatch):
+    output_path = tmp_path / 'sample.py'
+
+    def exploding(co, version, out, **kwargs):
+        out.write('# partial\n')
+        raise RuntimeError('asked to')
+
+    monkeypatch.setattr(decompile_module, 'load_decompiler', lambda name=None: ('fake', exploding))
+    report = decompile_file((SAMPLE_PYC, str(output_path)), cfg, do_39_to_38)
+    assert report['error'] == 'fake failed: RuntimeError: asked to'
+    # still written, the decompilers mark where they stopped
+    assert output_path.read_text() == '# partial\n'
+
+
+def test_no_decompiler(cfg, tmp_path, monkeypatch):
+    monkeypatch.setattr(decompile_module, 'load_decompiler', lambda name=None: None)
+    report = decompile_file((SAMPLE_PYC, str(tmp_path / 'sample.py')), cfg, do_39_to_38)
+    assert report['error'] == 'no decompiler installed'
+
+
+def test_decompile_tree(cfg, sample_tree, tmp_path, fake_decompiler):
+    with open(f'{sample_tree}/pkg/not_code.pyc', 'wb') as fp:
+        fp.write(NOT_CODE_PYC)
+    output_root = tmp_path / 'src'
+    reports = list(decompile_files(decompile_tree(sample_tree, str(output_root)), cfg, do_39_to_38, jobs=1))
+    assert sorted(report['ok'] for report in reports) == [False, True, True, True]
+    assert sorted(str(path.relative_to(output_root)) for path in output_root.rglob('*.py')) == [
+        'a.py', 'pkg/b.py', 'pkg/sub/c.py'
+    ]
@@ -0,0 +1,61 @@
+from json import load
+from os import stat
+from os.path import join
+
+from pyc39to38 import tree
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.tree import (
+    convert_tree,
+    dedup_todo,
+    MANIFEST_NAME,
+    JOURNAL_NAME
+)
+
+from .common import (
+    NOT_CODE_PYC,
+    list_files
+)
+
+
+def test_dedup_todo(tmp_path):
+    for name, data in (('a', b'1'), ('b', b'2'), ('c', b'1'), ('d', b'1')):
+        (tmp_path / name).write_bytes(data)
+    todo = [(str(tmp_path / name), f'out/{name}', False) for name in 'abcde']
+    unique, duplicates = dedup_todo(todo)
+    # the missing one is left to the worker
+    assert unique == [todo[0], todo[1], todo[4]]
+    assert duplicates == {todo[0][0]: ('out/a', [todo[2], todo[3]])}
+
+
+def test_dedup_converts_once(cfg, sample_tree, tmp_path, monkeypatch, converted_sample):
+    converted = []
+    reasm_bytes = tree.reasm_bytes
+
+    def counting_reasm_bytes(data, name, *args):
+        converted.append(name)
+        return reasm_bytes(data, name, *args)
+
+    # run in this process with a single job
+    monkeypatch.setattr(tree, 'reasm_bytes', counting_reasm_bytes)
+    with open(join(sample_tree, 'not_code.pyc'), 'wb') as fp:
+        fp.write(NOT_CODE_PYC)
+    with open(join(sample_tree, 'pkg/not_code.pyc'), 'wb') as fp:
+        fp.write(NOT_CODE_PYC)
+    output_root = str(tmp_path / 'out')
+
+    assert not convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1, incremental=True, dedup=True)
+    assert len(converted) == 2
+    assert list_files(output_root) == {'a.pyc', 'pkg/b.pyc', 'pkg/sub/c.pyc', JOURNAL_NAME, MANIFEST_NAME}
+    # hardlinks of the same output
+    inodes = {stat(join(output_root, rel_path)).st_ino for rel_path in ('a.pyc', 'pkg/b.pyc', 'pkg/sub/c.pyc')}
+    assert len(inodes) == 1
+    with open(join(output_root, 'pkg/sub/c.pyc'), 'rb') as fp:
+        assert fp.read() == converted_sample
+
+    with open(join(output_root, MANIFEST_NAME)) as fp:
+        files = load(fp)['files']
+    assert set(files) == {'a.pyc', 'pkg/b.pyc', 'pkg/sub/c.pyc', 'not_code.pyc', 'pkg/not_code.pyc'}
+    assert files['pkg/b.pyc']['ok'] and files['pkg/b.pyc']['hash'] == files['a.pyc']['hash']
+    # failed the same way without being converted again
+    assert not files['pkg/not_code.pyc']['ok']
+    assert files['pkg/not_code.pyc']['error'] == files['not_code.pyc']['error']
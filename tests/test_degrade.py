@@ -0,0 +1,64 @@
+from json import loads
+
+from pyc39to38.asm import reasm_bytes
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.tree import convert_tree
+from pyc39to38.walk import degraded_configs
+from pyc39to38.cfg import Config
+
+from .common import (
+    SAMPLE_PYC,
+    SAMPLE_RESULT,
+    PY39_ONLY_OPS,
+    read_sample,
+    load_output,
+    output_opnames,
+    run_sample_py38
+)
+
+
+def test_degraded_configs():
+    assert [reason for _, reason in degraded_configs(Config())] == [
+        'without begin_finally', 'without begin_finally, list_from_tuple'
+    ]
+    cfg = Config()
+    cfg.no_begin_finally = True
+    configs = degraded_configs(cfg)
+    assert [reason for _, reason in configs] == ['without list_from_tuple']
+    assert configs[0][0].no_begin_finally and not cfg.no_list_from_tuple
+
+
+def test_without_degrade_fails():
+    # a return in a try block isn't handled by the "finally" block patching yet
+    assert reasm_bytes(read_sample(), SAMPLE_PYC, Config(), do_39_to_38) is None
+
+
+def test_degrade(converted_sample):
+    cfg = Config()
+    cfg.degrade = True
+    degraded = []
+    data = reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38, None, degraded)
+    assert degraded == ['reraise: without begin_finally']
+    assert not output_opnames(data) & PY39_ONLY_OPS
+    # only the failed one is converted like with --no-begin-finally
+    codes = {code.co_name: code.co_code for code in load_output(data).codes}
+    fallback_codes = {code.co_name: code.co_code for code in load_output(converted_sample).codes}
+    assert codes['reraise'] == fallback_codes['reraise']
+    assert codes['with_finally'] != fallback_codes['with_finally']
+
+
+def test_degraded_runs(py38):
+    cfg = Config()
+    cfg.degrade = True
+    assert run_sample_py38(py38, reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38)) == SAMPLE_RESULT
+
+
+def test_degraded_in_report(sample_tree, tmp_path):
+    cfg = Config()
+    cfg.degrade = True
+    cfg.low_memory = True
+    report_path = tmp_path / 'report.jsonl'
+    assert convert_tree(sample_tree, str(tmp_path / 'out'), cfg, do_39_to_38, 1, report_path=str(report_path))
+    reports = list(map(loads, report_path.read_text().splitlines()))
+    assert len(reports) == 3
+    assert all(report['degraded'] == ['reraise: without begin_finally'] for report in reports)
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+from xdis.disasm import get_opcode
+
+from pyc39to38.asm import reasm_bytes
+from pyc39to38.emit import emit_code
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.utils import genlinestarts
+from pyc39to38 import PY39_VER
+
+from .common import (
+    SAMPLE_PYC,
+    SAMPLE_RESULT,
+    PY39_ONLY_OPS,
+    read_sample,
+    run_sample_py38,
+    load_input,
+    output_opnames
+)
+
+
+def decode_lnotab(firstlineno, lnotab):
+    """
+    the same as dis.findlinestarts of 3.8
+    """
+    lines = {}
+    last_line, line, offset = None, firstlineno, 0
+    for offset_inc, line_inc in zip(lnotab[::2], lnotab[1::2]):
+        if offset_inc:
+            if line != last_line:
+                lines[offset] = last_line = line
+            offset += offset_inc
+        line += line_inc - 256 if line_inc >= 128 else line_inc
+    if line != last_line:
+        lines[offset] = line
+    return lines
+
+
+def test_emit_round_trip():
+    # unchanged instructions are emitted as they were
+    pyc = load_input(read_sample())
+    opc = get_opcode(PY39_VER, False)
+    for code, label, backpatch_inst in pyc.iter_codes():
+        co_code = code.co_code
+        # the jumps target labels in the patcher, the id of a label is its offset in the input
+        for inst in backpatch_inst:
+            inst.arg = inst.arg + inst.offset + 2 if inst.opcode in opc.JREL_OPS else inst.arg
+        assert emit_code(opc, code, label, backpatch_inst).co_code == co_code
+
+
+def test_genlinestarts_big_increments():
+    lines = {0: 1, 2: 300, 600: 10, 602: 11}
+    code = SimpleNamespace(co_firstlineno=1, co_lnotab=dict(lines))
+    assert decode_lnotab(1, genlinestarts(code)) == {0: 1, 2: 300, 600: 10, 602: 11}
+
+
+def test_convert_sample(cfg):
+    data = reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38)
+    assert data is not None
+    opnames = output_opnames(data)
+    assert not opnames & PY39_ONLY_OPS
+    # big() has jumps over 255
+    assert 'EXTENDED_ARG' in opnames
+
+
+def test_convert_sample_runs(cfg, py38):
+    data = reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38)
+    assert run_sample_py38(py38, data) == SAMPLE_RESULT
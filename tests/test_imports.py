@@ -0,0 +1,62 @@
+from os import environ
+from subprocess import run
+from sys import executable
+from typing import Set
+
+import pytest
+
+from xdis.magics import magics
+
+from .common import (
+    ROOT_DIR,
+    run_cli
+)
+
+HEAVY_PACKAGES = ('xdis', 'xasm')
+
+
+def imported(stderr: bytes) -> Set[str]:
+    """
+    :return: names of the modules imported, from the output of -X importtime
+    """
+    return {
+        line.rsplit('|', 1)[1].strip()
+        for line in stderr.decode().splitlines() if line.startswith('import time:') and '|' in line
+    }
+
+
+def assert_light(stderr: bytes):
+    modules = imported(stderr)
+    assert 'pyc39to38' in modules
+    assert not {module for module in modules if module.split('.')[0] in HEAVY_PACKAGES}
+
+
+@pytest.mark.parametrize('args', [('--version',), ('--help',), ('merge-reports', '--help'), ('export', '--help')])
+def test_no_heavy_imports(args):
+    proc = run_cli(*args, python_args=('-X', 'importtime'))
+    assert proc.returncode == 0
+    assert_light(proc.stderr)
+
+
+@pytest.mark.parametrize('header', [magics['3.8'] + bytes(12), b'not a bytecode file!'])
+def test_header_rejected_without_heavy_imports(tmp_path, header):
+    input_path = tmp_path / 'in.pyc'
+    input_path.write_bytes(header + bytes(100))
+    proc = run_cli(str(input_path), str(tmp_path / 'out.pyc'), python_args=('-X', 'importtime'))
+    assert proc.returncode != 0
+    assert b'CRITICAL' in proc.stderr
+    assert_light(proc.stderr)
+    assert not (tmp_path / 'out.pyc').exists()
+
+
+def test_heavy_imports_seen(tmp_path):
+    # make sure the check above can fail
+    proc = run_cli('--no-begin-finally', '-', '-', stdin=magics['3.9'] + bytes(100), python_args=('-X', 'importtime'))
+    assert 'xdis' in imported(proc.stderr)
+
+
+def test_no_logging_setup_on_import():
+    # configured by the command handlers once the arguments are parsed
+    proc = run([executable, '-c', 'import logging, pyc39to38.__main__; assert not logging.getLogger().handlers'],
+               env=dict(environ, PYTHONPATH=ROOT_DIR))
+    assert proc.returncode == 0
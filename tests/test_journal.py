@@ -0,0 +1,89 @@
+from json import loads
+from os import (
+    stat,
+    unlink
+)
+from os.path import join
+
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.tree import (
+    convert_tree,
+    load_journal,
+    drop_partial_line,
+    JOURNAL_NAME
+)
+
+from .common import list_files
+
+
+def crash_after_first(output_root: str) -> str:
+    """
+    make the output directory look like the run was killed right after finishing one file
+
+    :return: relative input path of the finished one
+    """
+    journal_path = join(output_root, JOURNAL_NAME)
+    with open(journal_path) as fp:
+        lines = fp.readlines()
+    with open(journal_path, 'w') as fp:
+        # the next record is cut off
+        fp.write(lines[0] + lines[1][:20])
+    done = loads(lines[0])['input']
+    for line in lines[1:]:
+        unlink(join(output_root, loads(line)['output']))
+    return done
+
+
+def test_journal(cfg, sample_tree, tmp_path):
+    output_root = str(tmp_path / 'out')
+    assert convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1)
+    journal = load_journal(join(output_root, JOURNAL_NAME))
+    assert set(journal) == {'a.pyc', 'pkg/b.pyc', 'pkg/sub/c.pyc'}
+    assert all(entry['ok'] and entry['output'] == rel_input for rel_input, entry in journal.items())
+
+
+def test_broken_record_ignored(cfg, sample_tree, tmp_path):
+    output_root = str(tmp_path / 'out')
+    assert convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1)
+    done = crash_after_first(output_root)
+    assert list(load_journal(join(output_root, JOURNAL_NAME))) == [done]
+
+
+def test_resume(cfg, sample_tree, tmp_path):
+    output_root, report_path = str(tmp_path / 'out'), str(tmp_path / 'report.jsonl')
+    assert convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1, report_path=report_path)
+    done = crash_after_first(output_root)
+    with open(report_path) as fp:
+        first_report = fp.readline()
+    with open(report_path, 'w') as fp:
+        fp.write(first_report + first_report[:10])
+    inode = stat(join(output_root, done)).st_ino
+
+    assert convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1, resume=True, report_path=report_path)
+    assert list_files(output_root) == {'a.pyc', 'pkg/b.pyc', 'pkg/sub/c.pyc', JOURNAL_NAME}
+    # not converted again
+    assert stat(join(output_root, done)).st_ino == inode
+    assert set(load_journal(join(output_root, JOURNAL_NAME))) == {'a.pyc', 'pkg/b.pyc', 'pkg/sub/c.pyc'}
+    with open(report_path) as fp:
+        assert sorted(loads(line)['path'] for line in fp) == ['a.pyc', 'pkg/b.pyc', 'pkg/sub/c.pyc']
+
+
+def test_without_resume_starts_over(cfg, sample_tree, tmp_path):
+    output_root = str(tmp_path / 'out')
+    assert convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1)
+    crash_after_first(output_root)
+    assert not convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1)
+    assert set(load_journal(join(output_root, JOURNAL_NAME))) == {'a.pyc', 'pkg/b.pyc', 'pkg/sub/c.pyc'}
+
+
+def test_drop_partial_line(tmp_path):
+    path = tmp_path / 'journal'
+    path.write_bytes(b'{"a": 1}\n{"b"')
+    drop_partial_line(str(path))
+    assert path.read_bytes() == b'{"a": 1}\n'
+    drop_partial_line(str(path))
+    assert path.read_bytes() == b'{"a": 1}\n'
+    path.write_bytes(b'{"a"')
+    drop_partial_line(str(path))
+    assert path.read_bytes() == b''
+    drop_partial_line(str(tmp_path / 'missing'))
@@ -0,0 +1,56 @@
+from xdis.bytecode import get_instructions_bytes
+from xdis.disasm import get_opcode
+
+from pyc39to38.load import (
+    load_pyc,
+    MODULE_QUALNAME
+)
+from pyc39to38 import (
+    PY38_VER,
+    PY39_VER
+)
+
+from .common import (
+    SAMPLE_PYC,
+    read_sample,
+    load_input
+)
+
+
+def test_qualnames_children_first():
+    pyc = load_input(read_sample())
+    assert pyc.qualnames[-1] == MODULE_QUALNAME
+    assert pyc.qualnames.index('Counter.bump') < pyc.qualnames.index('Counter')
+    assert pyc.codes[-1].co_name == '<module>'
+
+
+def test_decode_matches_xdis():
+    pyc = load_input(read_sample())
+    opc = get_opcode(PY39_VER, False)
+    for code in pyc.codes:
+        expected = [(inst.offset, inst.opname, inst.arg)
+                    for inst in get_instructions_bytes(code.co_code, opc)]
+        assert [(inst.offset, inst.opname, inst.arg) for inst in code.instructions] == expected
+
+
+def test_labels_on_jump_targets():
+    pyc = load_input(read_sample())
+    opc = get_opcode(PY39_VER, False)
+    for code, label, backpatch_inst in zip(pyc.codes, pyc.label, pyc.backpatch):
+        offsets = {inst.offset for inst in code.instructions}
+        assert all(inst.opcode in opc.JREL_OPS or inst.opcode in opc.JABS_OPS for inst in backpatch_inst)
+        # the id of a label is its offset
+        assert all(label_id == offset and offset in offsets for label_id, offset in label.items())
+
+
+def test_lazy_decodes_on_iteration():
+    pyc = load_pyc(SAMPLE_PYC, PY39_VER, True)
+    assert not pyc.label
+    eager = load_input(read_sample())
+    for (code, label, _), eager_code in zip(pyc.iter_codes(), eager.codes):
+        assert [inst.opname for inst in code.instructions] == [inst.opname for inst in eager_code.instructions]
+        assert label is not None
+
+
+def test_wrong_version():
+    assert load_pyc(SAMPLE_PYC, PY38_VER) is None
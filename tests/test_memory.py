@@ -0,0 +1,44 @@
+from subprocess import run
+from sys import executable
+
+import pytest
+
+from pyc39to38.asm import reasm_bytes
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.utils import get_peak_memory
+
+from .common import (
+    SAMPLE_PYC,
+    SAMPLE_RESULT,
+    read_sample,
+    run_sample_py38,
+    load_output
+)
+
+CODE_FIELDS = ('co_name', 'co_code', 'co_names', 'co_varnames', 'co_lnotab', 'co_stacksize', 'co_flags')
+
+
+def test_low_memory_same_code(cfg):
+    # the bytes differ, marshal shares the objects it has already seen
+    data = reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38)
+    cfg.low_memory = True
+    low_memory_data = reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38)
+    codes = load_output(data).codes
+    low_memory_codes = load_output(low_memory_data).codes
+    assert len(codes) == len(low_memory_codes)
+    for code, low_memory_code in zip(codes, low_memory_codes):
+        for field in CODE_FIELDS:
+            assert getattr(code, field) == getattr(low_memory_code, field), (code.co_name, field)
+
+
+def test_low_memory_runs(cfg, py38):
+    cfg.low_memory = True
+    data = reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38)
+    assert run_sample_py38(py38, data) == SAMPLE_RESULT
+
+
+def test_peak_memory_of_children():
+    if get_peak_memory() is None:
+        pytest.skip('no getrusage on this platform')
+    run([executable, '-c', 'x = bytearray(64 << 20)'], check=True)
+    assert get_peak_memory(True) >= 64 << 20
@@ -0,0 +1,69 @@
+from subprocess import (
+    run,
+    PIPE
+)
+
+from pyc39to38.asm import reasm_bytes
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.cfg import Config
+
+from .common import (
+    SAMPLE_PYC,
+    read_sample,
+    load_input,
+    load_output
+)
+
+RUN_SELECTED = '''
+import marshal, sys
+namespace = {}
+exec(marshal.loads(sys.stdin.buffer.read()[16:]), namespace)
+counter = namespace['Counter']()
+# __init__ is a stub
+counter.count = 4
+print(repr([namespace['big'](40), namespace['reraise']('7'), counter.bump()]))
+'''
+
+# the code of a stub, LOAD_CONST None, RETURN_VALUE
+STUB_CODE = bytes((100, 0, 83, 0))
+
+
+def selected(*patterns: str):
+    pyc = load_input(read_sample())
+    return {pyc.qualnames[idx] for idx in pyc.select(patterns)}
+
+
+def test_select():
+    assert selected('big') == {'<module>', 'big'}
+    # with the ones defined in them and the ones they are defined in
+    assert selected('Counter') == {'<module>', 'Counter', 'Counter.__init__', 'Counter.bump'}
+    assert selected('Counter.b*', 'lists') == {'<module>', 'Counter', 'Counter.bump', 'lists'}
+    assert selected('nothing') == set()
+
+
+def test_only(converted_sample):
+    # the "finally" block patching fails on reraise, but that one is not converted now
+    cfg = Config()
+    cfg.only = ['big', 'Counter.bump']
+    data = reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38)
+    codes = {code.co_name: code for code in load_output(data).codes}
+    fully_converted = {code.co_name: code for code in load_output(converted_sample).codes}
+    assert codes['big'].co_code == fully_converted['big'].co_code
+    assert codes['bump'].co_code == fully_converted['bump'].co_code
+    for name in ('reraise', 'with_finally', 'run', '__init__'):
+        assert codes[name].co_code == STUB_CODE
+        assert codes[name].co_varnames == fully_converted[name].co_varnames
+
+
+def test_only_runs(py38):
+    cfg = Config()
+    cfg.only = ['big', 'Counter.bump']
+    data = reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38)
+    proc = run([py38, '-c', RUN_SELECTED], input=data, stdout=PIPE, check=True)
+    assert proc.stdout.decode().strip() == '[465, None, 5]'
+
+
+def test_only_nothing_matches(cfg):
+    cfg.only = ['nothing']
+    data = reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38)
+    assert all(code.co_code == STUB_CODE for code in load_output(data).codes)
@@ -0,0 +1,163 @@
+from collections import Counter
+from json import loads
+from os import makedirs
+from os.path import join
+from shutil import copyfile
+
+from xdis.disasm import get_opcode
+
+from pyc39to38.asm import reasm_bytes
+from pyc39to38.optimize import (
+    thread_jumps,
+    drop_jumps_to_next,
+    optimize_jumps,
+    pop_opt_stats,
+    OPT_THREADED,
+    OPT_DROPPED,
+    OPT_SAVED_BYTES
+)
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.tree import convert_tree
+from pyc39to38.walk import assemble_code
+from pyc39to38.cfg import Config
+from pyc39to38 import PY38_VER
+from tools.synthetic import SyntheticCode
+
+from .common import (
+    JUMPS_PYC,
+    JUMPS_RESULT,
+    SAMPLE_PYC,
+    SAMPLE_RESULT,
+    read_sample,
+    load_input,
+    run_sample_py38,
+    synthetic_pyc,
+    synthetic_patcher
+)
+
+
+def chain_code(hop_line: bool = False) -> SyntheticCode:
+    """
+    if a: b
+    (the jump over b goes to a jump to the end)
+
+    :param hop_line: the jump in between starts a line
+    """
+    code = SyntheticCode('<module>')
+    hop, end = code.label('h'), code.label('e')
+    code.op('LOAD_FAST', 0)
+    code.op('POP_JUMP_IF_FALSE', hop)
+    code.op('LOAD_FAST', 1)
+    code.op('POP_TOP')
+    code.place(hop)
+    if hop_line:
+        code.next_line()
+    code.op('JUMP_ABSOLUTE', end)
+    code.op('LOAD_FAST', 1)
+    code.op('POP_TOP')
+    code.place(end)
+    code.next_line()
+    code.op('LOAD_FAST', 0)
+    code.op('POP_TOP')
+    return code
+
+
+def next_jump_code(jump: bool = True, next_line: bool = False) -> SyntheticCode:
+    """
+    if a: b
+    (the jump over b goes to a line starting with a jump to the next instruction)
+
+    :param jump: with the jump to the next instruction
+    :param next_line: the next instruction starts a line too
+    """
+    code = SyntheticCode('<module>')
+    hop, end = code.label('h'), code.label('e')
+    code.op('LOAD_FAST', 0)
+    code.op('POP_JUMP_IF_FALSE', hop)
+    code.op('LOAD_FAST', 1)
+    code.op('POP_TOP')
+    code.place(hop)
+    code.next_line()
+    if jump:
+        code.op('JUMP_FORWARD', end)
+    code.place(end)
+    if next_line:
+        code.next_line()
+    code.op('LOAD_FAST', 0)
+    code.op('POP_TOP')
+    return code
+
+
+def assemble(pyc, patcher, shift_on_add_extarg):
+    co = assemble_code(pyc.opc, get_opcode(PY38_VER, False), patcher, shift_on_add_extarg, {}, 0, Config())
+    assert co is not None
+    return co
+
+
+def test_thread_jumps():
+    _, patcher, _ = synthetic_patcher(chain_code())
+    cond, hop = (inst for inst in patcher.code.instructions if inst.opname.startswith(('POP_JUMP', 'JUMP_ABS')))
+    assert thread_jumps(patcher) == 1
+    assert cond.arg == hop.arg
+    # nothing left to thread
+    assert thread_jumps(patcher) == 0
+
+
+def test_thread_jumps_keeps_lines():
+    # the line event of the jump in between would be skipped
+    _, patcher, _ = synthetic_patcher(chain_code(hop_line=True))
+    assert thread_jumps(patcher) == 0
+
+
+def test_drop_jumps_to_next():
+    pyc, patcher, shift_on_add_extarg = synthetic_patcher(next_jump_code())
+    assert drop_jumps_to_next(patcher) == 1
+    assert 'JUMP_FORWARD' not in {inst.opname for inst in patcher.code.instructions}
+    # the jump to the removed one goes to the next instruction, which gets its line number
+    co = assemble(pyc, patcher, shift_on_add_extarg)
+    expected = load_input(synthetic_pyc(next_jump_code(jump=False))).codes[0]
+    assert co.co_code == expected.co_code
+    assert co.co_lnotab == expected.co_lnotab
+
+
+def test_drop_jumps_keeps_lines():
+    _, patcher, _ = synthetic_patcher(next_jump_code(next_line=True))
+    assert drop_jumps_to_next(patcher) == 0
+
+
+def test_optimize_jumps_stats():
+    _, patcher, _ = synthetic_patcher(next_jump_code())
+    optimize_jumps(patcher)
+    assert pop_opt_stats(patcher.stats) == {OPT_THREADED: 0, OPT_DROPPED: 1, OPT_SAVED_BYTES: 2}
+    assert not patcher.stats
+
+
+def test_optimize_jumps_py38(cfg, py38):
+    data = read_sample(JUMPS_PYC)
+    plain = reasm_bytes(data, JUMPS_PYC, cfg, do_39_to_38)
+    cfg.optimize = True
+    stats = Counter()
+    optimized = reasm_bytes(data, JUMPS_PYC, cfg, do_39_to_38, stats)
+    assert optimized is not None and optimized != plain
+    assert stats[OPT_THREADED] > 0
+    assert len(optimized) <= len(plain)
+    assert run_sample_py38(py38, optimized) == run_sample_py38(py38, plain) == JUMPS_RESULT
+
+    # there's nothing to optimize in the sample
+    stats = Counter()
+    sample = reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38, stats)
+    assert pop_opt_stats(stats) == {OPT_THREADED: 0, OPT_DROPPED: 0, OPT_SAVED_BYTES: 0}
+    assert run_sample_py38(py38, sample) == SAMPLE_RESULT
+
+
+def test_tree_report(cfg, tmp_path):
+    input_root = str(tmp_path / 'in')
+    makedirs(input_root)
+    copyfile(JUMPS_PYC, join(input_root, 'jumps.pyc'))
+    cfg.optimize = True
+    report_path = str(tmp_path / 'report.jsonl')
+    assert convert_tree(input_root, str(tmp_path / 'out'), cfg, do_39_to_38, 1, report_path=report_path)
+    with open(report_path) as fp:
+        report, = map(loads, fp)
+    assert report['optimized'][OPT_THREADED] > 0
+    assert OPT_THREADED not in report['rules']
@@ -0,0 +1,109 @@
+import pytest
+from xdis.disasm import get_opcode
+
+from pyc39to38.walk import (
+    prepare_patcher,
+    assemble_code
+)
+from pyc39to38.utils import build_inst
+from pyc39to38.cfg import Config
+from pyc39to38 import PY38_VER
+from tools.synthetic import SyntheticCode
+
+from .common import (
+    read_sample,
+    load_input,
+    synthetic_pyc,
+    synthetic_patcher
+)
+
+
+def jump_code(nop: bool = False) -> SyntheticCode:
+    """
+    jumps forward and backward, one of them to an instruction with EXTENDED_ARG
+
+    :param nop: start with a NOP
+    """
+    code = SyntheticCode('<module>')
+    for i in range(300):
+        code.const(i)
+    start, target, end = code.label('s'), code.label('t'), code.label('e')
+    if nop:
+        code.op('NOP')
+    code.place(start)
+    code.op('LOAD_FAST', 0)
+    code.op('POP_JUMP_IF_FALSE', target)
+    code.op('LOAD_FAST', 1)
+    code.op('JUMP_FORWARD', end)
+    code.place(target)
+    code.op('LOAD_CONST', 300)
+    code.op('POP_JUMP_IF_TRUE', start)
+    code.place(end)
+    code.op('LOAD_FAST', 1)
+    code.op('POP_TOP')
+    return code
+
+
+def test_label_ids():
+    # the id of a label is the offset of its target in the input, it's kept when the code moves
+    pyc = load_input(read_sample())
+    for code, label, backpatch_inst in pyc.iter_codes():
+        offsets = {inst.offset for inst in code.instructions}
+        patcher, _ = prepare_patcher(pyc.opc, code, label, backpatch_inst, Config())
+        assert all(type(label_id) is int for label_id in patcher.label)
+        assert set(patcher.label) <= offsets
+        assert all(inst.arg in patcher.label for inst in patcher.backpatch_inst)
+
+
+def test_extended_arg_target():
+    # the EXTENDED_ARG a jump targets is removed, its label goes to the instruction after it
+    pyc, patcher, _ = synthetic_patcher(jump_code())
+    load_const = next(inst for inst in patcher.code.instructions if inst.opname == 'LOAD_CONST')
+    assert 'EXTENDED_ARG' not in {inst.opname for inst in patcher.code.instructions}
+    assert load_const.offset in patcher.label.values()
+    assert len(patcher.code.instructions) == len(pyc.codes[0].instructions) - 1
+
+
+def test_insert_pop_shift_labels():
+    _, patcher, _ = synthetic_patcher(jump_code())
+    labels = dict(patcher.label)
+    lnotab = dict(patcher.code.co_lnotab)
+    nop = build_inst(patcher.opc, 'NOP', None)
+    patcher.insert_inst(nop, 2, 0, shift_line_no=True)
+    # the ids stay, the offsets move with the instructions
+    assert patcher.label == {label_id: offset + 2 for label_id, offset in labels.items()}
+    assert [inst.offset for inst in patcher.code.instructions] == list(range(0, 2 * len(patcher.code.instructions), 2))
+
+    assert patcher.pop_inst(0) == (nop, False, None, None)
+    assert patcher.label == labels
+    assert patcher.code.co_lnotab == lnotab
+    assert patcher.code.instructions[0].offset == 0
+
+
+def test_insert_pop_label():
+    _, patcher, _ = synthetic_patcher(jump_code())
+    nop = build_inst(patcher.opc, 'NOP', None)
+    patcher.insert_inst(nop, 2, 2, 1000)
+    assert patcher.label[1000] == nop.offset == 4
+    with pytest.raises(ValueError):
+        patcher.insert_inst(build_inst(patcher.opc, 'NOP', None), 2, 2, 1000)
+
+    assert patcher.pop_inst(2)[2] == 1000
+    assert 1000 not in patcher.label
+    # the jump to the start targets the label of offset 0
+    jump = next(inst for inst in patcher.backpatch_inst if inst.opname == 'POP_JUMP_IF_TRUE')
+    label_id = jump.arg
+    index = patcher.code.instructions.index(jump)
+    assert patcher.pop_inst(0)[2] == label_id
+    assert patcher.code.instructions[index - 1] is jump
+
+
+@pytest.mark.parametrize('nop', [False, True])
+def test_emit_labels(nop):
+    # the jumps are resolved to where their targets moved to, and the EXTENDED_ARG is added back
+    pyc, patcher, shift_on_add_extarg = synthetic_patcher(jump_code())
+    if nop:
+        patcher.insert_inst(build_inst(patcher.opc, 'NOP', None), 2, 0)
+    co = assemble_code(pyc.opc, get_opcode(PY38_VER, False), patcher, shift_on_add_extarg, {}, 0, Config())
+    assert co is not None
+    assert co.co_code == load_input(synthetic_pyc(jump_code(nop))).codes[0].co_code
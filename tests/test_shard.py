@@ -0,0 +1,88 @@
+from json import load
+from os.path import join
+
+import pytest
+
+from pyc39to38.batch import in_shard
+from pyc39to38.report import (
+    load_reports,
+    merge_reports
+)
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.tree import (
+    convert_tree,
+    state_path,
+    MANIFEST_NAME,
+    JOURNAL_NAME
+)
+
+from .common import (
+    NOT_CODE_PYC,
+    list_files,
+    run_cli
+)
+
+PATHS = [f'pkg{i % 7}/mod{i}.pyc' for i in range(1000)]
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 5])
+def test_in_shard_partitions(count):
+    shards = [{path for path in PATHS if in_shard(path, (index, count))} for index in range(count)]
+    # every path is in exactly one shard
+    assert sum(map(len, shards)) == len(PATHS)
+    assert set().union(*shards) == set(PATHS)
+    # and they are about the same size
+    assert min(map(len, shards)) > len(PATHS) / count * 0.8
+
+
+def test_in_shard_stable():
+    # every node has to get the same answer, whatever the process or the platform
+    assert [index for index in range(3) if in_shard('pkg/b.pyc', (index, 3))] == [0]
+    assert [index for index in range(3) if in_shard('a.pyc', (index, 3))] == [2]
+
+
+def test_sharded_tree(cfg, sample_tree, tmp_path):
+    with open(join(sample_tree, 'pkg/not_code.pyc'), 'wb') as fp:
+        fp.write(NOT_CODE_PYC)
+    output_root = str(tmp_path / 'out')
+    report_paths = [str(tmp_path / f'report{index}.jsonl') for index in range(2)]
+    for index in range(2):
+        convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1, incremental=True,
+                     shard=(index, 2), report_path=report_paths[index])
+    # each shard has its own manifest and journal
+    state = {state_path('', name, (index, 2)) for name in (MANIFEST_NAME, JOURNAL_NAME) for index in range(2)}
+    assert list_files(output_root) == {'a.pyc', 'pkg/b.pyc', 'pkg/sub/c.pyc'} | state
+
+    summary = merge_reports(load_reports(report_paths), 10)
+    assert (summary['files'], summary['ok'], summary['failed']) == (4, 3, 1)
+    assert summary['shards'] == ['0/2', '1/2']
+    assert summary['rules']['reraise'] == {'hits': 12, 'files': 3}
+    assert [failure['path'] for failure in summary['failures']] == ['pkg/not_code.pyc']
+
+
+def test_merge_reports_last_wins(tmp_path):
+    path = tmp_path / 'report.jsonl'
+    path.write_text('{"path": "a.pyc", "ok": false, "error": "killed", "shard": "0/2"}\n'
+                    '{"path": "b.pyc", "ok": true, "seconds": 2.0, "rules": {"reraise": 1}, "shard": "0/2"}\n'
+                    '\n'
+                    '{"path": "a.pyc", "ok": true, "seconds": 1.0, "optimized": {"saved_bytes": 4}, "shard": "0/2"}\n'
+                    '{"path": "c.pyc", "ok": tr')
+    summary = merge_reports(load_reports([str(path)]), 1)
+    assert (summary['files'], summary['ok'], summary['failed']) == (2, 2, 0)
+    assert summary['seconds'] == 3.0
+    assert summary['saved_bytes'] == 4
+    assert summary['slowest'] == [{'path': 'b.pyc', 'seconds': 2.0}]
+
+
+def test_merge_reports_cli(tmp_path):
+    report_path, summary_path = tmp_path / 'report.jsonl', tmp_path / 'summary.json'
+    report_path.write_text('{"path": "a.pyc", "ok": true, "shard": "1/3"}\n')
+    proc = run_cli('merge-reports', str(report_path), '--summary', str(summary_path))
+    assert proc.returncode == 0, proc.stderr.decode()
+    with open(summary_path) as fp:
+        assert load(fp)['shards'] == ['1/3']
+    assert run_cli('merge-reports', str(tmp_path / 'missing.jsonl')).returncode != 0
+
+
+def test_shard_arg():
+    assert run_cli('--shard', '2/2', 'in', 'out').returncode == 2
@@ -0,0 +1,144 @@
+from json import loads
+from os import makedirs
+from os.path import join
+from shutil import copyfile
+from sqlite3 import connect
+
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.store import (
+    PycStore,
+    export_store
+)
+from pyc39to38.tree import convert_tree_to_store
+
+from .common import (
+    SAMPLE_PYC,
+    list_files,
+    run_cli
+)
+
+OUTPUTS = {'a.pyc', 'pkg/b.pyc', 'pkg/sub/c.pyc', 'pkg/__pycache__/d.cpython-38.pyc'}
+
+
+def make_store(cfg, sample_tree, tmp_path) -> str:
+    cache_dir = join(sample_tree, 'pkg/__pycache__')
+    makedirs(cache_dir)
+    copyfile(SAMPLE_PYC, join(cache_dir, 'd.cpython-39.pyc'))
+    with open(join(sample_tree, 'broken.pyc'), 'wb') as fp:
+        fp.write(b'broken')
+    store_path = str(tmp_path / 'out.db')
+    assert not convert_tree_to_store(sample_tree, store_path, cfg, do_39_to_38, 1)
+    return store_path
+
+
+def read_rows(store_path: str) -> dict:
+    with connect(store_path) as conn:
+        return {path: (output, ok, loads(entry), data)
+                for path, output, ok, entry, data in conn.execute('SELECT path, output, ok, entry, data FROM files')}
+
+
+def test_store_round_trip(cfg, sample_tree, tmp_path, converted_sample):
+    store_path = make_store(cfg, sample_tree, tmp_path)
+    rows = read_rows(store_path)
+    assert rows['pkg/__pycache__/d.cpython-39.pyc'][0] == 'pkg/__pycache__/d.cpython-38.pyc'
+    output, ok, entry, data = rows['broken.pyc']
+    assert not ok and data is None and entry['error']
+    assert all(ok and data == converted_sample for path, (_, ok, _, data) in rows.items() if path != 'broken.pyc')
+
+    output_root = str(tmp_path / 'export')
+    assert export_store(store_path, output_root) == (len(OUTPUTS), 0)
+    assert list_files(output_root) == OUTPUTS
+    for rel_path in OUTPUTS:
+        with open(join(output_root, rel_path), 'rb') as fp:
+            assert fp.read() == converted_sample
+
+    # the existing files are kept unless forced
+    assert export_store(store_path, output_root, ['a.pyc']) == (0, 1)
+    assert export_store(store_path, output_root, ['a.pyc'], force=True) == (1, 0)
+
+
+def test_store_replaces(cfg, sample_tree, tmp_path):
+    store_path = make_store(cfg, sample_tree, tmp_path)
+    with open(join(sample_tree, 'broken.pyc'), 'wb') as fp, open(SAMPLE_PYC, 'rb') as src:
+        fp.write(src.read())
+    assert convert_tree_to_store(sample_tree, store_path, cfg, do_39_to_38, 1)
+    rows = read_rows(store_path)
+    assert len(rows) == len(OUTPUTS) + 1
+    assert rows['broken.pyc'][1]
+
+
+def test_export_select(cfg, sample_tree, tmp_path):
+    store_path = make_store(cfg, sample_tree, tmp_path)
+    # the patterns match the input or the output paths
+    for patterns, expected in (
+            (['pkg/*'], OUTPUTS - {'a.pyc'}),
+            (['a.pyc', '*/sub/*'], {'a.pyc', 'pkg/sub/c.pyc'}),
+            (['*.cpython-39.pyc'], {'pkg/__pycache__/d.cpython-38.pyc'}),
+            (['broken.pyc', 'nothing'], set())):
+        output_root = str(tmp_path / 'export')
+        assert export_store(store_path, output_root, patterns, force=True)[1] == 0
+        assert list_files(output_root) == expected, patterns
+        if expected:
+            for rel_path in expected:
+                (tmp_path / 'export' / rel_path).unlink()
+
+
+def test_store_batches(tmp_path):
+    store_path = str(tmp_path / 'batches.db')
+    entry = {'ok': True, 'hash': 'h', 'size': 1}
+    with PycStore(store_path, batch_size=2, batch_bytes=100) as store:
+        store.add('a.pyc', 'a.pyc', entry, b'a')
+        assert not read_rows(store_path)
+        store.add('b.pyc', 'b.pyc', entry, b'b')
+        assert set(read_rows(store_path)) == {'a.pyc', 'b.pyc'}
+        # a big one is written at once
+        store.add('c.pyc', 'c.pyc', entry, bytes(100))
+        assert set(read_rows(store_path)) == {'a.pyc', 'b.pyc', 'c.pyc'}
+        store.add('d.pyc', 'd.pyc', entry, b'd')
+    # the rest is written when closed
+    assert set(read_rows(store_path)) == {'a.pyc', 'b.pyc', 'c.pyc', 'd.pyc'}
+    with PycStore(store_path, True) as store:
+        assert list(store.iter_files(['c*'])) == [('c.pyc', 'c.pyc', bytes(100))]
+
+
+def test_export_special_path(cfg, sample_tree, tmp_path):
+    # the characters of a URI in the path of the store
+    special_dir = tmp_path / 'a?b#c%20d'
+    special_dir.mkdir()
+    store_path = make_store(cfg, sample_tree, special_dir)
+    output_root = str(tmp_path / 'export')
+    assert export_store(store_path, output_root) == (len(OUTPUTS), 0)
+    assert list_files(output_root) == OUTPUTS
+
+
+def test_export_not_a_store(tmp_path):
+    not_store = tmp_path / 'not.db'
+    not_store.write_bytes(b'not a database')
+    assert export_store(str(not_store), str(tmp_path / 'out'))[1] == 1
+    # a database, but not a store
+    other_db = str(tmp_path / 'other.db')
+    with connect(other_db) as conn:
+        conn.execute('CREATE TABLE other (a)')
+    assert export_store(other_db, str(tmp_path / 'out')) == (0, 1)
+    assert not (tmp_path / 'out').exists()
+
+
+def test_cli(sample_tree, tmp_path, converted_sample):
+    store_path, output_root = str(tmp_path / 'out.db'), str(tmp_path / 'export')
+    proc = run_cli(sample_tree, '--store', store_path, '--no-begin-finally', '-j', '1')
+    assert proc.returncode == 0, proc.stderr.decode(errors='replace')
+    assert b'3 files converted into' in proc.stderr
+
+    proc = run_cli('export', store_path, output_root, '--select', 'pkg/*')
+    assert proc.returncode == 0, proc.stderr.decode(errors='replace')
+    assert list_files(output_root) == {'pkg/b.pyc', 'pkg/sub/c.pyc'}
+    with open(join(output_root, 'pkg/b.pyc'), 'rb') as fp:
+        assert fp.read() == converted_sample
+
+    proc = run_cli('export', store_path, output_root)
+    assert proc.returncode != 0
+    assert b'2 files failed to export' in proc.stderr
+    assert list_files(output_root) == {'a.pyc', 'pkg/b.pyc', 'pkg/sub/c.pyc'}
+
+    proc = run_cli('export', str(tmp_path / 'missing.db'), output_root)
+    assert proc.returncode != 0
@@ -0,0 +1,91 @@
+from io import (
+    BytesIO,
+    RawIOBase
+)
+
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.stream import (
+    convert_stream,
+    read_frames,
+    write_frame
+)
+
+from .common import (
+    NOT_CODE_PYC,
+    SAMPLE_PYC,
+    read_sample,
+    run_cli
+)
+
+FRAMES = [('a.pyc', b'first'), ('\udcff.pyc', b''), ('pkg/b.pyc', b'x' * 70000)]
+
+
+class Trickle(RawIOBase):
+    """
+    a pipe giving one byte at a time
+    """
+
+    def __init__(self, data: bytes):
+        self.data = BytesIO(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        return self.data.read(min(size, 1))
+
+
+def framed(frames) -> bytes:
+    fp = BytesIO()
+    for name, data in frames:
+        write_frame(fp, name, data)
+    return fp.getvalue()
+
+
+def test_frames_round_trip():
+    assert list(read_frames(BytesIO(framed(FRAMES)))) == FRAMES
+    assert list(read_frames(Trickle(framed(FRAMES)))) == FRAMES
+    assert list(read_frames(BytesIO())) == []
+
+
+def test_convert_stream(cfg, converted_sample):
+    frames = [('a.pyc', read_sample()), ('bad.pyc', NOT_CODE_PYC), ('b.pyc', read_sample())]
+    output_fp = BytesIO()
+    assert not convert_stream(BytesIO(framed(frames)), output_fp, cfg, do_39_to_38, 1)
+    # in the same order, the failed one is empty
+    assert list(read_frames(BytesIO(output_fp.getvalue()))) == [
+        ('a.pyc', converted_sample), ('bad.pyc', b''), ('b.pyc', converted_sample)
+    ]
+
+
+def test_convert_stream_workers(cfg, converted_sample):
+    frames = [(f'{i}.pyc', read_sample()) for i in range(6)]
+    output_fp = BytesIO()
+    assert convert_stream(BytesIO(framed(frames)), output_fp, cfg, do_39_to_38, 2)
+    assert list(read_frames(BytesIO(output_fp.getvalue()))) == [(name, converted_sample) for name, _ in frames]
+
+
+def test_convert_stream_truncated(cfg, converted_sample):
+    output_fp = BytesIO()
+    assert not convert_stream(BytesIO(framed([('a.pyc', read_sample())] * 2)[:-10]), output_fp, cfg, do_39_to_38, 1)
+    assert list(read_frames(BytesIO(output_fp.getvalue()))) == [('a.pyc', converted_sample)]
+
+
+def test_pipe_cli(converted_sample):
+    proc = run_cli('--no-begin-finally', '-', '-', stdin=read_sample())
+    assert proc.returncode == 0, proc.stderr.decode()
+    assert proc.stdout == converted_sample
+    proc = run_cli('--no-begin-finally', SAMPLE_PYC, '-')
+    assert proc.stdout == converted_sample
+
+
+def test_pipe_cli_malformed():
+    proc = run_cli('-', '-', stdin=NOT_CODE_PYC)
+    assert proc.stdout == b''
+    assert b'TypeError' in proc.stderr and b'conversion failed' in proc.stderr
+
+
+def test_stream_cli(converted_sample):
+    proc = run_cli('--no-begin-finally', '--stream', '-j', '1', '-', stdin=framed([('a.pyc', read_sample())]))
+    assert proc.returncode == 0, proc.stderr.decode()
+    assert list(read_frames(BytesIO(proc.stdout))) == [('a.pyc', converted_sample)]
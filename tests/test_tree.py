@@ -0,0 +1,112 @@
+from json import (
+    load,
+    loads
+)
+from os import (
+    stat,
+    unlink,
+    utime
+)
+from os.path import join
+
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.tree import (
+    convert_tree,
+    MANIFEST_NAME,
+    JOURNAL_NAME
+)
+
+from .common import (
+    NOT_CODE_PYC,
+    read_sample,
+    list_files
+)
+
+OUTPUTS = {'a.pyc', 'pkg/b.pyc', 'pkg/sub/c.pyc'}
+
+
+def test_convert_tree(cfg, sample_tree, tmp_path, converted_sample):
+    output_root = str(tmp_path / 'out')
+    assert convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1)
+    assert list_files(output_root) == OUTPUTS | {JOURNAL_NAME}
+    for rel_path in OUTPUTS:
+        with open(join(output_root, rel_path), 'rb') as fp:
+            assert fp.read() == converted_sample
+
+
+def test_broken_files_dont_stop_the_run(cfg, sample_tree, tmp_path, converted_sample):
+    with open(join(sample_tree, 'pkg/truncated.pyc'), 'wb') as fp:
+        fp.write(read_sample()[:100])
+    with open(join(sample_tree, 'not_code.pyc'), 'wb') as fp:
+        fp.write(NOT_CODE_PYC)
+    output_root, report_path = str(tmp_path / 'out'), str(tmp_path / 'report.jsonl')
+    assert not convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1, incremental=True, report_path=report_path)
+    assert list_files(output_root) == OUTPUTS | {JOURNAL_NAME, MANIFEST_NAME}
+    with open(join(output_root, 'pkg/b.pyc'), 'rb') as fp:
+        assert fp.read() == converted_sample
+
+    with open(report_path) as fp:
+        reports = {report['path']: report for report in map(loads, fp)}
+    assert set(reports) == OUTPUTS | {'pkg/truncated.pyc', 'not_code.pyc'}
+    assert reports['not_code.pyc']['error'].startswith('TypeError: ')
+    assert reports['pkg/truncated.pyc']['error'] == 'conversion failed'
+    with open(join(output_root, MANIFEST_NAME)) as fp:
+        manifest = load(fp)['files']
+    assert not manifest['not_code.pyc']['ok'] and manifest['a.pyc']['ok']
+
+
+def test_existing_output_kept(cfg, sample_tree, tmp_path):
+    output_root = tmp_path / 'out'
+    output_root.mkdir()
+    (output_root / 'a.pyc').write_bytes(b'old')
+    assert not convert_tree(sample_tree, str(output_root), cfg, do_39_to_38, 1)
+    assert (output_root / 'a.pyc').read_bytes() == b'old'
+    assert convert_tree(sample_tree, str(output_root), cfg, do_39_to_38, 1, force=True)
+    assert (output_root / 'a.pyc').read_bytes() != b'old'
+
+
+def test_incremental(cfg, sample_tree, tmp_path):
+    output_root = str(tmp_path / 'out')
+    assert convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1, incremental=True)
+    # the output files are replaced when written, so a new inode means converted again
+    inodes = {rel_path: stat(join(output_root, rel_path)).st_ino for rel_path in OUTPUTS}
+
+    assert convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1, incremental=True)
+    assert {rel_path: stat(join(output_root, rel_path)).st_ino for rel_path in OUTPUTS} == inodes
+
+    # touched but not changed, gone, and changed
+    st = stat(join(sample_tree, 'a.pyc'))
+    utime(join(sample_tree, 'a.pyc'), ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    unlink(join(sample_tree, 'pkg/b.pyc'))
+    with open(join(sample_tree, 'pkg/sub/c.pyc'), 'ab') as fp:
+        fp.write(b'\0')
+    convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1, incremental=True)
+    assert list_files(output_root) == {'a.pyc', 'pkg/sub/c.pyc', JOURNAL_NAME, MANIFEST_NAME}
+    assert stat(join(output_root, 'a.pyc')).st_ino == inodes['a.pyc']
+    assert stat(join(output_root, 'pkg/sub/c.pyc')).st_ino != inodes['pkg/sub/c.pyc']
+    with open(join(output_root, MANIFEST_NAME)) as fp:
+        assert set(load(fp)['files']) == {'a.pyc', 'pkg/sub/c.pyc'}
+
+    # converted again with other options
+    cfg.optimize = True
+    assert convert_tree(sample_tree, output_root, cfg, do_39_to_38, 1, incremental=True)
+    assert stat(join(output_root, 'a.pyc')).st_ino != inodes['a.pyc']
+
+
+def test_convert_tree_isolated(cfg, sample_tree, tmp_path, converted_sample):
+    output_root = str(tmp_path / 'out')
+    with open(join(sample_tree, 'not_code.pyc'), 'wb') as fp:
+        fp.write(NOT_CODE_PYC)
+    assert not convert_tree(sample_tree, output_root, cfg, do_39_to_38, 2, timeout=60, max_rss=1 << 30)
+    assert list_files(output_root) == OUTPUTS | {JOURNAL_NAME}
+    for rel_path in OUTPUTS:
+        with open(join(output_root, rel_path), 'rb') as fp:
+            assert fp.read() == converted_sample
+
+
+def test_convert_tree_chunks(cfg, sample_tree, tmp_path, converted_sample):
+    output_root = str(tmp_path / 'out')
+    assert convert_tree(sample_tree, output_root, cfg, do_39_to_38, 2, chunk_size=1 << 20)
+    for rel_path in OUTPUTS:
+        with open(join(output_root, rel_path), 'rb') as fp:
+            assert fp.read() == converted_sample
@@ -0,0 +1,109 @@
+from subprocess import run
+from types import SimpleNamespace
+from typing import (
+    List,
+    Tuple
+)
+
+from xdis.disasm import get_opcode
+
+from pyc39to38.asm import reasm_bytes
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.verify import (
+    verify_code,
+    verify_codes
+)
+from pyc39to38 import PY38_VER
+
+from .common import (
+    DATA_DIR,
+    SAMPLE_PYC,
+    read_sample,
+    load_output
+)
+
+opc38 = get_opcode(PY38_VER, False)
+
+
+def make_code(insts: List[Tuple[str, int]], stacksize: int) -> SimpleNamespace:
+    """
+    a stand-in for a code object, the verifier only looks at these
+    """
+    co_code = bytes(byte for opname, arg in insts for byte in (opc38.opmap[opname], arg))
+    return SimpleNamespace(co_name='f', co_code=co_code, co_stacksize=stacksize, co_consts=())
+
+
+def test_converted_sample(cfg):
+    data = reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38)
+    assert verify_codes(opc38, load_output(data).codes[0]) == []
+
+
+def test_compiled_by_py38(py38, tmp_path):
+    # the verifier must agree with the compiler of 3.8
+    path = tmp_path / 'sample.pyc'
+    run([py38, '-c', f'import py_compile; py_compile.compile({DATA_DIR + "/sample.py"!r}, {str(path)!r})'],
+        check=True)
+    assert verify_codes(opc38, load_output(path.read_bytes()).codes[0]) == []
+
+
+def test_verify_option_passes(cfg):
+    cfg.verify = True
+    assert reasm_bytes(read_sample(), SAMPLE_PYC, cfg, do_39_to_38) is not None
+
+
+def test_ok():
+    code = make_code([('LOAD_CONST', 0), ('POP_JUMP_IF_FALSE', 8), ('LOAD_CONST', 0), ('RETURN_VALUE', 0),
+                      ('LOAD_CONST', 1), ('RETURN_VALUE', 0)], 1)
+    assert verify_code(opc38, code) == []
+
+
+def test_jump_out_of_code():
+    code = make_code([('LOAD_CONST', 0), ('POP_JUMP_IF_FALSE', 40), ('LOAD_CONST', 0), ('RETURN_VALUE', 0)], 1)
+    assert verify_code(opc38, code) == ['POP_JUMP_IF_FALSE at 2 jumps to 40, which is not an instruction']
+
+
+def test_jump_after_extended_arg():
+    code = make_code([('JUMP_ABSOLUTE', 4), ('EXTENDED_ARG', 0), ('LOAD_CONST', 0), ('RETURN_VALUE', 0)], 1)
+    assert verify_code(opc38, code) == [
+        'JUMP_ABSOLUTE at 0 jumps to 4, which is in the middle of an EXTENDED_ARG prefixed instruction'
+    ]
+
+
+def test_stack_underflow():
+    code = make_code([('POP_TOP', 0), ('LOAD_CONST', 0), ('RETURN_VALUE', 0)], 1)
+    assert verify_code(opc38, code) == ['stack underflow at 0 (POP_TOP)']
+
+
+def test_inconsistent_join():
+    # one more value on the stack when jumping
+    code = make_code([('LOAD_CONST', 0), ('LOAD_CONST', 0), ('POP_JUMP_IF_FALSE', 8), ('POP_TOP', 0),
+                      ('RETURN_VALUE', 0)], 2)
+    assert verify_code(opc38, code) == [
+        'inconsistent stack at 8: depth 1 in 0 "finally" blocks, but depth 0 in 0 from 6'
+    ]
+
+
+def test_stacksize_too_small():
+    code = make_code([('LOAD_CONST', 0), ('LOAD_CONST', 0), ('BINARY_ADD', 0), ('RETURN_VALUE', 0)], 1)
+    assert verify_code(opc38, code) == ['co_stacksize is 1, but the stack can be 2 deep']
+
+
+def test_py39_opcode():
+    code = make_code([('LOAD_CONST', 0), ('RETURN_VALUE', 0)], 1)
+    # RERAISE of 3.9
+    code.co_code = bytes((48, 0)) + code.co_code
+    assert verify_code(opc38, code) == ['<48> at 0 is not a 3.8 instruction']
+
+
+def test_unpaired_end_finally():
+    code = make_code([('END_FINALLY', 0), ('LOAD_CONST', 0), ('RETURN_VALUE', 0)], 1)
+    assert verify_code(opc38, code) == ['END_FINALLY at 0 has no matching BEGIN_FINALLY or exception handler']
+
+
+def test_nested_codes_reported(monkeypatch):
+    monkeypatch.setattr('pyc39to38.verify.iscode', lambda const: isinstance(const, SimpleNamespace))
+    broken = make_code([('POP_TOP', 0)], 1)
+    broken.co_name = 'inner'
+    module = make_code([('LOAD_CONST', 0), ('RETURN_VALUE', 0)], 1)
+    module.co_consts = (None, broken)
+    assert verify_codes(opc38, module) == [('inner', ['stack underflow at 0 (POP_TOP)'])]
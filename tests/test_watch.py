@@ -0,0 +1,129 @@
+from json import loads
+from os import (
+    environ,
+    makedirs,
+    replace,
+    _exit
+)
+from os.path import (
+    join,
+    isfile,
+    basename
+)
+from signal import SIGTERM
+from subprocess import (
+    Popen,
+    PIPE
+)
+from sys import executable
+from time import (
+    monotonic,
+    sleep
+)
+
+from pyc39to38 import watch
+from pyc39to38.watch import (
+    watch_tree,
+    LatencyStats,
+    Stop
+)
+from pyc39to38.rules import do_39_to_38
+from pyc39to38.cfg import Config
+
+from .common import (
+    ROOT_DIR,
+    NOT_CODE_PYC,
+    read_sample
+)
+
+
+def wait_for(predicate, timeout: float = 30.0) -> bool:
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        if predicate():
+            return True
+        sleep(0.1)
+    return False
+
+
+def test_latency_stats():
+    stats = LatencyStats()
+    for i in range(100, 0, -1):
+        stats.add(float(i))
+    assert stats.percentile(0.5) == 51.0
+    assert stats.percentile(0.95) == 96.0
+    assert stats.percentile(1.0) == 100.0
+
+
+def test_latency_stats_window():
+    stats = LatencyStats(10)
+    for i in range(100, 0, -1):
+        stats.add(float(i))
+    # only the latest ones are kept for the percentiles
+    assert list(stats.latencies) == [float(i) for i in range(10, 0, -1)]
+    assert stats.percentile(1.0) == 10.0
+    assert (stats.converted, stats.max_latency) == (100, 100.0)
+
+
+def convert_or_exit(item, cfg, rule_applier):
+    """
+    run in the workers, kills the worker for the files named exit
+    """
+    input_path, output_path, _ = item
+    if basename(input_path) == 'exit.pyc':
+        _exit(3)
+    with open(output_path, 'wb') as fp:
+        fp.write(b'converted')
+    return {'ok': True}
+
+
+def test_watch_broken_pool(tmp_path, monkeypatch, caplog):
+    spool_root, output_root = tmp_path / 'spool', tmp_path / 'out'
+    spool_root.mkdir()
+    (spool_root / 'exit.pyc').write_bytes(b'exit')
+    monkeypatch.setattr(watch, 'convert_tree_file', convert_or_exit)
+    monkeypatch.setattr(watch, 'SETTLE_TIME', 0.2)
+    monkeypatch.setattr(watch, 'POLL_INTERVAL', 0.1)
+    find_pycs = watch.find_pycs
+    deadline = monotonic() + 30
+
+    def poll(root: str):
+        if (output_root / 'a.pyc').exists() or monotonic() > deadline:
+            raise Stop()
+        # the next file lands once the worker converting the first one died
+        if 'worker failed' in caplog.text and not (spool_root / 'a.pyc').exists():
+            (spool_root / 'a.pyc').write_bytes(b'a')
+        return find_pycs(root)
+
+    monkeypatch.setattr(watch, 'find_pycs', poll)
+    stats = watch_tree(str(spool_root), str(output_root), Config(), do_39_to_38, 1)
+    # the pool is started again for the next file
+    assert 'the worker pool is broken' in caplog.text
+    assert (stats.converted, stats.failed) == (1, 1)
+    assert (output_root / 'a.pyc').read_bytes() == b'converted'
+
+
+def test_watch(tmp_path, converted_sample):
+    spool_root, output_root, report_path = tmp_path / 'spool', tmp_path / 'out', tmp_path / 'report.jsonl'
+    spool_root.mkdir()
+    proc = Popen([executable, '-m', 'pyc39to38', '--watch', '--no-begin-finally', '-j', '1',
+                  '--report', str(report_path), str(spool_root), str(output_root)],
+                 stdout=PIPE, stderr=PIPE, env=dict(environ, PYTHONPATH=ROOT_DIR))
+    try:
+        # landing the way a producer should, renamed into place once written
+        makedirs(spool_root / 'pkg')
+        for rel_path, data in (('pkg/a.pyc', read_sample()), ('bad.pyc', NOT_CODE_PYC)):
+            (spool_root / 'tmp').write_bytes(data)
+            replace(spool_root / 'tmp', spool_root / rel_path)
+        assert wait_for(lambda: isfile(join(output_root, 'pkg/a.pyc')))
+        assert wait_for(lambda: report_path.exists() and len(report_path.read_text().splitlines()) == 2)
+    finally:
+        proc.send_signal(SIGTERM)
+        _, stderr = proc.communicate(timeout=30)
+    assert proc.returncode == 0, stderr.decode()
+    assert (output_root / 'pkg/a.pyc').read_bytes() == converted_sample
+    reports = {report['path']: report for report in map(loads, report_path.read_text().splitlines())}
+    assert reports['pkg/a.pyc']['ok'] and not reports['bad.pyc']['ok']
+    # it has to settle first
+    assert reports['pkg/a.pyc']['latency'] >= 1.0
+    assert b'1 files converted, 1 failed' in stderr
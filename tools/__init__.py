@@ -0,0 +1,3 @@
+"""
+development tools, not a part of the package
+"""
@@ -0,0 +1,351 @@
+"""
+algorithmic complexity checks
+
+synthetic 3.9 bytecode of growing sizes goes through each phase of the conversion, the steps run by each phase
+are counted and their growth exponent is fitted, a phase growing faster than its bound
+(e.g. an accidentally quadratic loop over the instructions) fails the check
+
+the steps are the calls and the lines of Python code traced, unlike the time taken they're the same
+from one run to another, so the fit needs no room for noise
+
+run from the root of the repository: python -m tools.complexity --help
+"""
+
+from argparse import (
+    ArgumentParser,
+    ArgumentTypeError
+)
+from io import BytesIO
+from logging import (
+    basicConfig,
+    getLogger,
+    INFO
+)
+from math import log
+from sys import (
+    argv,
+    gettrace,
+    settrace
+)
+from time import process_time
+from typing import (
+    Optional,
+    Callable,
+    Iterable,
+    Collection,
+    List,
+    Dict,
+    Tuple,
+    TypeVar,
+    Any
+)
+
+from xdis.codetype.code38 import Code38
+from xasm.assemble import Assembler
+
+from pyc39to38.load import load_pyc
+from pyc39to38.walk import (
+    prepare_patcher,
+    assemble_code
+)
+from pyc39to38.asm import write_pyc
+from pyc39to38.analyze import to_json_line
+from pyc39to38.rules import (
+    RULE_APPLIER,
+    do_39_to_38
+)
+from pyc39to38.cfg import Config
+from pyc39to38 import (
+    LOG_CFG,
+    FILE_ENCODING,
+    PY38_VER,
+    PY39_VER
+)
+
+from .synthetic import (
+    gen_pyc,
+    SHAPES,
+    NESTED_CODES,
+    FILE_NAME
+)
+
+
+logger = getLogger('complexity')
+
+T = TypeVar('T')
+
+# number of instructions of each input
+DEFAULT_SIZES = (1000, 2000, 4000)
+# the phases counted, in order
+PHASES = ('load', 'prepare', 'rules', 'emit', 'write')
+# the growth exponent allowed for a phase, i.e. the steps may grow as size ** exponent
+DEFAULT_MAX_EXPONENT = 1.2
+# the phases known to grow quadratically with the size of a single code object,
+# every insertion and removal of the patcher shifts the instructions and the labels after it,
+# they're reported as known issues instead of failing, as long as they don't grow faster than that
+KNOWN_ISSUES = ('prepare', 'rules', 'emit')
+# quadratic, with a little room for the share of the jumps needing EXTENDED_ARG growing in the small inputs
+KNOWN_ISSUE_MAX_EXPONENT = 2.1
+# a phase running fewer steps than this is too small to be fitted
+MIN_STEPS = 2000
+# don't start a size expected to take longer than this, in seconds
+DEFAULT_BUDGET = 60.0
+
+RESULT = Dict[str, Any]
+
+
+def count_steps(func: Callable[[], T]) -> Tuple[T, int]:
+    """
+    run a function and count the calls and the lines it runs
+
+    :param func: the function to run
+    :return: what it returns and the steps it took
+    """
+    steps = 0
+
+    def trace(frame, event, arg):
+        nonlocal steps
+        steps += 1
+        return trace
+
+    previous = gettrace()
+    settrace(trace)
+    try:
+        result = func()
+    finally:
+        settrace(previous)
+    return result, steps
+
+
+def count_phases(data: bytes, cfg: Config, rule_applier: RULE_APPLIER) -> Dict[str, int]:
+    """
+    convert a bytecode file phase by phase
+
+    :param data: content of the bytecode file
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :return: steps taken by each phase
+
+    :raises ValueError: if the conversion fails
+    """
+    steps = {}
+    pyc, steps['load'] = count_steps(lambda: load_pyc(FILE_NAME, PY39_VER, False, BytesIO(data)))
+    if pyc is None:
+        raise ValueError('failed to load')
+
+    # input code object, patcher, and the instructions whose line starts move to an EXTENDED_ARG
+    patchers, steps['prepare'] = count_steps(lambda: [
+        (code, *prepare_patcher(pyc.opc, code, label, backpatch_inst, cfg))
+        for code, label, backpatch_inst in pyc.iter_codes()
+    ])
+
+    def apply_rules():
+        for _, patcher, _ in patchers:
+            rule_applier(patcher, pyc.is_pypy, cfg)
+
+    _, steps['rules'] = count_steps(apply_rules)
+
+    new_asm = Assembler(PY38_VER, pyc.is_pypy)
+
+    def emit() -> Code38:
+        # the children come first, like in walk_codes
+        methods: Dict[int, Code38] = {}
+        for code_idx, (code, patcher, shift_on_add_extarg) in enumerate(patchers):
+            co = assemble_code(pyc.opc, new_asm.opc, patcher, shift_on_add_extarg, methods, code_idx, cfg)
+            if co is None:
+                raise ValueError(f'failed to assemble code #{code_idx}')
+            methods[id(code)] = co
+        # the module is the last one
+        return co
+
+    module, steps['emit'] = count_steps(emit)
+    new_asm.code_list.append(module)
+
+    def write():
+        with BytesIO() as fp:
+            if not write_pyc(fp, new_asm, pyc.timestamp):
+                raise ValueError('failed to write')
+
+    _, steps['write'] = count_steps(write)
+    return steps
+
+
+def fit_exponent(points: Iterable[Tuple[int, float]]) -> Optional[float]:
+    """
+    fit steps = c * size ** exponent with least squares in log-log scale
+
+    :param points: size and steps
+    :return: the exponent, None if less than two points are large enough to be fitted
+    """
+    points = [(log(size), log(steps)) for size, steps in points if steps >= MIN_STEPS]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var_x:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+
+
+def check_shape(shape: str, sizes: Iterable[int], cfg: Config, rule_applier: RULE_APPLIER,
+                bounds: Dict[str, float], known_issues: Collection[str] = KNOWN_ISSUES,
+                budget: float = DEFAULT_BUDGET) -> Tuple[List[RESULT], List[RESULT]]:
+    """
+    count the steps of the phases on the inputs of one shape at growing sizes and fit their growth exponents
+
+    a size is skipped if it's expected to take longer than the budget from the growth so far,
+    and the check fails if less than two sizes are left
+
+    :param shape: one of SHAPES, or NESTED_CODES
+    :param sizes: about how many instructions of each input
+    :param cfg: config options
+    :param rule_applier: rule applier
+    :param bounds: the growth exponent allowed for each phase
+    :param known_issues: the phases reported as known issues above their bounds, up to KNOWN_ISSUE_MAX_EXPONENT
+    :param budget: don't start a size expected to take longer than this many seconds
+    :return: the steps of each size and the fitted exponent of each phase
+    """
+    counts: List[RESULT] = []
+    error = None
+    for size in sorted(sizes):
+        data, count = gen_pyc(shape, size)
+        if counts:
+            last = counts[-1]
+            # assume the worst of quadratic and the growth so far
+            exponent = max([2.0] + [e for phase in PHASES
+                                    if (e := fit_exponent((c['instructions'], c[phase]) for c in counts))])
+            expected = last['seconds'] * (count / last['instructions']) ** exponent
+            if expected > budget:
+                logger.warning(f'{shape}: skipping {count} instructions, expected to take {expected:.0f}s')
+                break
+        start = process_time()
+        try:
+            steps = count_phases(data, cfg, rule_applier)
+        except (ValueError, TypeError, ImportError, RecursionError) as e:
+            error = f'failed to convert {count} instructions: {type(e).__name__}: {e}'
+            logger.error(f'{shape}: {error}')
+            break
+        counts.append({'shape': shape, 'size': size, 'instructions': count, 'seconds': process_time() - start,
+                       **steps})
+        logger.info(f'{shape}: {count} instructions, ' + ', '.join(f'{phase} {steps[phase]}' for phase in PHASES))
+    if error is None and len(counts) < 2:
+        # nothing to fit, and the growth is already too fast for the budget
+        error = f'only {len(counts)} of the sizes fit in the budget'
+
+    exponents: List[RESULT] = []
+    for phase in PHASES:
+        exponent = fit_exponent((c['instructions'], c[phase]) for c in counts)
+        bound = bounds.get(phase, DEFAULT_MAX_EXPONENT)
+        ok = error is None and (exponent is None or exponent <= bound)
+        exponents.append({
+            'shape': shape,
+            'phase': phase,
+            'exponent': exponent,
+            'bound': bound,
+            'ok': ok,
+            # above its bound, but no worse than it's known to be
+            'known_issue': (error is None and not ok and phase in known_issues
+                            and exponent <= KNOWN_ISSUE_MAX_EXPONENT),
+            'error': error
+        })
+    return counts, exponents
+
+
+def log_exponents(exponents: Iterable[RESULT]):
+    """
+    log the fitted exponents in a human-readable way
+    """
+    for result in exponents:
+        name = f'{result["shape"]}/{result["phase"]}'
+        if result['error'] is not None:
+            logger.error(f'{name}: {result["error"]}')
+        elif result['exponent'] is None:
+            logger.info(f'{name}: too few steps to measure')
+        elif result['ok']:
+            logger.info(f'{name}: exponent {result["exponent"]:.2f} (bound {result["bound"]:.2f})')
+        elif result['known_issue']:
+            logger.warning(f'{name}: exponent {result["exponent"]:.2f} is above the bound {result["bound"]:.2f}, '
+                           f'known issue')
+        else:
+            logger.error(f'{name}: exponent {result["exponent"]:.2f} is above the bound {result["bound"]:.2f}')
+
+
+def bound_arg(val: str) -> Tuple[str, float]:
+    """
+    parse a PHASE=EXPONENT argument
+    """
+    phase, sep, exponent = val.partition('=')
+    if not sep:
+        raise ArgumentTypeError(f'expected PHASE=EXPONENT, got {val!r}')
+    try:
+        return phase, float(exponent)
+    except ValueError:
+        raise ArgumentTypeError(f'invalid exponent {exponent!r}')
+
+
+def main(check_argv: List[str]):
+    """
+    check how the steps of each phase grow with the size of the input
+    """
+    shapes = list(SHAPES) + [NESTED_CODES]
+    parser = ArgumentParser(prog='python -m tools.complexity',
+                            description='Convert synthetic inputs of growing sizes and fail if the steps run '
+                                        'by a phase grow faster than allowed')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='about how many instructions of each input (default: %s)'
+                             % ' '.join(map(str, DEFAULT_SIZES)))
+    parser.add_argument('--shape', type=str, action='append', choices=shapes, dest='shapes',
+                        help='only check the inputs of this shape, can be given more than once (default: all)')
+    parser.add_argument('--max-exponent', type=float, default=DEFAULT_MAX_EXPONENT,
+                        help='the growth exponent allowed for every phase (default: %s), the known quadratic ones '
+                             '(%s) are reported as known issues above it, up to %s'
+                             % (DEFAULT_MAX_EXPONENT, ', '.join(KNOWN_ISSUES), KNOWN_ISSUE_MAX_EXPONENT))
+    parser.add_argument('--bound', type=bound_arg, action='append', default=[], metavar='PHASE=EXPONENT',
+                        help='the growth exponent allowed for a phase, one of %s, can be given more than once, '
+                             'a known issue given here fails above it' % ', '.join(PHASES))
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                        help='skip the sizes expected to take longer than this many seconds (default: %s)'
+                             % DEFAULT_BUDGET)
+    parser.add_argument('--no-begin-finally', action='store_true',
+                        help='check without the BEGIN_FINALLY rule')
+    parser.add_argument('--report', type=str, help='write the steps and the exponents to this JSONL file')
+    check_args = parser.parse_args(check_argv)
+
+    basicConfig(level=INFO, format=LOG_CFG)
+    bounds = dict.fromkeys(PHASES, check_args.max_exponent)
+    known_issues = set(KNOWN_ISSUES)
+    for phase, exponent in check_args.bound:
+        if phase not in bounds:
+            parser.error(f'unknown phase {phase!r}')
+        bounds[phase] = exponent
+        known_issues.discard(phase)
+    cfg = Config()
+    cfg.no_begin_finally = check_args.no_begin_finally
+
+    failed = known = 0
+    report_fp = open(check_args.report, 'w', encoding=FILE_ENCODING) if check_args.report else None
+    try:
+        for shape in check_args.shapes or shapes:
+            counts, exponents = check_shape(shape, check_args.sizes, cfg, do_39_to_38, bounds, known_issues,
+                                            check_args.budget)
+            log_exponents(exponents)
+            failed += sum(1 for result in exponents if not result['ok'] and not result['known_issue'])
+            known += sum(1 for result in exponents if result['known_issue'])
+            if report_fp is not None:
+                for result in counts + exponents:
+                    report_fp.write(to_json_line(result))
+    finally:
+        if report_fp is not None:
+            report_fp.close()
+
+    if known:
+        logger.warning(f'{known} phase checks are known issues')
+    if failed:
+        logger.fatal(f'{failed} phase checks failed')
+        exit(1)
+    logger.info('done')
+
+
+if __name__ == '__main__':
+    main(argv[1:])
@@ -0,0 +1,307 @@
+"""
+synthetic 3.9 bytecode of a given shape and size, for the complexity checks and the tests
+
+the instructions are laid out from the shapes directly, with the EXTENDED_ARG they need,
+so that an input of any size is there without compiling any source
+"""
+
+from io import BytesIO
+from types import ModuleType
+from typing import (
+    Optional,
+    Callable,
+    Union,
+    List,
+    Dict,
+    Tuple,
+    Any
+)
+
+from xdis.disasm import get_opcode
+from xdis.codetype.code38 import Code38
+from xasm.write_pyc import write_pycfile
+
+from pyc39to38.emit import (
+    EXTENDED_ARG,
+    INST_SIZE,
+    ARG_BITS,
+    ARG_MASK
+)
+from pyc39to38.utils import genlinestarts
+from pyc39to38 import PY39_VER
+
+
+# CO_MAXBLOCKS of CPython, the try blocks can't be nested deeper than this
+MAX_BLOCKS = 20
+CO_OPTIMIZED = 0x1
+CO_NEWLOCALS = 0x2
+FILE_NAME = '<synthetic>'
+# the label all the jumps of gen_jumps go to
+JUMPS_END = 'jumps_end'
+
+
+class SyntheticCode:
+    """
+    a code object being generated, the jump targets are labels, resolved when built
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # opname, arg (label name for jumps), line number
+        self.ops: List[Tuple[str, Union[int, str, None], int]] = []
+        # label name to index of the instruction
+        self.labels: Dict[str, int] = {}
+        # None is always the first one
+        self.consts: List[Any] = [None]
+        self.line = 1
+        self.label_count = 0
+
+    def op(self, opname: str, arg: Union[int, str, None] = None, line: Optional[int] = None):
+        self.ops.append((opname, arg, self.line if line is None else line))
+
+    def label(self, prefix: str) -> str:
+        """
+        get a new label name, place it with place()
+        """
+        self.label_count += 1
+        return f'{prefix}{self.label_count}'
+
+    def place(self, name: str):
+        self.labels[name] = len(self.ops)
+
+    def next_line(self) -> int:
+        self.line += 1
+        return self.line
+
+    def const(self, val: Any) -> int:
+        self.consts.append(val)
+        return len(self.consts) - 1
+
+    def build(self, opc: ModuleType, flags: int) -> Code38:
+        """
+        lay out the instructions with the EXTENDED_ARG they need and make the code object
+
+        :param opc: opcode map (it's a module ig)
+        :param flags: co_flags
+        :return: the code object
+        """
+        self.op('LOAD_CONST', 0)
+        self.op('RETURN_VALUE')
+        # words taken by each instruction including its EXTENDED_ARG, only grows until stable
+        words = [1] * len(self.ops)
+        while True:
+            offsets = []
+            offset = 0
+            for size in words:
+                offsets.append(offset)
+                offset += size * INST_SIZE
+            args = []
+            stable = True
+            for i, (opname, arg, _) in enumerate(self.ops):
+                if isinstance(arg, str):
+                    target = offsets[self.labels[arg]]
+                    if opc.opmap[opname] in opc.JREL_OPS:
+                        arg = target - offsets[i] - words[i] * INST_SIZE
+                    else:
+                        arg = target
+                args.append(arg or 0)
+                need = 1
+                while arg is not None and arg >> (ARG_BITS * need):
+                    need += 1
+                if need > words[i]:
+                    words[i] = need
+                    stable = False
+            if stable:
+                break
+
+        co_code = bytearray()
+        lnotab: Dict[int, int] = {}
+        last_line = None
+        for (opname, _, line), arg, size, offset in zip(self.ops, args, words, offsets):
+            for shift in range(size - 1, 0, -1):
+                co_code += bytes((opc.opmap[EXTENDED_ARG], (arg >> (ARG_BITS * shift)) & ARG_MASK))
+            co_code += bytes((opc.opmap[opname], arg & ARG_MASK))
+            if line != last_line:
+                lnotab[offset] = last_line = line
+        code = Code38(0, 0, 0, 2, 8, flags, bytes(co_code), tuple(self.consts), ('E',), ('a', 'b'), FILE_NAME,
+                      self.name, 1, lnotab, (), ())
+        code.co_lnotab = genlinestarts(code)
+        return code
+
+
+def gen_except(code: SyntheticCode):
+    """
+    try: a
+    except E: pass
+    (the exception match and the re-raise are rewritten)
+    """
+    handler, reraise, end = code.label('h'), code.label('r'), code.label('e')
+    code.next_line()
+    code.op('SETUP_FINALLY', handler)
+    code.op('LOAD_FAST', 0)
+    code.op('POP_TOP')
+    code.op('POP_BLOCK')
+    code.op('JUMP_FORWARD', end)
+    code.place(handler)
+    code.next_line()
+    code.op('DUP_TOP')
+    code.op('LOAD_GLOBAL', 0)
+    code.op('JUMP_IF_NOT_EXC_MATCH', reraise)
+    for _ in range(3):
+        code.op('POP_TOP')
+    code.op('POP_EXCEPT')
+    code.op('JUMP_FORWARD', end)
+    code.place(reraise)
+    code.op('RERAISE')
+    code.place(end)
+
+
+def gen_list(code: SyntheticCode):
+    """
+    [k, k + 1]
+    (a list of constants is built from a tuple in 3.9)
+    """
+    # all the tuples need EXTENDED_ARG, so their share doesn't change with the size
+    while len(code.consts) <= ARG_MASK:
+        code.const(len(code.consts))
+    code.next_line()
+    code.op('BUILD_LIST', 0)
+    code.op('LOAD_CONST', code.const((len(code.consts), len(code.consts) + 1)))
+    code.op('LIST_EXTEND', 1)
+    code.op('POP_TOP')
+
+
+def gen_finally(code: SyntheticCode, depth: int = 1):
+    """
+    try: a
+    finally: b
+    (nested in the try body depth times)
+    """
+    handler, end = code.label('h'), code.label('e')
+    code.next_line()
+    code.op('SETUP_FINALLY', handler)
+    if depth > 1:
+        gen_finally(code, depth - 1)
+    else:
+        code.next_line()
+        code.op('LOAD_FAST', 0)
+        code.op('POP_TOP')
+    code.op('POP_BLOCK')
+    # the finally body is in there twice, with the same line number
+    line = code.next_line()
+    code.op('LOAD_FAST', 1)
+    code.op('POP_TOP')
+    code.op('JUMP_FORWARD', end)
+    code.place(handler)
+    code.op('LOAD_FAST', 1, line)
+    code.op('POP_TOP', None, line)
+    code.op('RERAISE', None, line)
+    code.place(end)
+
+
+def gen_nested_finally(code: SyntheticCode):
+    gen_finally(code, MAX_BLOCKS)
+
+
+def gen_jumps(code: SyntheticCode):
+    """
+    if a: b
+    (the jumps are absolute and all go to the end of the code, so their share needing EXTENDED_ARG
+    doesn't change with the size)
+    """
+    code.next_line()
+    code.op('LOAD_FAST', 0)
+    code.op('POP_JUMP_IF_FALSE', JUMPS_END)
+    code.op('LOAD_FAST', 1)
+    code.op('POP_TOP')
+    # placed again after every statement, so that it ends up at the end
+    code.place(JUMPS_END)
+
+
+# the shapes of the inputs, each generator adds one statement
+SHAPES: Dict[str, Callable[[SyntheticCode], None]] = {
+    'except': gen_except,
+    'list': gen_list,
+    'finally': gen_finally,
+    'nested_finally': gen_nested_finally,
+    'jumps': gen_jumps
+}
+# chains of functions defined in each other, more of them with the size
+NESTED_CODES = 'nested_codes'
+# instructions of each function in a chain
+NESTED_CODE_SIZE = 32
+# the tokenizer of CPython allows 100 levels of indentation, so a chain is at most this deep
+MAX_NESTING = 99
+
+
+def gen_def(code: SyntheticCode, child: Code38):
+    """
+    def f(): ...
+    """
+    code.next_line()
+    code.op('LOAD_CONST', code.const(child))
+    code.op('LOAD_CONST', code.const(child.co_name))
+    code.op('MAKE_FUNCTION', 0)
+    code.op('STORE_FAST', 0)
+
+
+def gen_chain(opc: ModuleType, depth: int, prefix: str) -> Tuple[Code38, int]:
+    """
+    generate a chain of functions defined in each other
+
+    :param opc: opcode map (it's a module ig)
+    :param depth: how many functions
+    :param prefix: prefix of the names of the functions
+    :return: the outermost function and the number of instructions in the chain
+    """
+    # from the innermost one
+    child: Optional[Code38] = None
+    count = 0
+    for level in range(depth, 0, -1):
+        code = SyntheticCode(f'{prefix}_{level}')
+        while len(code.ops) < NESTED_CODE_SIZE - 6:
+            gen_jumps(code)
+        if child is not None:
+            gen_def(code, child)
+        child = code.build(opc, CO_OPTIMIZED | CO_NEWLOCALS)
+        count += len(code.ops)
+    return child, count
+
+
+def gen_module(opc: ModuleType, shape: str, size: int) -> Tuple[Code38, int]:
+    """
+    generate the module code object of a synthetic input
+
+    :param opc: opcode map (it's a module ig)
+    :param shape: one of SHAPES, or NESTED_CODES
+    :param size: about how many instructions
+    :return: the module code object and the number of instructions in it and its children
+    """
+    code = SyntheticCode('<module>')
+    if shape != NESTED_CODES:
+        while len(code.ops) < size:
+            SHAPES[shape](code)
+        return code.build(opc, 0), len(code.ops)
+
+    count = 0
+    while count < size:
+        depth = min(max((size - count) // NESTED_CODE_SIZE, 1), MAX_NESTING)
+        chain, chain_count = gen_chain(opc, depth, f'f{len(code.consts)}')
+        gen_def(code, chain)
+        count += chain_count
+    co = code.build(opc, 0)
+    return co, count + len(code.ops)
+
+
+def gen_pyc(shape: str, size: int) -> Tuple[bytes, int]:
+    """
+    generate a synthetic 3.9 bytecode file
+
+    :param shape: one of SHAPES, or NESTED_CODES
+    :param size: about how many instructions
+    :return: content of the file and the number of instructions in it
+    """
+    co, count = gen_module(get_opcode(PY39_VER, False), shape, size)
+    with BytesIO() as fp:
+        write_pycfile(fp, [co], 0, PY39_VER)
+        return fp.getvalue(), count